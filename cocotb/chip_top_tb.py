@@ -8,24 +8,41 @@ from pathlib import Path
 
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import Timer, Edge, RisingEdge, FallingEdge, ClockCycles
-from cocotb_tools.runner import get_runner
+from cocotb.triggers import Timer, Edge, RisingEdge, FallingEdge, ClockCycles, ReadOnly
+from cocotb.utils import get_sim_time
+from cocotb_tools.runner import get_runner, get_results
 
 sim = os.getenv("SIM", "icarus")
 pdk_root = os.getenv("PDK_ROOT", Path("~/.ciel").expanduser())
 pdk = os.getenv("PDK", "gf180mcuD")
 scl = os.getenv("SCL", "gf180mcu_fd_sc_mcu7t5v0")
 gl = os.getenv("GL", False)
+backdoor = os.getenv("BACKDOOR", False)
+trace = os.getenv("TRACE", False)
+throughput = os.getenv("THROUGHPUT", False)
+shards = int(os.getenv("SHARDS", 0))
+shard = os.getenv("SHARD", "0/1") # set by the sharded runner: <index>/<count>
+results_file = os.getenv("RESULTS_FILE", None)
 slot = os.getenv("SLOT", "1x1")
 
 hdl_toplevel = "chip_top"
 
 
 #########################################################################################################################
+import io
+import sys
+import json
+import contextlib
 import numpy as np
+from multiprocessing import Pool
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from npz_to_verilog import load_npz_file, build_network, emitted_wires, category_settings
+from npz_eval import expected_categories, expected_results, eval_levels, expand_emitted, first_divergence, print_divergence
 
 WRITE_ENABLE  = 0
 WRITE_DISABLE = 256
+COMMIT        = 512 # latches the input buffer when net.v is generated with DOUBLE_BUFFER_INPUTS, ignored otherwise
 
 # gates_value = os.getenv('GATES')
 GATE_LEVEL_SIMULATION = not gl in (False, 0, None, "no")
@@ -38,6 +55,17 @@ CLEAR_WITH_ALTERNATING_PATTERN = True
 
 SEVEN_SEGMENT = True
 
+# RTL only: writes test samples straight into the 'x' register of lgn instead of shifting them
+# through input_PAD, which makes running the whole test dataset tractable
+BACKDOOR_INPUT_LOAD = not backdoor in (False, 0, None, "no")
+
+# RTL only: samples every layer of the net and compares it with the evaluation of the network
+# as npz_to_verilog() generates it with the current settings, so net.v has to be generated with them
+TRACE_LAYERS = not trace in (False, 0, None, "no")
+
+# RTL only: streams frames back-to-back through input_PAD and reports frames per second
+MEASURE_THROUGHPUT = not throughput in (False, 0, None, "no")
+
 
 X = \
 [[0] * 256,
@@ -48,6 +76,8 @@ Y = "../src/20251204-084921_binTestAcc8873_seed190838_epochs100_2x12000_b256_lr5
 INPUT_SIZE_IN_BITS = 16 * 16 * 4
 
 NUMBER_OF_TESTS_SAMPLES_TO_RUN = 4 # run 4 test samples
+NUMBER_OF_FRAMES_TO_STREAM = 16   # back-to-back frames for the throughput test
+NUMBER_OF_SAMPLES_TO_TRACE = 16   # samples compared layer by layer with the reference evaluation
 ###############################################################################
 
 def split_array(lst, chunk_size=8):
@@ -86,10 +116,10 @@ def assert_output(dut, y):
         assert str(dut.i_chip_core.lgn.y.value)[::-1].startswith(array_to_bin(y))
         print(str(dut.i_chip_core.lgn.y.value))
 
-    categories = np.sum(y.reshape(10, -1), -1)
-    print(categories)
+    # categories are wired, summed and truncated like net.v and lgn.v do with the current settings
+    categories, values = expected_results(np.asarray(y)[None])
 
-    expected = len(categories) - 1 - np.argmax(categories[::-1])
+    expected = int(categories[0])
     if SEVEN_SEGMENT:
         computed = seven_segment_inverse(dut.bidir_PAD.value.to_unsigned() & 127)
     else:
@@ -99,7 +129,7 @@ def assert_output(dut, y):
 
     assert expected == computed
 
-    expected = int(categories[expected]) // 2
+    expected = int(values[0])
     computed = (dut.bidir_PAD.value.to_unsigned() >> 8) & 255
     dut._log.info(f"Expected value: {expected}")
     dut._log.info(f"Computed value: {computed}")
@@ -140,15 +170,43 @@ async def start_up(dut):
     await start_clock(dut.clk_PAD)
     await reset(dut.rst_n_PAD)
 
-@cocotb.test()
-async def test_lgn(dut):
-    global X, Y
+network = None
+def load_dataset():
+    global X, Y, network
     if isinstance(Y, str):
-        data = np.load("../" + Y)
-        X = data["input"]
-        Y = data["output"]
+        network = load_npz_file("../" + Y) # memory-mapped, samples are paged in only when used
+        X = network["input"]
+        Y = network["output"]
         print("Test dataset: ", X.shape, Y.shape)
 
+def read_pipeline_latency(net_file=Path(__file__).resolve().parent / "../src/net.v"):
+    # Clock cycles from the register the inputs are written into ('x' or 'x_shadow') to the net outputs
+    # and to the category outputs, see PIPELINE_EVERY_N_LAYERS, PIPELINE_POPCOUNT and DOUBLE_BUFFER_INPUTS
+    # in npz_to_verilog.py. Double buffered inputs add the commit and the result registers.
+    net_latency, popcount_latency, double_buffered = 0, 0, False
+    if os.path.exists(net_file):
+        with open(net_file) as f:
+            for line in f:
+                if line.startswith("`define NET_LATENCY"):
+                    net_latency = int(line.split()[2])
+                elif line.startswith("`define PIPELINE_POPCOUNT"):
+                    popcount_latency = 1
+                elif line.startswith("`define DOUBLE_BUFFER_INPUTS"):
+                    double_buffered = True
+                elif line.startswith("module"):
+                    break
+    net_latency += double_buffered
+    return net_latency, net_latency + popcount_latency + double_buffered, double_buffered
+
+NET_LATENCY, LATENCY, DOUBLE_BUFFERED = read_pipeline_latency()
+
+def bits_to_int(bits):
+    # bit i of the array becomes bit i of the integer, same order as in[i] and out[i] of the net
+    return int.from_bytes(np.packbits(np.asarray(bits) != 0, bitorder='little').tobytes(), 'little')
+
+@cocotb.test()
+async def test_lgn(dut):
+    load_dataset()
 
     # Create a logger for this testbench
     logger = logging.getLogger("my_testbench")
@@ -190,17 +248,16 @@ async def test_lgn(dut):
             alt = 1-alt if CLEAR_WITH_ALTERNATING_PATTERN else alt
 
         logger.info(f"Set input buffer, {len(x)} bits")
-        i = 0
-        for block_of_8 in split_array(x, 8):
+        blocks = split_array(x, 8)
+        for i, block_of_8 in enumerate(blocks):
             print(array_to_bin(block_of_8), end="")
             if i % 2 == 1:
                 print(f" best index: {category_index()} value: {category_value()}")
-            dut.input_PAD.value = int(array_to_bin(block_of_8), 2) | WRITE_ENABLE
+            dut.input_PAD.value = int(array_to_bin(block_of_8), 2) | WRITE_ENABLE | (COMMIT if i == len(blocks) - 1 else 0)
             await ClockCycles(dut.clk_PAD, 1)
-            i += 1
 
         dut.input_PAD.value = 0 | WRITE_DISABLE
-        for _ in range(10):
+        for _ in range(10 + LATENCY):
             await ClockCycles(dut.clk_PAD, 1)
             print(category_index(), category_value())
         
@@ -212,8 +269,163 @@ async def test_lgn(dut):
 
     logger.info("Done!")
 
+@cocotb.test(skip=GATE_LEVEL_SIMULATION or not BACKDOOR_INPUT_LOAD)
+async def test_lgn_dataset(dut):
+    load_dataset()
+    if X.ndim != 2 or X.shape[-1] != INPUT_SIZE_IN_BITS:
+        dut._log.info(f"No test dataset included, 'input' shape: {X.shape}")
+        return
 
-def chip_top_runner():
+    await start_up(dut)
+    dut.input_PAD.value = 0 | WRITE_DISABLE | COMMIT # double buffered inputs are committed every cycle
+    await ClockCycles(dut.clk_PAD, 1)
+
+    lgn = dut.i_chip_core.lgn
+    inputs = lgn.x_shadow if DOUBLE_BUFFERED else lgn.x
+    expected = expected_categories(Y)
+    compare_outputs = Y.shape[-1] != category_settings()[0] # dataset might contain already summed categories
+    output_mask = (1 << Y.shape[-1]) - 1
+    confusion = np.zeros((10, 10), dtype=np.int64)
+    mismatches = []
+    shard_index, shard_count = map(int, shard.split("/"))
+    samples = np.array_split(np.arange(len(X)), shard_count)[shard_index]
+    # A new sample every clock cycle, results come out LATENCY cycles later when pipelined
+    for step in range(len(samples) + LATENCY):
+        await RisingEdge(dut.clk_PAD)
+        if step < len(samples):
+            inputs.value = bits_to_int(X[samples[step]])
+        await ReadOnly()
+
+        if compare_outputs and NET_LATENCY <= step < len(samples) + NET_LATENCY:
+            n = int(samples[step - NET_LATENCY])
+            if (lgn.y.value.to_unsigned() & output_mask) != bits_to_int(Y[n]):
+                mismatches.append(n)
+
+        if step >= LATENCY:
+            n = int(samples[step - LATENCY])
+            out = dut.bidir_PAD.value.to_unsigned()
+            computed = seven_segment_inverse(out & 127) if SEVEN_SEGMENT else out & 15
+            if computed is None or computed > 9:
+                mismatches.append(n)
+                continue
+            confusion[expected[n], computed] += 1
+    mismatches = sorted(set(mismatches))
+
+    if results_file is not None:
+        with open(results_file, "w") as f:
+            json.dump({"samples": len(samples), "confusion": confusion.tolist(), "mismatches": mismatches}, f)
+    print_dataset_report(len(samples), confusion, mismatches)
+
+    assert not mismatches
+
+@cocotb.test(skip=GATE_LEVEL_SIMULATION or not MEASURE_THROUGHPUT)
+async def test_lgn_throughput(dut):
+    # Streams frames back-to-back through input_PAD and measures frames per second at the simulated clock.
+    # With DOUBLE_BUFFER_INPUTS the next frame is shifted in while the result of the previous one is computed,
+    # otherwise every frame waits for its result with write disabled.
+    load_dataset()
+    if np.ndim(X) == 2 and np.shape(X)[-1] == INPUT_SIZE_IN_BITS:
+        frames = np.asarray(X[:NUMBER_OF_FRAMES_TO_STREAM])
+        expected = expected_categories(Y[:len(frames)])
+    else:
+        frames = np.random.default_rng(0).integers(0, 2, size=(NUMBER_OF_FRAMES_TO_STREAM, INPUT_SIZE_IN_BITS))
+        expected = None
+
+    stream = []
+    for frame in frames:
+        blocks = [int(array_to_bin(block_of_8), 2) for block_of_8 in split_array(frame[::-1], 8)]
+        stream += [block | WRITE_ENABLE for block in blocks[:-1]] + [blocks[-1] | WRITE_ENABLE | COMMIT]
+        if not DOUBLE_BUFFERED:
+            stream += [0 | WRITE_DISABLE] * (LATENCY + 1)
+
+    await start_up(dut)
+    dut.input_PAD.value = 0 | WRITE_DISABLE
+    await ClockCycles(dut.clk_PAD, 10)
+
+    results, was_valid = [], False
+    start = get_sim_time("ns")
+    for cycles in range(1, len(stream) + LATENCY + 4):
+        await FallingEdge(dut.clk_PAD)
+        dut.input_PAD.value = stream[cycles - 1] if cycles <= len(stream) else 0 | WRITE_DISABLE
+        await RisingEdge(dut.clk_PAD)
+        await ReadOnly()
+        out = dut.bidir_PAD.value
+        valid = out.is_resolvable and (out.to_unsigned() >> 7) & 1 == 1 # result is latched on the rising edge of valid
+        if valid and not was_valid:
+            results.append(seven_segment_inverse(out.to_unsigned() & 127) if SEVEN_SEGMENT else out.to_unsigned() & 15)
+            if len(results) == len(frames):
+                break
+        was_valid = valid
+    elapsed = (get_sim_time("ns") - start) * 1e-9
+
+    clock = cycles / elapsed
+    print(f"{'Double buffered' if DOUBLE_BUFFERED else 'Single buffered'} inputs, latency: {LATENCY} cycle(s)")
+    print(f"Streamed {len(frames)} frames in {cycles} cycles: {cycles / len(frames):.1f} cycles per frame")
+    print(f"Throughput: {len(frames) / elapsed:.0f} frames/s at {clock / 1e6:.1f} MHz, "
+          f"pad bandwidth limit: {clock / (INPUT_SIZE_IN_BITS // 8):.0f} frames/s")
+
+    assert len(results) == len(frames)
+    if expected is not None:
+        assert results == expected.tolist()
+
+
+def read_bits(handle):
+    # bit i of the Verilog vector becomes element i of the array, X/Z bits become 2
+    bits = np.frombuffer(str(handle.value)[::-1].encode(), dtype=np.uint8)
+    return np.where(bits == ord("1"), 1, np.where(bits == ord("0"), 0, 2)).astype(np.uint8)
+
+@cocotb.test(skip=GATE_LEVEL_SIMULATION or not TRACE_LAYERS)
+async def test_lgn_trace(dut):
+    # Samples every layer of the net for a batch of inputs and compares them with the bit-level evaluation
+    # of the network as npz_to_verilog() generates it (current settings), reports the first divergent gate
+    load_dataset()
+    if np.ndim(X) == 2 and np.shape(X)[-1] == INPUT_SIZE_IN_BITS:
+        samples = np.asarray(X[:NUMBER_OF_SAMPLES_TO_TRACE])
+    else:
+        samples = np.random.default_rng(0).integers(0, 2, size=(NUMBER_OF_SAMPLES_TO_TRACE, INPUT_SIZE_IN_BITS))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        global_inputs, gates, conn_a, conn_b = build_network(network)
+    expected = eval_levels(samples, gates, conn_a, conn_b)
+    emitted = emitted_wires(global_inputs, gates, conn_a, conn_b) # collapsed buffers have no wire in net.v
+
+    await start_up(dut)
+    lgn = dut.i_chip_core.lgn
+    inputs = lgn.x_shadow if DOUBLE_BUFFERED else lgn.x
+    wires = [lgn.x] + [getattr(lgn.net, f"layer_{l}") for l in range(len(gates) - 1)] + [lgn.net.out]
+    simulated = [np.zeros((len(samples), len(expected[0][0])), dtype=np.uint8)] + \
+                [np.zeros((len(samples), np.count_nonzero(mask)), dtype=np.uint8) for mask in emitted[1:]]
+    for n, sample in enumerate(samples):
+        await FallingEdge(dut.clk_PAD)
+        dut.input_PAD.value = 0 | WRITE_DISABLE | COMMIT
+        inputs.value = bits_to_int(sample)
+        await ClockCycles(dut.clk_PAD, NET_LATENCY + 1) # all pipeline stages hold the same sample
+        await ReadOnly()
+        for level, wire in enumerate(wires):
+            bits = read_bits(wire)
+            assert len(bits) == simulated[level].shape[-1], \
+                f"Level {level} has {len(bits)} simulated nets, {simulated[level].shape[-1]} expected: net.v is generated from a different network or settings"
+            simulated[level][n] = bits
+
+    simulated = expand_emitted(simulated, emitted, gates, conn_a, conn_b)
+    divergence = first_divergence(expected, simulated, gates, conn_a, conn_b)
+    print(f"Traced {len(samples)} samples through {len(wires)} levels")
+    print_divergence(divergence)
+    assert divergence is None
+
+
+def print_dataset_report(samples, confusion, mismatches):
+    correct = np.trace(confusion)
+    print(f"Samples: {samples}, top-1 accuracy: {correct / max(samples, 1) * 100:.2f}% ({correct}/{samples})")
+    print("Confusion matrix (rows: expected, columns: computed):")
+    print("   ", " ".join(f"{i:5}" for i in range(10)))
+    for i in range(10):
+        print(f"{i:3} ", " ".join(f"{c:5}" for c in confusion[i]))
+    if mismatches:
+        print(f"Samples that do not match the dataset output: {len(mismatches)}, first: {mismatches[:16]}")
+
+
+def chip_top_runner(always=True):
     proj_path = Path(__file__).resolve().parent
 
     sources = []
@@ -230,10 +442,11 @@ def chip_top_runner():
 
         defines = {"FUNCTIONAL": True, "USE_POWER_PINS": True}
     else:
+        defines["SIM"] = True # behavioral adders instead of the standard cells, see USE_HA_FA_CELLS
         sources.append(proj_path / "../src/chip_top.sv")
         sources.append(proj_path / "../src/chip_core.sv")
+        sources.append(proj_path / "../src/net.v") # defines pipeline settings for lgn.v
         sources.append(proj_path / "../src/lgn.v")
-        sources.append(proj_path / "../src/net.v")
 
     sources += [
         # IO pad models
@@ -263,12 +476,14 @@ def chip_top_runner():
         sources=sources,
         hdl_toplevel=hdl_toplevel,
         defines=defines,
-        always=True,
+        always=always,
         includes=includes,
         build_args=build_args,
         waves=True,
     )
+    return runner
 
+def chip_top_test(runner):
     plusargs = []
 
     runner.test(
@@ -278,6 +493,63 @@ def chip_top_runner():
         waves=True,
     )
 
+#--- Sharded runner -----------------------------------------------------------------------
+#
+# SHARDS=<n> builds the simulation once and runs the dataset test (with backdoor input load)
+# as n simulator processes in parallel, each on its own slice of the test dataset.
+# Results of the shards are merged into a single report.
+
+def run_shard(args):
+    index, count = args
+    test_dir = Path(__file__).resolve().parent / "sim_build" / f"shard_{index}"
+    test_dir.mkdir(parents=True, exist_ok=True)
+    results = test_dir / "results.json"
+    results.unlink(missing_ok=True)
+
+    runner = chip_top_runner(always=False) # already built, only sets up the runner
+    results_xml = runner.test(
+        hdl_toplevel=hdl_toplevel,
+        test_module="chip_top_tb",
+        test_filter="test_lgn_dataset",
+        test_dir=test_dir,
+        extra_env={"BACKDOOR": "1", "SHARD": f"{index}/{count}", "RESULTS_FILE": str(results)},
+        waves=False,
+    )
+    _, failed = get_results(results_xml)
+    if not results.exists():
+        return index, failed, None
+    with open(results) as f:
+        return index, failed, json.load(f)
+
+def chip_top_sharded_runner(shards):
+    assert not gl, "Sharded runner writes inputs directly into the RTL registers, gate level netlist is not supported"
+    chip_top_runner()
+
+    print(f"Running {shards} simulation shard(s) in parallel...")
+    samples, failed = 0, 0
+    confusion = np.zeros((10, 10), dtype=np.int64)
+    mismatches = []
+    with Pool(shards) as pool:
+        for index, shard_failed, result in pool.imap_unordered(run_shard, [(i, shards) for i in range(shards)]):
+            if result is None:
+                print(f"shard {index}: FAILED, no results")
+                failed += 1
+                continue
+            print(f"shard {index}: {'FAILED' if shard_failed else 'passed'}, {result['samples']} samples")
+            failed += shard_failed
+            samples += result["samples"]
+            confusion += np.array(result["confusion"])
+            mismatches += result["mismatches"]
+
+    print()
+    print_dataset_report(samples, confusion, sorted(mismatches))
+    print(f"Failed shards: {failed}/{shards}")
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    chip_top_runner()
+    if shards > 0:
+        chip_top_sharded_runner(shards)
+    else:
+        chip_top_test(chip_top_runner())
@@ -3,9 +3,35 @@
 
 import klayout.db as db
 import argparse
+import numpy as np
 from PIL import Image
 
 
+def pixel_rectangles(pixels):
+    """Cover the set pixels of a 2D bool array with rectangles
+
+    Horizontal runs of set pixels are found in every row, identical runs
+    in consecutive rows are coalesced into one rectangle.
+    Returns an array of (x0, y0, x1, y1) rows in pixels, y0/y1 are image rows
+    (top to bottom), x1/y1 are exclusive.
+    """
+    padded = np.pad(pixels.astype(np.int8), ((0, 0), (1, 1)))
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # row-major order, pairs up with the starts
+    if len(rows) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+
+    # sort runs by (start, end, row), a rectangle continues while the run repeats in the next row
+    order = np.lexsort((rows, ends, starts))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1]) | (rows[1:] != rows[:-1] + 1)
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(rows)) - 1
+    return np.stack([starts[first], rows[first], ends[first], rows[last] + 1], axis=-1)
+
+
 def convert_to_gds(
     input_filepath,
     output_filepath,
@@ -74,26 +100,32 @@ def convert_to_gds(
             Image.LANCZOS,
         )
 
+    # Set pixels as rectangles of runs instead of single pixels
+    pixels = np.asarray(new_image_binary, dtype=bool)
+    if invert:
+        pixels = ~pixels
+
+    height = new_image_binary.height
+    boxes = [
+        db.DBox(
+            x0 * pixel_size,
+            (height - y1) * pixel_size,
+            x1 * pixel_size,
+            (height - y0) * pixel_size,
+        )
+        for x0, y0, x1, y1 in pixel_rectangles(pixels).tolist()
+    ]
+
     # Use a region to merge pixels together
     if merge:
         top_region = db.Region()
-
-    for y in range(new_image_binary.height):
-        for x in range(new_image_binary.width):
-            # If pixel is set
-            pixel = new_image_binary.getpixel((x, y))
-
-            if pixel and not invert or not pixel and invert:
-                pixel = db.DBox(0.0, 0.0, pixel_size, pixel_size).moved(
-                    x * pixel_size, (new_image_binary.height - y - 1) * pixel_size
-                )
-
-                if merge:
-                    pixel_polygon = db.DPolygon(pixel)
-                    top_region.insert(from_um * pixel_polygon)
-                else:
-                    for foreground_layer in foreground_layers:
-                        top.shapes(foreground_layer).insert(pixel)
+        for box in boxes:
+            top_region.insert(from_um * box)
+    else:
+        for foreground_layer in foreground_layers:
+            shapes = top.shapes(foreground_layer)
+            for box in boxes:
+                shapes.insert(box)
 
     if merge:
         top_region.merge()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: Apache-2.0
+
+# Pre-synthesis estimate of the standard cell count and area of the chip core for a network,
+# tells whether the design fits a slot at the configured PL_TARGET_DENSITY_PCT
+# before spending a PnR run on it.
+#
+# Network gates are mapped to the cells Yosys most likely picks for them, popcount
+# (sum_bits) and arg_max_10 from lgn.v are estimated from their width, or the adders of the
+# compressor tree are counted with GENERATE_POPCOUNT_TREE. Registers follow the settings of npz_to_verilog.py.
+# Cell areas are read from the Liberty file of the PDK.
+
+import os
+import re
+import sys
+import glob
+import gzip
+import yaml
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import npz_to_verilog
+from npz_eval import get_network_layers
+from npz_to_verilog import load_npz_file, optimize_network, category_bits, sum_truncate_lsb, \
+    category_settings, fold_constants, eliminate_dead_gates, pipeline_stages
+from popcount_tree import popcount_netlist
+
+SCL = "gf180mcu_fd_sc_mcu7t5v0"
+
+# Cells per gate type, see GATE_TEMPLATES in npz_to_verilog.py.
+# Pass-through gates are plain wires, negated inputs need an inverter.
+# Constants are tie nets, network_cells() counts a single tie cell for all of them.
+GATE_CELLS = [
+    [],                     #  0: 0
+    ["and2_1"],             #  1: A & B
+    ["inv_1", "nor2_1"],    #  2: A & ~B = ~(~A | B)
+    [],                     #  3: A
+    ["inv_1", "nor2_1"],    #  4: B & ~A = ~(A | ~B)
+    [],                     #  5: B
+    ["xor2_1"],             #  6: A ^ B
+    ["or2_1"],              #  7: A | B
+    ["nor2_1"],             #  8: ~(A | B)
+    ["xnor2_1"],            #  9: ~(A ^ B)
+    ["inv_1"],              # 10: ~B
+    ["inv_1", "nand2_1"],   # 11: A | ~B = ~(~A & B)
+    ["inv_1"],              # 12: ~A
+    ["inv_1", "nand2_1"],   # 13: ~A | B = ~(A & ~B)
+    ["nand2_1"],            # 14: ~(A & B)
+    [],                     # 15: 1
+]
+
+INPUTS = 16 * 16 * 4 # lgn.v: localparam INPUTS
+
+def find_liberty(pdk_root, pdk):
+    lib_dir = os.path.join(pdk_root, pdk, "libs.ref", SCL, "lib")
+    files = sorted(glob.glob(os.path.join(lib_dir, "*tt*.lib*"))) or sorted(glob.glob(os.path.join(lib_dir, "*.lib*")))
+    if not files:
+        raise FileNotFoundError(f"No Liberty files found in '{lib_dir}', check PDK_ROOT and PDK.")
+    return files[0]
+
+def read_cell_areas(liberty_file):
+    opener = gzip.open if liberty_file.endswith(".gz") else open
+    with opener(liberty_file, "rt") as f:
+        text = f.read()
+    # area is the first attribute that follows the cell name
+    cells = re.findall(r'cell\s*\(\s*"?([\w$]+)"?\s*\)\s*\{[^{}]*?\barea\s*:\s*([\d.]+)', text)
+    return {name.removeprefix(SCL + "__"): float(area) for name, area in cells}
+
+def network_cells(gates):
+    counts = np.bincount(np.concatenate([np.asarray(g) for g in gates]), minlength=16)
+    cells = {}
+    for gate_type, count in enumerate(counts):
+        for cell in GATE_CELLS[gate_type]:
+            cells[cell] = cells.get(cell, 0) + int(count)
+    if counts[0] > 0:
+        cells["tiel"] = 1
+    if counts[15] > 0:
+        cells["tieh"] = 1
+    return cells
+
+def live_network(gates, conn_a, conn_b):
+    # Synthesis removes the gates outside of every category cone and folds the constants,
+    # even if net.v is generated without ELIMINATE_DEAD_GATES
+    gates = fold_constants(gates, conn_a, conn_b)
+    live_outputs = category_bits(len(gates[-1]))
+    live_outputs = live_outputs[live_outputs >= 0]
+    return eliminate_dead_gates(gates, conn_a, conn_b, live_outputs, keep_output_positions=True)
+
+def popcount_cells(bits_per_category):
+    # sum_bits of a single category
+    if npz_to_verilog.GENERATE_POPCOUNT_TREE:
+        # adders of the compressor tree in net.v, the top bit is the parity of its column
+        adders, outputs = popcount_netlist(bits_per_category)
+        parity = outputs[-1][2:-1].split(", ") if outputs[-1].startswith("^{") else []
+        return {
+            "addf_1": sum(cell == "popcount_fa" for cell, _, _, _ in adders),
+            "addh_1": sum(cell == "popcount_ha" for cell, _, _, _ in adders),
+            "xor2_1": max(len(parity) - 1, 0),
+        }
+    # $countones: every full adder removes one bit
+    sum_bits = (bits_per_category - 1).bit_length()
+    return {
+        "addf_1": bits_per_category - sum_bits,
+        "addh_1": sum_bits,
+    }
+
+def core_cells(number_of_categories=None, bits_per_category=None, truncate_lsb=0, pipeline_bits=0):
+    # Everything in lgn.v besides the network itself,
+    # pipeline_bits is the number of registered outputs of the network layers (PIPELINE_EVERY_N_LAYERS)
+    number_of_categories, bits_per_category = category_settings(number_of_categories, bits_per_category)
+    sum_bits = (bits_per_category - 1).bit_length()
+    arg_max_bits = sum_bits - truncate_lsb
+    comparisons = number_of_categories - 1 # arg_max_10 comparison tree
+    cells = {
+        # input shift register with write enable
+        "dffq_1": INPUTS,
+        "mux2_2": INPUTS
+                # arg_max_10: value and index multiplexers after every comparison
+                + comparisons * (arg_max_bits + 4),
+        # arg_max_10: magnitude comparators
+        "xnor2_1": comparisons * arg_max_bits,
+        "and2_1": comparisons * arg_max_bits,
+        "or2_1": comparisons * arg_max_bits,
+    }
+    for cell, count in popcount_cells(bits_per_category).items():
+        if count > 0:
+            cells[cell] = cells.get(cell, 0) + number_of_categories * count
+
+    if npz_to_verilog.DOUBLE_BUFFER_INPUTS:
+        # x latched from the shadow register on commit, x_committed
+        cells["dffq_1"] += INPUTS + 1
+        cells["mux2_2"] += INPUTS
+        # held result index, value and valid with reset
+        cells["dffrnq_1"] = 4 + arg_max_bits + 1
+        cells["mux2_2"] += 4 + arg_max_bits
+    # net pipeline registers, sum_categories and the valid shift registers
+    cells["dffq_1"] += pipeline_bits
+    if npz_to_verilog.PIPELINE_POPCOUNT:
+        cells["dffq_1"] += number_of_categories * sum_bits + 1
+    return cells
+
+def slot_core_area(slot_file):
+    x0, y0, x1, y1 = yaml.safe_load(open(slot_file))["CORE_AREA"]
+    return (x1 - x0) * (y1 - y0)
+
+def main(npz_file, slot, config_path, pdk_root, pdk):
+    data = load_npz_file(npz_file)
+    gates, conn_a, conn_b = get_network_layers(data)
+    gates, conn_a, conn_b = optimize_network(gates, conn_a, conn_b)
+    gates_before = sum(len(g) for g in gates)
+    gates, conn_a, conn_b = live_network(gates, conn_a, conn_b)
+    print(f"Gates: {gates_before}, live: {sum(np.count_nonzero((g != 0) & (g != 15)) for g in gates)}")
+
+    areas = read_cell_areas(find_liberty(pdk_root, pdk))
+    cells = {}
+    bits_per_category = category_bits(len(gates[-1])).shape[1] # CATEGORY_CONFIG might narrow the categories
+    stages = pipeline_stages(len(gates))
+    pipeline_bits = sum(len(gates[l]) for l in stages) + len(stages) # registered layers and valid
+    for part in (network_cells(gates), core_cells(bits_per_category=bits_per_category, truncate_lsb=sum_truncate_lsb(), pipeline_bits=pipeline_bits)):
+        for cell, count in part.items():
+            cells[cell] = cells.get(cell, 0) + count
+
+    print()
+    print(f"{'cell':<12} {'count':>8} {'area um^2':>12}")
+    total_cells, total_area = 0, 0.0
+    for cell, count in sorted(cells.items(), key=lambda item: -item[1]):
+        if cell not in areas:
+            raise KeyError(f"Cell '{SCL}__{cell}' is not in the Liberty file.")
+        print(f"{cell:<12} {count:>8} {count * areas[cell]:>12.0f}")
+        total_cells += count
+        total_area += count * areas[cell]
+    print(f"{'total':<12} {total_cells:>8} {total_area:>12.0f}")
+
+    density = yaml.safe_load(open(config_path))["PL_TARGET_DENSITY_PCT"]
+    print()
+    print(f"Placement density: {density}%, required core area: {total_area / (density / 100) / 1e6:.2f} mm^2")
+    print(f"{'slot':<10} {'core mm^2':>10} {'utilization':>12}")
+    fits = True
+    for slot_file in sorted(glob.glob(os.path.join(os.path.dirname(config_path), "slots", "slot_*.yaml"))):
+        name = os.path.basename(slot_file)[len("slot_"):-len(".yaml")]
+        core_area = slot_core_area(slot_file)
+        utilization = total_area / core_area * 100
+        fit = utilization <= density
+        selected = name.lower() == slot.lower()
+        if selected:
+            fits = fit
+        print(f"{name:<10} {core_area / 1e6:>10.2f} {utilization:>11.1f}% {'fits' if fit else 'DOES NOT FIT'}{'   <- selected' if selected else ''}")
+
+    if not fits:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("npz", help="path to the network .npz file")
+    parser.add_argument("--slot", default=os.getenv("SLOT", "1x1"), help="slot to check, 1x1, 0p5x0p5, ...")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "librelane", "config.yaml"), help="path to config")
+
+    args = parser.parse_args()
+
+    PDK_ROOT = os.getenv("PDK_ROOT", os.path.expanduser("~/.ciel"))
+    PDK = os.getenv("PDK", "gf180mcuD")
+
+    main(args.npz, args.slot, args.config, PDK_ROOT, PDK)
@@ -3,16 +3,42 @@
 
 import os
 import argparse
+import tempfile
+from multiprocessing import Pool
 import klayout.lay as lay
 import klayout.db as db
 
+# Background colors
+BACKGROUNDS = {
+    "white": "#FFFFFF",
+    "black": "#000000",
+}
 
-def main(input_layout, output_image, width, height, oversampling, pdk_root, pdk):
+# Disable some layers
+ENABLED_LAYERS = [
+    (22, 0),
+    (21, 0),
+    (204, 0),
+    (55, 0),
+    (30, 0),
+    (32, 0),
+    (31, 0),
+    (49, 0),
+    (33, 0),
+    (34, 0),
+    (35, 0),
+    (36, 0),
+    (38, 0),
+    (42, 0),
+    (40, 0),
+    (46, 0),
+    (41, 0),
+    (81, 0),
+    (37, 0),
+]
 
-    # Background colors
-    background_white = "#FFFFFF"
-    background_black = "#000000"
 
+def setup_view(input_layout, pdk_root, pdk):
     lv = lay.LayoutView()
 
     lv.set_config("grid-visible", "false")
@@ -22,69 +48,171 @@ def main(input_layout, output_image, width, height, oversampling, pdk_root, pdk)
     lv.load_layout(input_layout, 0)
     lv.max_hier()
 
-    top_cell = lv.active_cellview().layout().top_cell()
-    top_bbox = top_cell.dbbox()
-    aspect_ratio = top_bbox.width() / top_bbox.height()
-
-    if not height and not width:
-        width = 1024
-
-    if not height:
-        height = int(width / aspect_ratio)
-
     # Load the layer properties
     lv.load_layer_props(
         os.path.join(pdk_root, pdk, "libs.tech", "klayout", "tech", "gf180mcu.lyp")
     )
 
-    # Disable some layers
-    enabled_layers = [
-        (22, 0),
-        (21, 0),
-        (204, 0),
-        (55, 0),
-        (30, 0),
-        (32, 0),
-        (31, 0),
-        (49, 0),
-        (33, 0),
-        (34, 0),
-        (35, 0),
-        (36, 0),
-        (38, 0),
-        (42, 0),
-        (40, 0),
-        (46, 0),
-        (41, 0),
-        (81, 0),
-        (37, 0),
-    ]
     for lyp in lv.each_layer():
         layer_datatype = (lyp.source_layer, lyp.source_datatype)
 
-        if layer_datatype not in enabled_layers:
+        if layer_datatype not in ENABLED_LAYERS:
             lyp.visible = False
 
-    # Save the images
+    return lv
+
+
+def image_size(box_width, box_height, width, height):
+    aspect_ratio = box_width / box_height
+
+    if not height and not width:
+        width = 1024
+
+    if not height:
+        height = int(width / aspect_ratio)
+
+    if not width:
+        width = int(height * aspect_ratio)
+
+    return width, height
+
+
+def output_names(output_image):
     base_name = os.path.splitext(os.path.basename(output_image))[0]
     directory = os.path.dirname(output_image)
+    return {
+        name: os.path.join(directory, f"{base_name}_{name}.png")
+        for name in BACKGROUNDS
+    }
 
-    lv.set_config("background-color", background_white)
-    lv.save_image_with_options(
-        os.path.join(directory, base_name + "_white.png"),
-        width,
-        height,
-        oversampling=oversampling,
-    )
 
-    lv.set_config("background-color", background_black)
-    lv.save_image_with_options(
-        os.path.join(directory, base_name + "_black.png"),
-        width,
-        height,
-        oversampling=oversampling,
+def main(input_layout, output_image, width, height, oversampling, pdk_root, pdk):
+
+    lv = setup_view(input_layout, pdk_root, pdk)
+
+    top_bbox = lv.active_cellview().layout().top_cell().dbbox()
+    width, height = image_size(top_bbox.width(), top_bbox.height(), width, height)
+
+    # Save the images
+    for name, file_name in output_names(output_image).items():
+        lv.set_config("background-color", BACKGROUNDS[name])
+        lv.save_image_with_options(
+            file_name,
+            width,
+            height,
+            oversampling=oversampling,
+        )
+
+
+# --- Tiled rendering ---
+#
+# The die is split into a grid of tiles, every worker process loads the layout and sets up the layers once.
+# A tile is rendered once, oversampled, on a key color that no visible layer uses. Both backgrounds
+# are composited from that render and downsampled, which is what klayout does for oversampling.
+# Memory per worker is one layout plus one oversampled tile, the parent only stitches one image at a time.
+
+DEFAULT_JOBS = min(4, os.cpu_count() or 1) # every worker holds a copy of the layout
+
+view = None
+key_color = None
+
+
+def init_worker(input_layout, pdk_root, pdk):
+    global view, key_color
+    view = setup_view(input_layout, pdk_root, pdk)
+
+    used = set()
+    for lyp in view.each_layer():
+        if lyp.visible:
+            used |= {lyp.fill_color & 0xFFFFFF, lyp.frame_color & 0xFFFFFF}
+    key_color = next(c for c in (0x01FE03, 0xFE02FD, 0x03FD01, 0x02FE02) if c not in used)
+    view.set_config("background-color", f"#{key_color:06X}")
+
+
+def top_bbox():
+    box = view.active_cellview().layout().top_cell().dbbox()
+    return box.left, box.bottom, box.right, box.top
+
+
+def render_tile(args):
+    from PIL import Image, ImageChops
+
+    directory, index, box, width, height, oversampling = args
+    file_name = os.path.join(directory, f"tile_{index}.png")
+    view.save_image_with_options(
+        file_name,
+        width * oversampling,
+        height * oversampling,
+        oversampling=1,
+        resolution=1 / oversampling,
+        target=db.DBox(*box),
     )
 
+    with Image.open(file_name) as image:
+        image = image.convert("RGB")
+    os.remove(file_name)
+
+    # pixels that differ from the key color in any channel belong to the layout
+    key = Image.new("RGB", image.size, f"#{key_color:06X}")
+    r, g, b = ImageChops.difference(image, key).split()
+    drawn = ImageChops.lighter(ImageChops.lighter(r, g), b).point(lambda v: 255 if v else 0)
+
+    for name, color in BACKGROUNDS.items():
+        tile = Image.composite(image, Image.new("RGB", image.size, color), drawn)
+        if oversampling > 1:
+            tile = tile.resize((width, height), Image.Resampling.BOX)
+        tile.save(os.path.join(directory, f"tile_{index}_{name}.png"))
+    return index
+
+
+def tile_grid(bbox, width, height, tiles):
+    # Viewport is the die box widened to the aspect ratio of the image, same as for a single render.
+    # Returns (pixel x, pixel y, pixel width, pixel height, (left, bottom, right, top) in um) of every tile.
+    left, bottom, right, top = bbox
+    scale = max((right - left) / width, (top - bottom) / height)
+    x = (left + right) / 2 - width * scale / 2
+    y = (bottom + top) / 2 + height * scale / 2
+
+    xs = [width * i // tiles for i in range(tiles + 1)]
+    ys = [height * i // tiles for i in range(tiles + 1)]
+    grid = []
+    for y0, y1 in zip(ys, ys[1:]):
+        for x0, x1 in zip(xs, xs[1:]):
+            box = (x + x0 * scale, y - y1 * scale, x + x1 * scale, y - y0 * scale)
+            grid.append((x0, y0, x1 - x0, y1 - y0, box))
+    return grid
+
+
+def main_tiled(input_layout, output_image, width, height, oversampling, pdk_root, pdk, tiles, jobs):
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as directory, Pool(
+        min(jobs, tiles * tiles),
+        initializer=init_worker,
+        initargs=(input_layout, pdk_root, pdk),
+    ) as pool:
+        # only the workers load the layout
+        bbox = pool.apply(top_bbox)
+        width, height = image_size(bbox[2] - bbox[0], bbox[3] - bbox[1], width, height)
+        grid = tile_grid(bbox, width, height, tiles)
+
+        tasks = [
+            (directory, index, box, w, h, oversampling)
+            for index, (_, _, w, h, box) in enumerate(grid)
+        ]
+        for _ in pool.imap_unordered(render_tile, tasks):
+            pass
+
+        for name, file_name in output_names(output_image).items():
+            image = Image.new("RGB", (width, height))
+            for index, (x, y, _, _, _) in enumerate(grid):
+                tile_name = os.path.join(directory, f"tile_{index}_{name}.png")
+                with Image.open(tile_name) as tile:
+                    image.paste(tile, (x, y))
+                os.remove(tile_name)
+            image.save(file_name)
+            image = None # freed before the canvas of the next background
+
 
 if __name__ == "__main__":
 
@@ -101,15 +229,34 @@ if __name__ == "__main__":
     parser.add_argument(
         "--oversampling", type=int, default=1, help="oversampling factor"
     )
+    parser.add_argument(
+        "--tiles", type=int, default=1, help="render as a grid of tiles x tiles in parallel"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=DEFAULT_JOBS, help="worker processes for tiled rendering, each loads the layout"
+    )
 
     args = parser.parse_args()
 
-    main(
-        args.layout,
-        args.image,
-        args.width,
-        args.height,
-        args.oversampling,
-        pdk_root,
-        pdk,
-    )
+    if args.tiles > 1:
+        main_tiled(
+            args.layout,
+            args.image,
+            args.width,
+            args.height,
+            args.oversampling,
+            pdk_root,
+            pdk,
+            args.tiles,
+            args.jobs,
+        )
+    else:
+        main(
+            args.layout,
+            args.image,
+            args.width,
+            args.height,
+            args.oversampling,
+            pdk_root,
+            pdk,
+        )
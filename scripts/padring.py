@@ -4,10 +4,13 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import re
 import sys
 import yaml
 import shutil
+import hashlib
 import argparse
+from multiprocessing import Pool
 
 from typing import List, Type, Tuple
 
@@ -89,12 +92,169 @@ def main(slot_config_path, config_path):
     print(f"Run successfully completed.")
 
 
+# --- Multiple slots ---
+#
+# Every slot runs in its own process and run directory: runs/PADRING_<slot>_<hash>.
+# The hash covers the merged config, the files it references (Verilog with the pad
+# instances, SDC, macros) together with the `include`d ones (slot_defines.svh), the PDK and the flow steps. A slot whose run directory
+# already holds a completed run with the same hash is skipped.
+# PADRING_ tags sort before the RUN_ tags of the full flow, so RUN_TAG in the Makefile is not affected.
+
+HASH_FILE = "padring.sha256"
+
+
+def referenced_files(value, design_dir):
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from referenced_files(v, design_dir)
+    elif isinstance(value, list):
+        for v in value:
+            yield from referenced_files(v, design_dir)
+    elif isinstance(value, str) and value.startswith("dir::"):
+        path = os.path.normpath(os.path.join(design_dir, value[len("dir::") :]))
+        if os.path.isfile(path):
+            yield path
+
+
+def included_files(path, include_dirs, seen):
+    # `include`d files of a Verilog source, recursively, looked up next to
+    # the including file first and then in the include directories
+    with open(path, errors="replace") as f:
+        names = re.findall(r'`include\s+"([^"]+)"', f.read())
+    for name in names:
+        for directory in [os.path.dirname(path)] + include_dirs:
+            candidate = os.path.normpath(os.path.join(directory, name))
+            if os.path.isfile(candidate):
+                if candidate not in seen:
+                    seen.add(candidate)
+                    yield candidate
+                    yield from included_files(candidate, include_dirs, seen)
+                break
+
+
+def source_files(flow_cfg, design_dir):
+    # Files referenced by the config and everything the Verilog sources among them include
+    files = set(referenced_files(flow_cfg, design_dir))
+    include_dirs = [
+        os.path.join(design_dir, d[len("dir::") :]) if d.startswith("dir::") else d
+        for d in flow_cfg.get("VERILOG_INCLUDE_DIRS") or []
+    ]
+    seen = set()
+    for path in sorted(files):
+        if path.endswith((".v", ".sv", ".vh", ".svh")):
+            files |= set(included_files(path, include_dirs, seen))
+    return files
+
+
+def config_hash(flow_cfg, design_dir, pdk_root, pdk):
+    h = hashlib.sha256()
+    h.update(yaml.safe_dump(flow_cfg, sort_keys=True).encode())
+    h.update(f"{pdk_root} {pdk}".encode())
+    h.update(" ".join(step.id for step in PadringFlow.Steps).encode())
+    for path in sorted(source_files(flow_cfg, design_dir)):
+        h.update(path.encode())
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def run_slot(args):
+    slot, flow_cfg, design_dir, pdk_root, pdk, tag = args
+
+    flow = PadringFlow(
+        flow_cfg,
+        design_dir=design_dir,
+        pdk_root=pdk_root,
+        pdk=pdk,
+    )
+
+    try:
+        flow.start(tag=tag, overwrite=True)
+    except FlowError as e:
+        return slot, f"{e}"
+
+    return slot, None
+
+
+def main_slots(slot_config_paths, config_path, jobs):
+
+    PDK_ROOT = os.getenv("PDK_ROOT", os.path.expanduser("~/.ciel"))
+    PDK = os.getenv("PDK", "gf180mcuD")
+
+    print(f"PDK_ROOT = {PDK_ROOT}")
+    print(f"PDK = {PDK}")
+
+    design_dir = os.path.dirname(config_path)
+
+    tasks = []
+    tags = {}  # hash -> slot
+    digests = {}  # tag -> hash
+    for slot_config_path in slot_config_paths:
+        slot = os.path.splitext(os.path.basename(slot_config_path))[0].removeprefix("slot_")
+
+        with open(slot_config_path) as f:
+            flow_cfg = yaml.safe_load(f)
+        with open(config_path) as f:
+            flow_cfg.update(yaml.safe_load(f))
+
+        digest = config_hash(flow_cfg, design_dir, PDK_ROOT, PDK)
+        tag = f"PADRING_{slot}_{digest[:12]}"
+        run_dir = os.path.join(design_dir, "runs", tag)
+        hash_path = os.path.join(run_dir, HASH_FILE)
+
+        reused = False
+        if os.path.exists(hash_path):
+            with open(hash_path) as f:
+                reused = f.read().strip() == digest
+
+        if reused:
+            print(f"{slot}: unchanged, reusing {run_dir}")
+        elif digest in tags:
+            print(f"{slot}: same as {tags[digest]}, reusing its run")
+        else:
+            tags[digest] = slot
+            digests[tag] = digest
+            tasks.append((slot, flow_cfg, design_dir, PDK_ROOT, PDK, tag))
+
+    errors = {}
+    if tasks:
+        print(f"Running {len(tasks)} padring flow(s): {', '.join(t[0] for t in tasks)}")
+        with Pool(min(jobs, len(tasks)), maxtasksperchild=1) as pool:
+            for slot, error in pool.imap_unordered(run_slot, tasks):
+                if error is not None:
+                    errors[slot] = error
+                    print(f"{slot}: Error: \n{error}")
+                else:
+                    print(f"{slot}: run successfully completed.")
+
+    # Only completed runs are marked, failed ones run again next time
+    for slot, _, _, _, _, tag in tasks:
+        if slot not in errors:
+            with open(os.path.join(design_dir, "runs", tag, HASH_FILE), "w") as f:
+                f.write(digests[tag] + "\n")
+
+    if errors:
+        sys.exit(1)
+
+    print(f"All slots successfully completed.")
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("slot", default=".", help="path to slot config")
+    parser.add_argument(
+        "slot",
+        nargs="+",
+        help="path to slot config, several run in parallel and unchanged ones are skipped",
+    )
     parser.add_argument("config", default=".", help="path to config")
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="parallel runs for several slots"
+    )
 
     args = parser.parse_args()
 
-    main(args.slot, args.config)
+    if len(args.slot) > 1:
+        main_slots(args.slot, args.config, args.jobs)
+    else:
+        main(args.slot[0], args.config)
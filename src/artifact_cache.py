@@ -0,0 +1,110 @@
+import io
+import os
+import shutil
+import hashlib
+import contextlib
+import numpy as np
+
+# Content-addressed on-disk cache for the pth -> npz -> Verilog conversion chain.
+#
+# Every entry is a directory named after the hash of the input tensors, the generator
+# settings and the converter sources. Entries are evicted in LRU order (directory mtime
+# is touched on every hit) once the cache grows over CACHE_MAX_BYTES.
+# The cache lives in .cache/lgn of the project, LGN_CACHE_DIR and LGN_CACHE_MAX_BYTES override it.
+
+CACHE_DIR = os.getenv("LGN_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "lgn"))
+CACHE_MAX_BYTES = int(os.getenv("LGN_CACHE_MAX_BYTES", 1024**3))
+LOG_FILE = "log.txt"
+
+def hash_update(h, value):
+    if hasattr(value, "detach"): # torch.Tensor
+        value = value.detach().cpu().numpy()
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update(f"array:{value.dtype.str}:{value.shape}:".encode())
+        h.update(value.tobytes())
+    elif hasattr(value, "keys"): # dict, NpzFile, torch checkpoint
+        for key in sorted(value.keys()):
+            h.update(f"key:{key}:".encode())
+            hash_update(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"list:{len(value)}:".encode())
+        for v in value:
+            hash_update(h, v)
+    else:
+        h.update(f"value:{value!r}:".encode())
+
+def cache_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        hash_update(h, part)
+    return h.hexdigest()
+
+def source_hash(*modules):
+    # Cached artifacts are invalidated when converter sources change
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def cache_entry_size(path):
+    # entries might hold directories of .npy files
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def evict(keep=None):
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if os.path.isdir(path) and not name.endswith(".tmp"):
+            try:
+                entries.append((os.path.getmtime(path), cache_entry_size(path), path))
+            except FileNotFoundError:
+                pass # evicted by another process
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+def cached(key, produce, log=False):
+    # Returns directory of the cache entry, produce(directory) is called to fill it on a miss.
+    # With log, console output of produce() is stored in the entry and printed on a hit as well,
+    # so the statistics of a cached run are the same as of a fresh one.
+    path = os.path.join(CACHE_DIR, key)
+    if os.path.isdir(path):
+        os.utime(path)
+        print(f"Using cached artifacts: {path}")
+        if log and os.path.isfile(os.path.join(path, LOG_FILE)):
+            with open(os.path.join(path, LOG_FILE)) as f:
+                print(f.read(), end="")
+        return path
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        if log:
+            output = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(output):
+                    produce(tmp)
+            finally:
+                print(output.getvalue(), end="")
+            with open(os.path.join(tmp, LOG_FILE), "w") as f:
+                f.write(output.getvalue())
+        else:
+            produce(tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            pass # produced concurrently by another process
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict(keep=path)
+    return path
+
+def parse_cache_flag(argv):
+    # Strips --no-cache from the command line, returns (use_cache, remaining arguments)
+    return "--no-cache" not in argv, [arg for arg in argv if arg != "--no-cache"]
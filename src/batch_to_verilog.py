@@ -0,0 +1,132 @@
+import sys
+import os
+import io
+import glob
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+from multiprocessing import Pool
+
+import npz_eval
+from npz_eval import evaluate_npz
+from npz_to_verilog import load_npz_file, npz_to_verilog, verilog_cache_key
+from artifact_cache import cached, source_hash, parse_cache_flag
+
+# Converts many .pth / .npz checkpoints to Verilog in parallel, one worker process per core.
+# Every worker imports torch at most once, per file output is silenced and
+# a single summary table is printed at the end. Unchanged models are taken from the cache.
+
+def find_checkpoints(path):
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*.pth")) + glob.glob(os.path.join(path, "*.npz"))
+    else:
+        files = glob.glob(path)
+    files = [f for f in files if f.endswith(".pth") or f.endswith(".npz")]
+
+    # .npz is already converted from .pth with the same name, no need to do it twice
+    npz = {os.path.splitext(f)[0] for f in files if f.endswith(".npz")}
+    files = [f for f in files if f.endswith(".npz") or os.path.splitext(f)[0] not in npz]
+    return sorted(files)
+
+def convert_network(data, path):
+    # Writes Verilog and statistics of a single network into the directory path
+    stats = {}
+    # evaluated before npz_to_verilog(), which rewrites the connections in place with LIMIT_LONG_CONNECTIONS
+    if 'input' in data and 'output' in data:
+        result = evaluate_npz(data)
+        if result is not None:
+            stats["accuracy"] = float(result["accuracy"])
+
+    with open(os.path.join(path, "net.v"), "w") as f:
+        npz_to_verilog(data, f=f, stats=stats)
+
+    with open(os.path.join(path, "stats.json"), "w") as f:
+        json.dump(stats, f)
+
+def convert_file(args):
+    file_name, output_dir, use_cache = args
+    stats = {"file": file_name}
+    verilog_file_name = os.path.splitext(file_name)[0] + ".v"
+    if output_dir is not None:
+        verilog_file_name = os.path.join(output_dir, os.path.basename(verilog_file_name))
+
+    start = time.perf_counter()
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            if file_name.endswith(".pth"):
+                import pth_to_npz # torch is imported only by workers that need it
+                checkpoint = pth_to_npz.load_pth_file(file_name)
+                key = verilog_cache_key(checkpoint, -1, source_hash(pth_to_npz, npz_eval))
+                load = lambda: pth_to_npz.pth_to_npz(checkpoint)
+            else:
+                data = load_npz_file(file_name)
+                key = verilog_cache_key(data, -1, source_hash(npz_eval))
+                load = lambda: data
+
+            if use_cache and key is not None:
+                path = cached(key, lambda path: convert_network(load(), path))
+            else:
+                path = tempfile.mkdtemp()
+                convert_network(load(), path)
+
+            with open(os.path.join(path, "stats.json")) as f:
+                stats.update(json.load(f))
+            with open(verilog_file_name, "w") as f, open(os.path.join(path, "net.v")) as net:
+                f.write(f"// Generated from: {file_name}\n")
+                shutil.copyfileobj(net, f)
+
+            if not use_cache or key is None:
+                shutil.rmtree(path)
+    except Exception as e:
+        stats["error"] = str(e)
+        stats["log"] = log.getvalue()
+
+    stats["verilog"] = verilog_file_name
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def print_summary(results):
+    width = max(len(os.path.basename(r["file"])) for r in results)
+    print()
+    print(f"{'model':<{width}} {'gates':>9} {'optimized':>9} {'total wire':>12} {'avg wire':>8} {'accuracy':>8} {'time':>7}")
+    for r in results:
+        name = os.path.basename(r["file"])
+        if "error" in r:
+            print(f"{name:<{width}} FAILED: {r['error']}")
+            continue
+        accuracy = f"{r['accuracy']*100:7.2f}%" if "accuracy" in r else f"{'-':>8}"
+        print(f"{name:<{width}} {r['gates']:>9} {r['optimized_gates']:>9} {r['total_wire']:>12} {r['avg_wire']:>8} {accuracy} {r['seconds']:>6.1f}s")
+
+###########################################################################################
+
+if __name__ == "__main__":
+    use_cache, argv = parse_cache_flag(sys.argv)
+    if len(argv) != 2 and len(argv) != 3:
+        print(f"Usage: python {argv[0]} <directory_or_glob> (optional: <output_directory>) [--no-cache]")
+        sys.exit(1)
+
+    files = find_checkpoints(argv[1])
+    output_dir = argv[2] if len(argv) == 3 else None
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if not files:
+        print(f"No .pth or .npz files found in '{argv[1]}'.")
+        sys.exit(1)
+
+    processes = min(os.cpu_count() or 1, len(files))
+    print(f"Converting {len(files)} checkpoint(s) with {processes} process(es)...")
+    start = time.perf_counter()
+    results = []
+    with Pool(processes) as pool:
+        for r in pool.imap_unordered(convert_file, [(f, output_dir, use_cache) for f in files]):
+            print(f"{'FAILED' if 'error' in r else 'done'}: {r['file']}")
+            results.append(r)
+
+    results.sort(key=lambda r: r["file"])
+    print_summary(results)
+    print(f"Converted {len(files)} checkpoint(s) in {time.perf_counter() - start:.1f}s")
+    if any("error" in r for r in results):
+        sys.exit(1)
@@ -47,11 +47,13 @@ module chip_core #(
     localparam OUTPUTS = 16;
     lgn lgn (
         .clk            (clk),
+        .rst_n          (rst_n),
         .ui_in          (input_in [0 +: INPUTS]),
         .write_enable   (~input_in[INPUTS]),
+        .commit         (input_in[INPUTS+1]),
         .uo_out         (bidir_out[0 +: OUTPUTS])
     );
-    localparam TOTAL_INPUTS = INPUTS+1; // pixel input pins + 1 write_enable pin
+    localparam TOTAL_INPUTS = INPUTS+2; // pixel input pins + 1 write_enable pin + 1 commit pin
 
     ////////////////////////////////////
     logic _unused;
@@ -7,46 +7,106 @@
 
 module lgn (
     input  wire clk,
+    input  wire rst_n,           // resets the result registers, DOUBLE_BUFFER_INPUTS only
     input  wire write_enable,
+    input  wire commit,          // latches the input buffer into the net inputs, DOUBLE_BUFFER_INPUTS only
     input  wire [7:0]  ui_in,    // Dedicated inputs
     output wire [15:0] uo_out    // Dedicated outputs
 );
   localparam INPUTS  = 16*16*4; // IMG_WIDTH=16 BINARIZE_IMAGE_THRESHOLD="[.2, .4, .6, .8]"
   localparam CATEGORIES = 10;
+`ifdef BITS_PER_CATEGORY // net.v is generated with a searched category wiring, see CATEGORY_CONFIG
+  localparam BITS_PER_CATEGORY = `BITS_PER_CATEGORY;
+`else
   localparam BITS_PER_CATEGORY = 800; // 511;
+`endif
   localparam OUTPUTS = BITS_PER_CATEGORY * CATEGORIES;
   localparam BITS_PER_CATEGORY_SUM = $clog2(BITS_PER_CATEGORY);
+`ifdef SUM_TRUNCATE_LSB // LSBs of the sums ignored by arg_max_10
+  localparam TRUNCATE_LSB = `SUM_TRUNCATE_LSB;
+`else
+  localparam TRUNCATE_LSB = 0;
+`endif
+  localparam ARG_MAX_BITS = BITS_PER_CATEGORY_SUM - TRUNCATE_LSB;
 
+`ifdef DOUBLE_BUFFER_INPUTS // next image is shifted into the shadow buffer while the net works on x
+  reg   [INPUTS-1:0] x_shadow;
+  wire  [INPUTS-1:0] x_shadow_next = write_enable ? {x_shadow[INPUTS-8-1:0], ui_in[7:0]} : x_shadow;
+  reg   [INPUTS-1:0] x;
+  reg   x_committed;
+  always @(posedge clk) begin : set_inputs
+    x_shadow <= x_shadow_next;
+    if (commit)
+      x <= x_shadow_next; // byte written together with commit is the last one of the image
+    x_committed <= rst_n & commit;
+  end
+  wire x_valid = x_committed;
+`else
   reg   [INPUTS-1:0] x;
   always @(posedge clk) begin : set_inputs
     if (write_enable)
       x <= {x[INPUTS-8-1:0], ui_in[7:0]};
   end
+  wire x_valid = ~write_enable;
+  wire _unused_commit = &{commit, rst_n};
+`endif
 
   wire [OUTPUTS-1:0] y; wire _unused = &{y};
   wire [BITS_PER_CATEGORY*CATEGORIES-1:0] y_categories;
+  wire y_valid;
+`ifdef NET_LATENCY // net.v is generated with pipeline registers, see PIPELINE_EVERY_N_LAYERS
   net net(
+    .clk(clk),
+    .in_valid(x_valid),
+    .out_valid(y_valid),
     .in(x),
     .out(y),
     .categories(y_categories)
   );
+`else
+  assign y_valid = x_valid;
+  net net(
+    .in(x),
+    .out(y),
+    .categories(y_categories)
+  );
+`endif
 
-  wire [BITS_PER_CATEGORY_SUM*CATEGORIES-1:0] sum_categories;
+  wire [BITS_PER_CATEGORY_SUM*CATEGORIES-1:0] popcounts;
   genvar i;
   generate
     for (i = 0; i < CATEGORIES; i = i+1) begin : calc_categories
       sum_bits #(.N(BITS_PER_CATEGORY)) sum_bits(
         .y(y_categories[i*BITS_PER_CATEGORY +: BITS_PER_CATEGORY]),      
-        .sum(sum_categories[i*BITS_PER_CATEGORY_SUM +: BITS_PER_CATEGORY_SUM])
+        .sum(popcounts[i*BITS_PER_CATEGORY_SUM +: BITS_PER_CATEGORY_SUM])
       );
     end
   endgenerate
 
+`ifdef PIPELINE_POPCOUNT
+  reg [BITS_PER_CATEGORY_SUM*CATEGORIES-1:0] sum_categories;
+  reg sum_valid;
+  always @(posedge clk) begin
+    sum_categories <= popcounts;
+    sum_valid <= y_valid;
+  end
+`else
+  wire [BITS_PER_CATEGORY_SUM*CATEGORIES-1:0] sum_categories = popcounts;
+  wire sum_valid = y_valid;
+`endif
+
   /* verilator lint_off UNUSEDSIGNAL */
+  wire [ARG_MAX_BITS*CATEGORIES-1:0] arg_max_inputs;
+  generate
+    for (i = 0; i < CATEGORIES; i = i+1) begin : truncate_categories
+      assign arg_max_inputs[i*ARG_MAX_BITS +: ARG_MAX_BITS] = sum_categories[i*BITS_PER_CATEGORY_SUM + TRUNCATE_LSB +: ARG_MAX_BITS];
+    end
+  endgenerate
+
   wire [3:0] best_category_index;
-  wire [BITS_PER_CATEGORY_SUM-1:0] best_category_value;
-  arg_max_10 #(.N(BITS_PER_CATEGORY_SUM)) arg_max_categories(
-    .categories(sum_categories),
+  wire [ARG_MAX_BITS-1:0] best_category_value;
+  arg_max_10 #(.N(ARG_MAX_BITS)) arg_max_categories(
+    .categories(arg_max_inputs),
     .out_index(best_category_index),
     .out_value(best_category_value)
   );
@@ -56,16 +116,41 @@ module lgn (
   // assign uio_out[6:4] = 0;
   // assign uio_out[7]   = 0;
 
+`ifdef DOUBLE_BUFFER_INPUTS
+  // result of the last committed image is held until the result of the next one is ready,
+  // valid is cleared by commit and set when the result is latched
+  reg [3:0] result_index;
+  reg [ARG_MAX_BITS-1:0] result_value;
+  reg result_valid;
+  always @(posedge clk) begin
+    if (!rst_n) begin
+      result_index <= 0;
+      result_value <= 0;
+      result_valid <= 0;
+    end else begin
+      if (sum_valid) begin
+        result_index <= best_category_index;
+        result_value <= best_category_value;
+      end
+      result_valid <= sum_valid | (result_valid & ~commit);
+    end
+  end
+`else
+  wire [3:0] result_index = best_category_index;
+  wire [ARG_MAX_BITS-1:0] result_value = best_category_value;
+  wire result_valid = sum_valid; // ~write_enable delayed by the pipeline
+`endif
+
   wire [6:0] display;
   seven_segment seven_segment(
-    .in(best_category_index[3:0]),
+    .in(result_index[3:0]),
     .out(display)
   );
 
-  // assign  uo_out[3:0] = best_category_index[3:0]; assign  uo_out[6:4] = 0;
+  // assign  uo_out[3:0] = result_index[3:0]; assign  uo_out[6:4] = 0;
   assign  uo_out[6:0] = display;
-  assign  uo_out[7] = ~write_enable;
-  assign  uo_out[15:8] = best_category_value[BITS_PER_CATEGORY_SUM-1 -: 8];
+  assign  uo_out[7] = result_valid;
+  assign  uo_out[15:8] = result_value[ARG_MAX_BITS-1 -: 8];
   /* verilator lint_on UNUSEDSIGNAL */
 endmodule
 
@@ -86,7 +171,11 @@ module sum_bits #(
     // end
     
     // assign sum = temp_sum;
+`ifdef POPCOUNT_TREE // net.v is generated with a compressor tree, see GENERATE_POPCOUNT_TREE
+    `POPCOUNT_TREE popcount(.y(y), .sum(sum));
+`else
     assign sum = $countones(y); 
+`endif
 endmodule
 
 module arg_max_10 #(
@@ -0,0 +1,137 @@
+import sys
+import json
+import numpy as np
+
+from npz_eval import get_network_layers
+from npz_to_verilog import load_npz_file, category_bits, get_conn_distance, optimize_network, \
+    ascii_graph, ascii_histogram, ascii_histogram_compressed, GATE_DEPENDS_ON_A, GATE_DEPENDS_ON_B, \
+    category_settings
+
+# Netlist analytics: tells quickly whether a checkpoint is worth sending through the flow.
+#
+# Nets are numbered by level: level 0 are the global inputs, level l+1 are the outputs of layer l.
+# Fanout of a net counts the gate input pins it drives (inputs ignored by the gate type are not wired),
+# nets of the last level drive the 'categories' bits. Nets without fanout are the ones
+# Verilator reports as %Warning-UNUSEDSIGNAL, gates outside of every category cone are
+# the ones synthesis removes.
+
+def fanout(conn_a, conn_b, gates, count):
+    # Number of input pins driven by every one of the count nets of the previous level
+    a = np.asarray(conn_a)[GATE_DEPENDS_ON_A[gates]]
+    b = np.asarray(conn_b)[GATE_DEPENDS_ON_B[gates]]
+    return np.bincount(a, minlength=count) + np.bincount(b, minlength=count)
+
+def category_cones(gates, conn_a, conn_b, input_count, number_of_categories=None, output_bits_per_category=None):
+    # Bit c of the returned uint64 masks is set for every net in the fan-in cone of category c,
+    # one mask array per level of nets
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    assert number_of_categories <= 64
+    bits = category_bits(len(gates[-1]), number_of_categories, output_bits_per_category)
+    mask = np.zeros(len(gates[-1]), dtype=np.uint64)
+    for c in range(number_of_categories):
+        mask[bits[c][bits[c] >= 0]] |= np.uint64(1 << c)
+
+    masks = [mask]
+    for l in range(len(gates) - 1, -1, -1):
+        g = np.asarray(gates[l])
+        prev = np.zeros(input_count if l == 0 else len(gates[l-1]), dtype=np.uint64)
+        use_a, use_b = GATE_DEPENDS_ON_A[g], GATE_DEPENDS_ON_B[g]
+        np.bitwise_or.at(prev, np.asarray(conn_a[l])[use_a], mask[use_a])
+        np.bitwise_or.at(prev, np.asarray(conn_b[l])[use_b], mask[use_b])
+        mask = prev
+        masks.append(mask)
+    return masks[::-1]
+
+def analyze_network(gates, conn_a, conn_b, number_of_categories=None, output_bits_per_category=None):
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    input_count = int(max(np.max(conn_a[0]), np.max(conn_b[0]))) + 1
+    nets = [input_count] + [len(g) for g in gates]
+    cones = category_cones(gates, conn_a, conn_b, input_count, number_of_categories, output_bits_per_category)
+
+    levels = []
+    for level, count in enumerate(nets):
+        if level < len(gates):
+            f = fanout(conn_a[level], conn_b[level], np.asarray(gates[level]), count)
+        else:
+            bits = category_bits(count, number_of_categories, output_bits_per_category)
+            f = np.bincount(bits[bits >= 0], minlength=count)
+        live = cones[level] != 0
+        per_category = [int(np.count_nonzero(cones[level] & np.uint64(1 << c))) for c in range(number_of_categories)]
+        stats = {   "level"             : level,
+                    "nets"              : int(count),
+                    "fanout_histogram"  : np.bincount(f).tolist(),
+                    "max_fanout"        : int(np.max(f, initial=0)),
+                    "max_fanout_nets"   : np.flatnonzero(f == np.max(f, initial=0))[:8].tolist(),
+                    "unused"            : int(np.count_nonzero(f == 0)),
+                    "live"              : int(np.count_nonzero(live)),
+                    "live_per_category" : per_category }
+
+        if level > 0:
+            l = level - 1
+            g = np.asarray(gates[l])
+            d = get_conn_distance(np.asarray(conn_a[l]), np.asarray(conn_b[l]), nets[l])
+            stats |= {  "gate_types"    : np.bincount(g, minlength=16).tolist(),
+                        "wire_total"    : int(np.sum(d)),
+                        "wire_max"      : int(np.max(d, initial=0)),
+                        "wire_avg"      : float(np.mean(d)) if len(d) > 0 else 0.0,
+                        "wire_live"     : int(np.sum(d[live])),
+                        "_distances"    : d }
+        stats["_fanout"] = f
+        levels.append(stats)
+
+    live_gates = sum(s["live"] for s in levels[1:])
+    return {"inputs"             : input_count,
+            "layers"             : len(gates),
+            "gates"              : int(sum(nets[1:])),
+            "predicted_gates"    : int(live_gates),
+            "unused_signals"     : int(sum(s["unused"] for s in levels)),
+            "predicted_wire"     : int(sum(s["wire_live"] for s in levels[1:])),
+            "levels"             : levels }
+
+def to_json(analysis):
+    # Drops the raw per net arrays, they are only used for the ASCII view
+    levels = [{k: v for k, v in s.items() if not k.startswith("_")} for s in analysis["levels"]]
+    return analysis | {"levels": levels}
+
+def print_analysis(analysis):
+    print()
+    print("Net statistics (level 0: inputs, level l+1: outputs of layer l):")
+    print("   ","  _ _   ___ _ _ ")
+    print("   ","0&⇒A⇐B⊕||⊕B⇐A⇒&1","   ","0..fanout.....>16","   ","0...4..........16..............32.... connection distance .....>64")
+    for s in analysis["levels"]:
+        gate_types = ascii_graph(np.array(s["gate_types"]))[0] if "gate_types" in s else " " * 16
+        distances = ascii_histogram(s["_distances"], size=64)[0] + " xx " + ascii_histogram_compressed(s["_distances"], bins=8)[0] \
+            if "_distances" in s and len(s["_distances"]) > 0 else ""
+        print(f"{s['level']:3}", gate_types, "   ", ascii_histogram(s["_fanout"], size=16)[0], "   ", distances)
+    print()
+    print(f"{'level':>5} {'nets':>8} {'live':>8} {'unused':>8} {'max fanout':>10} {'wire total':>12} {'wire max':>8} {'wire avg':>8}")
+    for s in analysis["levels"]:
+        wire = f"{s['wire_total']:>12} {s['wire_max']:>8} {s['wire_avg']:>8.1f}" if "wire_total" in s else ""
+        print(f"{s['level']:>5} {s['nets']:>8} {s['live']:>8} {s['unused']:>8} {s['max_fanout']:>10} {wire}")
+    print()
+    print("Live cone per category (gates):", [sum(s["live_per_category"][c] for s in analysis["levels"][1:])
+                                              for c in range(len(analysis["levels"][0]["live_per_category"]))])
+    print(f"Gates: {analysis['gates']}, live: {analysis['predicted_gates']} (the rest is dead logic, removed by synthesis)")
+    print(f"Unused signals (%Warning-UNUSEDSIGNAL): {analysis['unused_signals']}")
+    print(f"Predicted wire (live gates only): {analysis['predicted_wire']}")
+
+###########################################################################################
+
+if __name__ == "__main__":
+    optimized = "--optimized" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--optimized"]
+    if len(argv) != 2 and len(argv) != 3:
+        print(f"Usage: python {argv[0]} <input_npz_file_name> (optional: <output_json_file_name>) [--optimized]")
+        sys.exit(1)
+
+    data = load_npz_file(argv[1])
+    gates, conn_a, conn_b = get_network_layers(data)
+    if optimized:
+        gates, conn_a, conn_b = optimize_network(gates, conn_a, conn_b)
+
+    analysis = analyze_network(gates, conn_a, conn_b)
+    print_analysis(analysis)
+    if len(argv) == 3:
+        with open(argv[2], "w") as f:
+            json.dump(to_json(analysis), f, indent=1)
+        print(f"Analysis has been saved to '{argv[2]}'.")
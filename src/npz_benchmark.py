@@ -0,0 +1,162 @@
+import sys
+import io
+import os
+import json
+import time
+import tempfile
+import subprocess
+import contextlib
+from multiprocessing import Pool
+
+import numpy as np
+
+import stage_timer
+from stage_timer import stage
+from npz_to_verilog import npz_to_verilog
+
+# Converter benchmark on synthetic networks of configurable width (gates per layer) and depth (layers).
+#
+# Every configuration runs in a fresh worker process, so the peak RSS belongs to that configuration only.
+# pth_to_npz is measured on a synthetic checkpoint when torch is installed.
+# Results are appended to a history file (JSON lines) together with the git revision and compared
+# with the last recorded run of the same configuration, a throughput drop above REGRESSION_THRESHOLD fails the run.
+#
+#   python npz_benchmark.py widths=1000,10000,100000,1000000 depths=2,4 (optional: benchmark.jsonl)
+
+INPUTS = 16 * 16 * 4 # lgn.v: localparam INPUTS
+DEFAULT_WIDTHS = [1000, 10000, 100000]
+DEFAULT_DEPTHS = [2]
+REGRESSION_THRESHOLD = 0.2
+
+def synthetic_network(width, depth, seed=0):
+    # Random gate types and uniformly random connections, the worst case for the wire length reordering
+    rng = np.random.default_rng(seed)
+    in_counts = [INPUTS] + [width] * (depth - 1)
+    return {"gate_types"    : rng.integers(0, 16, size=(depth, width)),
+            "connections.A" : np.stack([rng.integers(0, n, size=width) for n in in_counts]),
+            "connections.B" : np.stack([rng.integers(0, n, size=width) for n in in_counts]),
+            "input"         : np.ones((1, 2), dtype=np.int64), # no test dataset, same as pth_to_npz default
+            "output"        : np.ones((1, 2), dtype=np.int64) }
+
+def synthetic_checkpoint(torch, data):
+    # Checkpoint in the layers.<i>.w / layers.<i>.indices layout that pth_to_npz() reads
+    checkpoint = {}
+    for i, (g, a, b) in enumerate(zip(data["gate_types"], data["connections.A"], data["connections.B"])):
+        w = torch.randn(16, len(g))
+        w[torch.from_numpy(g), torch.arange(len(g))] += 100 # argmax picks the gate type
+        checkpoint[f"layers.{i}.w"] = w
+        checkpoint[f"layers.{i}.indices"] = torch.from_numpy(np.stack([a, b], axis=-1).reshape(-1))
+    return checkpoint
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_benchmark(config):
+    width, depth = config
+    stage_timer.reset()
+    result = {"width": width, "depth": depth, "gates": width * depth}
+    with contextlib.redirect_stdout(io.StringIO()):
+        with stage("synthetic network"):
+            data = synthetic_network(width, depth)
+
+        try:
+            import torch
+            import pth_to_npz
+        except ImportError:
+            torch = None
+        if torch is not None:
+            checkpoint = synthetic_checkpoint(torch, data)
+            start = time.perf_counter()
+            with stage("pth_to_npz"):
+                pth_to_npz.pth_to_npz(checkpoint)
+            result["pth_to_npz_gates_per_second"] = width * depth / (time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            with stage("npz_to_verilog"), open(os.path.join(path, "net.v"), "w") as f:
+                npz_to_verilog(data, f=f)
+            result["npz_to_verilog_gates_per_second"] = width * depth / (time.perf_counter() - start)
+
+    return result | stage_timer.timing_report()
+
+def last_runs(history_file_name):
+    # Last recorded result of every (width, depth) configuration
+    runs = {}
+    if history_file_name is not None and os.path.exists(history_file_name):
+        with open(history_file_name) as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    runs[(r["width"], r["depth"])] = r
+    return runs
+
+def compare(result, previous):
+    # Relative throughput change of npz_to_verilog against the previous run, None without one
+    if previous is None:
+        return None
+    return result["npz_to_verilog_gates_per_second"] / previous["npz_to_verilog_gates_per_second"] - 1
+
+def print_results(results):
+    print()
+    print(f"{'width':>8} {'depth':>5} {'gates':>9} {'pth_to_npz g/s':>15} {'npz_to_verilog g/s':>19} {'peak RSS MB':>12} {'vs. last':>18}")
+    for r in results:
+        pth = f"{r['pth_to_npz_gates_per_second']:>15.0f}" if "pth_to_npz_gates_per_second" in r else f"{'-':>15}"
+        change = f"{r['change']*100:+7.1f}% ({r['previous_revision']})" if r["change"] is not None else "-"
+        print(f"{r['width']:>8} {r['depth']:>5} {r['gates']:>9} {pth} {r['npz_to_verilog_gates_per_second']:>19.0f} {r['peak_rss_mb']:>12.1f} {change:>18}"
+              + ("   REGRESSION" if r["regression"] else ""))
+    print()
+    print("Slowest stages:")
+    for r in results:
+        leaves = [s for s in r["stages"] if not any(t["stage"].startswith(s["stage"] + "/") for t in r["stages"])]
+        top = sorted(leaves, key=lambda s: -s["seconds"])[:3]
+        print(f"{r['width']:>8} x {r['depth']}:", ", ".join(f"{s['stage']} {s['seconds']:.2f}s" for s in top))
+
+###########################################################################################
+
+if __name__ == "__main__":
+    widths, depths, history_file_name = DEFAULT_WIDTHS, DEFAULT_DEPTHS, None
+    for arg in sys.argv[1:]:
+        if arg.startswith("widths="):
+            widths = [int(w) for w in arg.split("=", 1)[1].split(",")]
+        elif arg.startswith("depths="):
+            depths = [int(d) for d in arg.split("=", 1)[1].split(",")]
+        elif arg.endswith(".jsonl"):
+            history_file_name = arg
+        else:
+            print(f"Usage: python {sys.argv[0]} (optional: widths=<gates>,<gates>,...) (optional: depths=<layers>,...) (optional: <history_jsonl_file_name>)")
+            sys.exit(1)
+
+    configs = [(w, d) for d in depths for w in widths]
+    revision = git_revision()
+    previous = last_runs(history_file_name)
+    print(f"Benchmarking {len(configs)} configuration(s) at revision {revision}...")
+
+    results = []
+    # one configuration at a time for stable timings, fresh process for the peak RSS
+    with Pool(1, maxtasksperchild=1) as pool:
+        for r in pool.imap(run_benchmark, configs):
+            last = previous.get((r["width"], r["depth"]))
+            r |= {  "revision"          : revision,
+                    "timestamp"         : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "change"            : compare(r, last),
+                    "previous_revision" : last["revision"] if last else None }
+            r["regression"] = r["change"] is not None and r["change"] < -REGRESSION_THRESHOLD
+            print(f"{r['width']} x {r['depth']}: {r['npz_to_verilog_gates_per_second']:.0f} gates/s, peak RSS {r['peak_rss_mb']:.1f} MB")
+            results.append(r)
+
+    print_results(results)
+
+    if history_file_name is not None:
+        with open(history_file_name, "a") as f:
+            for r in results:
+                f.write(json.dumps(r) + "\n")
+        print(f"Results have been appended to '{history_file_name}'.")
+
+    regressions = [r for r in results if r["regression"]]
+    if regressions:
+        print(f"Throughput dropped more than {REGRESSION_THRESHOLD*100:.0f}% in {len(regressions)} configuration(s).")
+        sys.exit(1)
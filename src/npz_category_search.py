@@ -0,0 +1,151 @@
+import sys
+import json
+import numpy as np
+
+import npz_to_verilog
+from npz_to_verilog import load_npz_file, category_bits, npz_to_verilog as generate_net
+from npz_eval import get_network_layers, pack_bits, unpack_bits, eval_network, arg_max_10, expected_categories
+from npz_sweep import pareto_front
+from popcount_tree import popcount_netlist, sum_width
+
+# Search for a cheaper popcount in front of arg_max_10.
+#
+# Summing all bits of every category is expensive, while arg_max usually needs only coarse counts
+# or a subset of the bits. Options:
+#   * first  - first N bits of every category, same as a smaller OUTPUT_BITS_PER_CATEGORY
+#   * ranked - N bits of every category that best separate its exact decisions from the other ones
+#   * LSBs of the sums dropped before arg_max_10
+# Reference is the exact decision of the current wiring, not a ground truth: the 'output' of the .npz
+# holds what the trained network itself produced. So every option is scored by its agreement with
+# the exact decision. Bits are ranked on a selection split of the test dataset and all options are
+# scored on the held-out rest, so the agreement is not measured on the samples the bits were picked with.
+# Chosen option is the smallest one within the agreement loss budget, it is saved as .json
+# for CATEGORY_CONFIG in npz_to_verilog.py, which wires it into 'categories' and sets lgn.v parameters.
+#
+#   python npz_category_search.py net.npz (optional: <max_agreement_loss_%>) (optional: categories.json) (optional: net.v)
+
+WIDTHS = [800, 640, 511, 400, 320, 256, 255, 200, 160] # sums keep at least 8 bits for uo_out[15:8]
+SELECTIONS = ["first", "ranked"]
+HELD_OUT_FRACTION = 0.5
+
+# Rough area relative to a full adder
+HALF_ADDER_AREA = 0.5
+COMPARATOR_BIT_AREA = 1.0 # arg_max_10: comparator and value multiplexer per bit
+
+def category_planes(out, count, bits):
+    # [samples, categories, bits] matrix of the 'out' bits wired into every category, unwired ones are 0
+    y = unpack_bits(out[np.maximum(bits, 0).reshape(-1)], count).reshape(count, *bits.shape)
+    return y & (bits >= 0)
+
+def rank_bits(y, decisions):
+    # Order of the bits in every category by how much more often they are set
+    # for samples decided as that category than for the other samples
+    order = []
+    for c in range(y.shape[1]):
+        own = decisions == c
+        score = y[own, c].mean(axis=0) - y[~own, c].mean(axis=0) if np.any(own) and not np.all(own) else np.zeros(y.shape[2])
+        order.append(np.argsort(-score, kind="stable"))
+    return np.array(order)
+
+def adder_area(number_of_categories, width, truncate_lsb):
+    adders, _ = popcount_netlist(width)
+    full = sum(a[0] == "popcount_fa" for a in adders) * number_of_categories
+    half = sum(a[0] == "popcount_ha" for a in adders) * number_of_categories
+    comparator_bits = (number_of_categories - 1) * (sum_width(width) - truncate_lsb)
+    return {"full_adders"     : int(full),
+            "half_adders"     : int(half),
+            "comparator_bits" : int(comparator_bits),
+            "area"            : float(full + half * HALF_ADDER_AREA + comparator_bits * COMPARATOR_BIT_AREA)}
+
+def split_samples(count, held_out_fraction=HELD_OUT_FRACTION, seed=0):
+    # Returns (selection, held-out) sample indices
+    order = np.random.default_rng(seed).permutation(count)
+    held_out = max(1, min(count - 1, int(round(count * held_out_fraction)))) if count > 1 else count
+    return np.sort(order[held_out:]), np.sort(order[:held_out])
+
+def search(y, bits, outputs, widths=WIDTHS):
+    # y: category bits of every sample, outputs: categories of the dataset 'output'
+    count, number_of_categories, available = y.shape
+    exact = arg_max_10(y.sum(axis=-1, dtype=np.int64) & ((1 << sum_width(available)) - 1))
+    selection, held_out = split_samples(count)
+    ranked = rank_bits(y[selection], exact[selection])
+    y, exact, outputs = y[held_out], exact[held_out], outputs[held_out]
+    exact_output_agreement = float(np.mean(exact == outputs))
+    orders = {"first": np.tile(np.arange(available), (number_of_categories, 1)), "ranked": ranked}
+
+    options = []
+    for width in sorted({w for w in widths + [available] if w <= available and sum_width(w) >= 8}, reverse=True):
+        for selection_name in SELECTIONS:
+            order = orders[selection_name][:, :width]
+            sums = np.take_along_axis(y, order[None], axis=-1).sum(axis=-1, dtype=np.int64)
+            sums &= (1 << sum_width(width)) - 1 # sum_bits truncates to $clog2(N) bits
+            for truncate_lsb in range(sum_width(width) - 8 + 1):
+                predicted = arg_max_10(sums >> truncate_lsb)
+                agreement = float(np.mean(predicted == exact))
+                options.append({"bits_per_category" : width,
+                                "selection"         : selection_name,
+                                "truncate_lsb"      : truncate_lsb,
+                                "agreement"         : agreement,
+                                "agreement_loss"    : 1 - agreement,
+                                "output_agreement"  : float(np.mean(predicted == outputs)),
+                                "held_out_samples"  : len(held_out),
+                                "_bits"             : np.take_along_axis(bits, order, axis=-1) }
+                               | adder_area(number_of_categories, width, truncate_lsb))
+    return exact_output_agreement, options
+
+def choose(options, max_agreement_loss):
+    within = [o for o in options if o["agreement_loss"] <= max_agreement_loss]
+    return min(within, key=lambda o: (o["area"], o["agreement_loss"]))
+
+def print_options(exact_output_agreement, options, chosen):
+    front = pareto_front([(o["agreement_loss"], o["area"]) for o in options])
+    print()
+    print(f"Held-out samples: {options[0]['held_out_samples']}, exact decision agrees with the dataset 'output' on {exact_output_agreement*100:.2f}%")
+    print(f"  {'bits':>5} {'selection':>9} {'lsb':>3} {'agreement':>9} {'loss':>7} {'output':>7} {'FA':>6} {'HA':>5} {'cmp':>4} {'area':>8}")
+    for o, is_front in zip(options, front):
+        mark = ">" if o is chosen else "*" if is_front else " "
+        print(mark, f"{o['bits_per_category']:>5} {o['selection']:>9} {o['truncate_lsb']:>3} {o['agreement']*100:8.2f}% {o['agreement_loss']*100:6.2f}% "
+                    f"{o['output_agreement']*100:6.2f}% {o['full_adders']:>6} {o['half_adders']:>5} {o['comparator_bits']:>4} {o['area']:>8.0f}")
+    print("agreement: with the exact decision, output: with the dataset 'output', both on the held-out samples")
+    print("* Pareto front: agreement loss vs. adder area (in full adders), > chosen")
+
+def save_config(file_name, option, exact_output_agreement):
+    config = {k: v for k, v in option.items() if not k.startswith("_")} | {"exact_output_agreement": exact_output_agreement, "bits": option["_bits"].tolist()}
+    with open(file_name, "w") as f:
+        json.dump(config, f)
+
+###########################################################################################
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or len(sys.argv) > 5:
+        print(f"Usage: python {sys.argv[0]} <input_npz_file_name> (optional: <max_agreement_loss_percent>) (optional: <output_json_file_name>) (optional: <output_verilog_file_name>)")
+        sys.exit(1)
+
+    max_agreement_loss = float(sys.argv[2]) / 100 if len(sys.argv) > 2 else 0.005
+    json_file_name = sys.argv[3] if len(sys.argv) > 3 else "categories.json"
+
+    data = load_npz_file(sys.argv[1])
+    X = np.asarray(data['input'])
+    gates, conn_a, conn_b = get_network_layers(data)
+    if X.ndim != 2 or X.shape[-1] < int(max(np.max(conn_a[0]), np.max(conn_b[0]))) + 1:
+        print(f"No test dataset included, 'input' shape: {X.shape}")
+        sys.exit(1)
+
+    npz_to_verilog.CATEGORY_CONFIG = None # search starts from the full wiring
+    bits = category_bits(len(gates[-1]))
+    out = eval_network(pack_bits(X), gates, conn_a, conn_b)
+    exact_output_agreement, options = search(category_planes(out, len(X), bits), bits, expected_categories(data['output']))
+    chosen = choose(options, max_agreement_loss)
+    print_options(exact_output_agreement, options, chosen)
+
+    save_config(json_file_name, chosen, exact_output_agreement)
+    print(f"Chosen: {chosen['bits_per_category']} {chosen['selection']} bits per category, {chosen['truncate_lsb']} truncated LSBs, "
+          f"agreement loss {chosen['agreement_loss']*100:.2f}% on held-out samples, saved to '{json_file_name}'.")
+    print(f"Set CATEGORY_CONFIG = \"{json_file_name}\" in npz_to_verilog.py to generate net.v with it.")
+
+    if len(sys.argv) > 4:
+        npz_to_verilog.CATEGORY_CONFIG = json_file_name
+        with open(sys.argv[4], "w") as f:
+            f.write(f"// Generated from: {sys.argv[1]}, categories: {json_file_name}\n")
+            generate_net(data, -1, f)
+        print(f"Verilog code has been generated and saved to '{sys.argv[4]}'.")
@@ -0,0 +1,240 @@
+import sys
+import time
+import numpy as np
+
+from npz_file import network_layers
+from npz_to_verilog import load_npz_file, add_missing_input_connections, category_bits, sum_truncate_lsb, op, \
+    category_settings, category_config
+
+# Bit-parallel reference simulator for the networks stored in .npz files.
+#
+# Test samples are packed 64 per uint64 word (bitplanes), so a whole layer
+# for the whole test set is just 2 gathers and a handful of bitwise ops
+# over [number_of_gates, number_of_words] arrays.
+
+WORD_BITS = 64
+
+def pack_bits(samples):
+    # [samples, bits] -> [bits, words] bitplanes, sample i is bit i%64 of word i//64
+    samples = np.asarray(samples) != 0
+    words = (samples.shape[0] + WORD_BITS - 1) // WORD_BITS
+    packed = np.packbits(samples.T, axis=1, bitorder='little')
+    packed = np.pad(packed, ((0, 0), (0, words * WORD_BITS // 8 - packed.shape[1])))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+def unpack_bits(planes, count):
+    # [bits, words] bitplanes -> [samples, bits]
+    planes = np.ascontiguousarray(planes)
+    return np.unpackbits(planes.view(np.uint8), axis=1, count=count, bitorder='little').T
+
+def gate_masks(gates):
+    # Gate type is the truth table of the gate, see op() in npz_to_verilog.py:
+    #   bit 3: ~A & ~B, bit 2: ~A & B, bit 1: A & ~B, bit 0: A & B
+    # Every bit is expanded into a full word mask.
+    gates = np.asarray(gates).astype(np.uint64)[:, None]
+    return [np.uint64(0) - ((gates >> np.uint64(bit)) & np.uint64(1)) for bit in (3, 2, 1, 0)]
+
+def eval_layer(x, gates, conn_a, conn_b):
+    a = x[conn_a]
+    b = x[conn_b]
+    m00, m01, m10, m11 = gate_masks(gates)
+    return (m00 & ~(a | b)) | (m01 & ~a & b) | (m10 & a & ~b) | (m11 & a & b)
+
+def eval_network(x, gates, conn_a, conn_b, trace=None):
+    # x: input bitplanes, returns bitplanes of the last layer.
+    # If trace list is passed, bitplanes of every layer are appended to it.
+    assert len(gates) == len(conn_a) == len(conn_b)
+    for layer_gates, layer_conn_a, layer_conn_b in zip(gates, conn_a, conn_b):
+        x = eval_layer(x, layer_gates, layer_conn_a, layer_conn_b)
+        if trace is not None:
+            trace.append(x)
+    return x
+
+def get_network_layers(data, max_layers=-1):
+    # Same layers that npz_to_verilog() turns into Verilog
+    gates, conn_a, conn_b = network_layers(data)
+    conn_a, conn_b = add_missing_input_connections(gates, conn_a, conn_b)
+    if max_layers > 0 and len(gates) > max_layers:
+        gates, conn_a, conn_b = gates[:max_layers], conn_a[:max_layers], conn_b[:max_layers]
+    return gates, conn_a, conn_b
+
+def sum_bits(planes, count, bits_per_category=None):
+    # sum_bits module in lgn.v: $countones truncated to $clog2(N) bits
+    _, bits_per_category = category_settings(None, bits_per_category)
+    total = unpack_bits(planes, count).sum(axis=-1, dtype=np.int64)
+    return total & ((1 << (bits_per_category - 1).bit_length()) - 1)
+
+def arg_max_10(sums):
+    # arg_max_10 module in lgn.v: comparisons use '>', so the last maximum wins ties
+    return sums.shape[-1] - 1 - np.argmax(sums[..., ::-1], axis=-1)
+
+def classify(out, count, number_of_categories=None, output_bits_per_category=None):
+    # out: bitplanes of the last layer, returns category sums and the winning category per sample
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    bits = category_bits(len(out), number_of_categories, output_bits_per_category)
+    sums = np.zeros((count, number_of_categories), dtype=np.int64)
+    for i in range(number_of_categories):
+        wired = bits[i][bits[i] >= 0]
+        sums[:, i] = sum_bits(out[wired], count, bits.shape[1])
+    return sums, arg_max_10(sums >> sum_truncate_lsb())
+
+def expected_results(y, number_of_categories=None):
+    # Dataset 'output' holds either output bits of the last layer or already summed categories.
+    # Returns the winning category and the value that lgn.v shows on uo_out[15:8] for every sample,
+    # output bits are wired into the categories like in net.v, CATEGORY_CONFIG included.
+    number_of_categories, bits_per_category = category_settings(number_of_categories)
+    y = np.asarray(y)
+    if y.shape[-1] == number_of_categories:
+        sums = y.astype(np.int64)
+        config = category_config()
+        if config is not None:
+            bits_per_category = len(config["bits"][0])
+    else:
+        sums, _ = classify(pack_bits(y), len(y), number_of_categories)
+        bits_per_category = category_bits(y.shape[-1], number_of_categories).shape[1]
+    sums = sums >> sum_truncate_lsb()
+    categories = arg_max_10(sums)
+    value_bits = (bits_per_category - 1).bit_length() - sum_truncate_lsb() # ARG_MAX_BITS in lgn.v
+    values = np.take_along_axis(sums, categories[:, None], axis=-1)[:, 0] >> max(value_bits - 8, 0)
+    return categories, values
+
+def expected_categories(y, number_of_categories=None):
+    return expected_results(y, number_of_categories)[0]
+
+def verify_equivalence(global_inputs, network, optimized_network, samples=4096, seed=0):
+    # Raises if the bits wired into 'categories' differ on random inputs
+    X = pack_bits(np.random.default_rng(seed).integers(0, 2, size=(samples, global_inputs)))
+    before = eval_network(X, *network)
+    after = eval_network(X, *optimized_network)
+    bits_before = category_bits(len(before))
+    bits_after = category_bits(len(after))
+    assert np.array_equal(bits_before >= 0, bits_after >= 0)
+    mismatch = np.flatnonzero(np.any(before[bits_before[bits_before >= 0]] != after[bits_after[bits_after >= 0]], axis=-1))
+    if len(mismatch) > 0:
+        raise RuntimeError(f"Optimized network differs from the original one in {len(mismatch)} category bits, first: {mismatch[:8]}")
+    print(f"Verified optimized network against the original one on {samples} random inputs.")
+
+def eval_levels(samples, gates, conn_a, conn_b):
+    # Values of every net for every sample: [samples, nets] array per level,
+    # level 0 are the inputs and level l+1 the outputs of layer l (same numbering as npz_analyze.py)
+    samples = (np.asarray(samples) != 0).astype(np.uint8)
+    trace = []
+    eval_network(pack_bits(samples), gates, conn_a, conn_b, trace)
+    return [samples] + [unpack_bits(x, len(samples)) for x in trace]
+
+def expand_emitted(simulated, emitted, gates, conn_a, conn_b):
+    # Levels sampled from a simulator only hold the nets emitted_wires() marks, collapsed buffers (A, B)
+    # are filled in with the net they buffer, so levels can be compared with eval_levels()
+    levels = [simulated[0]]
+    for l, (s, mask) in enumerate(zip(simulated[1:], emitted[1:])):
+        if s.shape[-1] != np.count_nonzero(mask):
+            raise ValueError(f"Level {l+1} has {s.shape[-1]} simulated nets, {np.count_nonzero(mask)} emitted: net.v is generated from a different network or settings")
+        level = np.empty((len(s), len(mask)), dtype=s.dtype)
+        level[:, mask] = s
+        source = np.where(np.asarray(gates[l]) == 3, conn_a[l], conn_b[l])
+        level[:, ~mask] = levels[l][:, source[~mask]]
+        levels.append(level)
+    return levels
+
+def first_divergence(expected, simulated, gates, conn_a, conn_b):
+    # Compares per level values from eval_levels() with the ones sampled from a simulator,
+    # simulated values other than 0 and 1 are X/Z. Returns the first divergent net of the first
+    # divergent level, together with the inputs of its gate, or None if everything matches.
+    for level, (e, s) in enumerate(zip(expected, simulated)):
+        if e.shape != s.shape:
+            raise ValueError(f"Level {level} has {s.shape[-1]} simulated nets, {e.shape[-1]} expected: net.v is generated from a different network or settings")
+        diff = e != s
+        if not np.any(diff):
+            continue
+        divergent = np.any(diff, axis=0)
+        net = int(np.argmax(divergent))
+        sample = int(np.argmax(diff[:, net]))
+        divergence = {  "level"             : level,
+                        "net"               : net,
+                        "sample"            : sample,
+                        "divergent_nets"    : int(np.count_nonzero(divergent)),
+                        "divergent_samples" : int(np.count_nonzero(np.any(diff, axis=1))),
+                        "simulated"         : int(s[sample, net]),
+                        "expected"          : int(e[sample, net]) }
+        if level > 0:
+            l = level - 1
+            a, b = int(conn_a[l][net]), int(conn_b[l][net])
+            divergence |= { "gate_type"     : int(gates[l][net]),
+                            "conn_a"        : a,
+                            "conn_b"        : b,
+                            "simulated_a"   : int(simulated[l][sample, a]),
+                            "simulated_b"   : int(simulated[l][sample, b]),
+                            "expected_a"    : int(expected[l][sample, a]),
+                            "expected_b"    : int(expected[l][sample, b]) }
+        return divergence
+    return None
+
+def print_divergence(divergence):
+    if divergence is None:
+        print("All levels match the reference evaluation.")
+        return
+    d = divergence
+    value = lambda v: "01"[v] if v in (0, 1) else "x"
+    print(f"First divergence at level {d['level']} ({'inputs' if d['level'] == 0 else 'outputs of layer ' + str(d['level'] - 1)}), "
+          f"net {d['net']}, sample {d['sample']}: simulated {value(d['simulated'])}, expected {value(d['expected'])}")
+    print(f"Divergent nets in this level: {d['divergent_nets']}, divergent samples: {d['divergent_samples']}")
+    if d['level'] == 0:
+        print("Inputs of the net differ: check how the samples are loaded into 'x'")
+        return
+    print(f"Gate type {d['gate_type']}: {op(d['gate_type'], 'A', 'B')}, A = in[{d['conn_a']}], B = in[{d['conn_b']}]")
+    print(f"  simulated: A={value(d['simulated_a'])} B={value(d['simulated_b'])} -> {value(d['simulated'])}")
+    print(f"  expected:  A={value(d['expected_a'])} B={value(d['expected_b'])} -> {value(d['expected'])}")
+    if (d['simulated_a'], d['simulated_b']) == (d['expected_a'], d['expected_b']):
+        print("Inputs match, the gate itself is converted wrong")
+
+#--- CORE function ------------------------------------------------------------------------
+
+def evaluate_npz(data, max_layers=-1):
+    gates, conn_a, conn_b = get_network_layers(data, max_layers)
+    X = np.asarray(data['input'])
+    Y = np.asarray(data['output'])
+    global_inputs = max(np.max(conn_a[0]), np.max(conn_b[0])) + 1
+    if X.ndim != 2 or X.shape[-1] < global_inputs:
+        print(f"No test dataset included, 'input' shape: {X.shape}")
+        return None
+
+    count = len(X)
+    start = time.perf_counter()
+    out = eval_network(pack_bits(X), gates, conn_a, conn_b)
+    sums, predicted = classify(out, count)
+    elapsed = time.perf_counter() - start
+
+    expected = expected_categories(Y)
+    result = {  "samples"   : count,
+                "predicted" : predicted,
+                "expected"  : expected,
+                "sums"      : sums,
+                "accuracy"  : np.mean(predicted == expected),
+                "seconds"   : elapsed }
+
+    if Y.shape[-1] != category_settings()[0]:
+        # compare last layer bit by bit, network output might be wider than the dataset
+        y = unpack_bits(out[:Y.shape[-1]], count)
+        result["mismatched_samples"] = np.flatnonzero(np.any(y != (Y != 0), axis=-1))
+    return result
+
+###########################################################################################
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 and len(sys.argv) != 3:
+        print(f"Usage: python {sys.argv[0]} <input_npz_file_name> (optional: <max_layers>)")
+        sys.exit(1)
+
+    max_layers = -1
+    if len(sys.argv) > 2:
+        max_layers = int(sys.argv[2])
+
+    data = load_npz_file(sys.argv[1])
+    result = evaluate_npz(data, max_layers)
+    if result is None:
+        sys.exit(1)
+
+    print(f"Evaluated {result['samples']} samples in {result['seconds']:.3f}s")
+    if "mismatched_samples" in result:
+        print(f"Samples with mismatched output bits: {len(result['mismatched_samples'])}")
+    print(f"Accuracy: {result['accuracy']*100:.2f}%")
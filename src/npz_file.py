@@ -0,0 +1,224 @@
+import os
+import struct
+import zipfile
+import numpy as np
+from collections.abc import Mapping
+
+# Lazy, memory-mapped access to networks stored as an uncompressed .npz
+# (np.savez, what pth_to_npz writes) or as a directory of .npy files.
+#
+# Only the .npy headers are read when the file is opened. Arrays are mapped on first access,
+# so pages are read only when used and are shared between processes working on the same file.
+# Default 'c' (copy-on-write) mode keeps the arrays writable without touching the file.
+
+def read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    if version == (2, 0):
+        return np.lib.format.read_array_header_2_0(f)
+    raise ValueError(f"Unsupported .npy format version: {version}")
+
+class LazyNpz(Mapping):
+    def __init__(self, file_name, mmap_mode='c'):
+        self.file_name = file_name
+        self.mmap_mode = mmap_mode
+        self.is_dir = os.path.isdir(file_name)
+        self.headers = {} # key -> (shape, fortran_order, dtype)
+        self.offsets = {} # key -> file offset of the array data, None if it can not be mapped
+        self.arrays = {}
+
+        if self.is_dir:
+            for name in sorted(os.listdir(file_name)):
+                if name.endswith(".npy"):
+                    with open(os.path.join(file_name, name), "rb") as f:
+                        self.headers[name[:-4]] = read_npy_header(f)
+                        self.offsets[name[:-4]] = f.tell()
+            return
+
+        with zipfile.ZipFile(file_name) as z, open(file_name, "rb") as f:
+            for info in z.infolist():
+                if not info.filename.endswith(".npy"):
+                    continue
+                key = info.filename[:-4]
+                if info.compress_type == zipfile.ZIP_STORED:
+                    # array data follows the local file header of the zip member
+                    f.seek(info.header_offset)
+                    name_length, extra_length = struct.unpack("<HH", f.read(30)[26:30])
+                    f.seek(info.header_offset + 30 + name_length + extra_length)
+                    self.headers[key] = read_npy_header(f)
+                    self.offsets[key] = f.tell()
+                else:
+                    with z.open(info) as member:
+                        self.headers[key] = read_npy_header(member)
+                    self.offsets[key] = None
+
+    def shape(self, key):
+        return self.headers[key][0]
+
+    def dtype(self, key):
+        return self.headers[key][2]
+
+    def load(self, key):
+        shape, fortran_order, dtype = self.headers[key]
+        if self.is_dir:
+            return np.load(os.path.join(self.file_name, key + ".npy"), mmap_mode=self.mmap_mode)
+        if self.offsets[key] is None or dtype.hasobject or self.mmap_mode is None:
+            with zipfile.ZipFile(self.file_name) as z, z.open(key + ".npy") as member:
+                return np.lib.format.read_array(member, allow_pickle=dtype.hasobject)
+        if np.prod(shape) == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.file_name, dtype=dtype, mode=self.mmap_mode, offset=self.offsets[key],
+                         shape=shape, order='F' if fortran_order else 'C')
+
+    def __getitem__(self, key):
+        if key not in self.arrays:
+            if key not in self.headers:
+                raise KeyError(key)
+            self.arrays[key] = self.load(key)
+        return self.arrays[key]
+
+    def __iter__(self):
+        return iter(self.headers)
+
+    def __len__(self):
+        return len(self.headers)
+
+def save_npy_dir(dir_name, npz_data):
+    # Directory of .npy files, every array can be memory-mapped by np.load(mmap_mode=...)
+    os.makedirs(dir_name, exist_ok=True)
+    for key, value in npz_data.items():
+        np.save(os.path.join(dir_name, key + ".npy"), np.asarray(value))
+
+def network_layers(data):
+    # Returns gate types and connections as lists of per layer arrays.
+    # Ragged networks are stored as flat arrays split by 'layer_sizes',
+    # otherwise every row of the 2-D arrays is a layer.
+    gates, conn_a, conn_b = data['gate_types'], data['connections.A'], data['connections.B']
+    if 'layer_sizes' not in data:
+        return list(gates), list(conn_a), list(conn_b)
+
+    sizes = np.asarray(data['layer_sizes'])
+    conn_sizes = sizes if len(conn_a) == np.sum(sizes) else sizes[1:] # first connection layer might be missing
+    def split(x, sizes):
+        return np.split(np.asarray(x), np.cumsum(sizes)[:-1])
+    return split(gates, sizes), split(conn_a, conn_sizes), split(conn_b, conn_sizes)
+
+#--- Packed format ------------------------------------------------------------------------
+#
+# Version 1:
+#   format_version       : 1
+#   gate_types.nibbles   : uint8, two 4-bit gate types per byte (even index in the low nibble)
+#   gate_types.shape     : shape of the gate_types array
+#   connections.A/B      : narrowest unsigned dtype that fits the connection indices
+#   <key>.bits/.shape    : binary arrays (test dataset) packed 8 values per byte
+#   layer_sizes          : (ragged networks only) number of gates in every layer
+# Any other array is stored as is. Readers get back the original keys, gate types and connections
+# are widened to int64 on access so the arithmetic in npz_to_verilog() can not overflow,
+# binary arrays are unpacked to uint8.
+
+PACKED_FORMAT_VERSION = 1
+
+def narrowest_uint_dtype(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+def is_binary(value):
+    return value.dtype.kind in "biu" and value.size > 0 and np.all((value == 0) | (value == 1))
+
+def pack_network(npz_data):
+    packed = {"format_version": np.array(PACKED_FORMAT_VERSION)}
+    for key in npz_data.keys():
+        value = np.asarray(npz_data[key])
+        if key == 'gate_types':
+            nibbles = value.astype(np.uint8).reshape(-1)
+            nibbles = np.pad(nibbles, (0, len(nibbles) % 2))
+            packed[key + '.nibbles'] = nibbles[0::2] | (nibbles[1::2] << 4)
+            packed[key + '.shape'] = np.array(value.shape)
+        elif key.startswith('connections.'):
+            packed[key] = value.astype(narrowest_uint_dtype(np.max(value, initial=0)))
+        elif is_binary(value):
+            packed[key + '.bits'] = np.packbits(value.reshape(-1).astype(bool))
+            packed[key + '.shape'] = np.array(value.shape)
+        else:
+            packed[key] = value
+    return packed
+
+class PackedNpz(Mapping):
+    # Decodes packed format on access, wraps LazyNpz
+    def __init__(self, packed):
+        version = int(packed['format_version'])
+        if version != PACKED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported packed network format version: {version}")
+        self.packed = packed
+        self.arrays = {}
+        self.keys_ = []
+        for key in packed.keys():
+            if key == 'format_version' or key.endswith('.shape'):
+                continue
+            self.keys_.append(key.removesuffix('.nibbles').removesuffix('.bits'))
+
+    def shape(self, key):
+        if key + '.shape' in self.packed:
+            return tuple(int(x) for x in self.packed[key + '.shape'])
+        return self.packed.shape(key)
+
+    def dtype(self, key):
+        if key == 'gate_types' or key.startswith('connections.'):
+            return np.dtype(np.int64)
+        if key + '.bits' in self.packed:
+            return np.dtype(np.uint8)
+        return self.packed.dtype(key)
+
+    def load(self, key):
+        if key == 'gate_types':
+            packed = np.asarray(self.packed[key + '.nibbles'])
+            nibbles = np.stack([packed & 15, packed >> 4], axis=-1).reshape(-1)
+            return nibbles[:np.prod(self.shape(key))].astype(np.int64).reshape(self.shape(key))
+        if key.startswith('connections.'):
+            return np.asarray(self.packed[key]).astype(np.int64)
+        if key + '.bits' in self.packed:
+            count = int(np.prod(self.shape(key)))
+            return np.unpackbits(np.asarray(self.packed[key + '.bits']), count=count).reshape(self.shape(key))
+        return self.packed[key]
+
+    def __getitem__(self, key):
+        if key not in self.arrays:
+            if key not in self.keys_:
+                raise KeyError(key)
+            self.arrays[key] = self.load(key)
+        return self.arrays[key]
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+def open_network(file_name, mmap_mode='c'):
+    # Reader for every network layout: plain or packed, .npz or a directory of .npy files
+    data = LazyNpz(file_name, mmap_mode)
+    if 'format_version' in data:
+        return PackedNpz(data)
+    return data
+
+def save_packed_npz(file_name, npz_data, compress=False):
+    packed = pack_network(npz_data)
+    if compress:
+        np.savez_compressed(file_name, **packed)
+    else:
+        np.savez(file_name, **packed)
+
+###########################################################################################
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or len(sys.argv) > 4 or (len(sys.argv) == 4 and sys.argv[3] != "--compress"):
+        print(f"Usage: python {sys.argv[0]} <input_npz_file_name> <output_packed_npz_file_name> [--compress]")
+        sys.exit(1)
+
+    save_packed_npz(sys.argv[2], open_network(sys.argv[1]), compress=len(sys.argv) == 4)
+    before, after = os.path.getsize(sys.argv[1]), os.path.getsize(sys.argv[2])
+    print(f"Packed '{sys.argv[1]}' into '{sys.argv[2]}': {before} -> {after} bytes ({before / after:.1f}x smaller)")
@@ -0,0 +1,133 @@
+import sys
+import io
+import os
+import ast
+import json
+import time
+import itertools
+import contextlib
+from multiprocessing import Pool
+
+import numpy as np
+
+import npz_to_verilog
+from npz_to_verilog import load_npz_file, build_network, network_tensors
+from npz_eval import pack_bits, eval_network, classify, expected_categories
+
+# Parameter sweep over the generator settings that are module-level globals in npz_to_verilog.py.
+# Every variant runs in a worker process with its own copy of the globals and of the network,
+# accuracy is measured with the bit-level reference simulator on the test dataset of the .npz.
+# Prints all variants and marks the Pareto front of accuracy vs. wire length vs. cell count.
+#
+#   python npz_sweep.py net.npz LIMIT_LONG_CONNECTIONS=False,128,64 RELAY_LONG_CONNECTIONS=False,64 \
+#                               FORCE_TO_POWER_LAW=None,0.55,[0.55,0.1] max_layers=-1,1 (optional: sweep.json)
+#
+# None removes the optional FORCE_* settings.
+
+DEFAULT_GRID = {
+    "LIMIT_LONG_CONNECTIONS": [False, 256, 128, 64],
+    "RELAY_LONG_CONNECTIONS": [False, 64],
+}
+
+OPTIONAL_SETTINGS = ["FORCE_RANDOM_GATES", "FORCE_TO_POWER_LAW"]
+
+def parse_grid(args):
+    grid = {}
+    for arg in args:
+        name, values = arg.split("=", 1)
+        if name != "max_layers" and name not in OPTIONAL_SETTINGS and not hasattr(npz_to_verilog, name):
+            raise ValueError(f"Unknown setting '{name}' in npz_to_verilog.py")
+        grid[name] = ast.literal_eval(f"[{values}]")
+    return grid or DEFAULT_GRID
+
+def grid_variants(grid):
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+def apply_settings(settings):
+    for name, value in settings.items():
+        if name == "max_layers":
+            continue
+        if value is None and name in OPTIONAL_SETTINGS:
+            if hasattr(npz_to_verilog, name):
+                delattr(npz_to_verilog, name)
+        else:
+            setattr(npz_to_verilog, name, value)
+
+network = None
+def init_worker(file_name):
+    global network
+    with contextlib.redirect_stdout(io.StringIO()):
+        network = load_npz_file(file_name)
+
+def run_variant(settings):
+    apply_settings(settings)
+    np.random.seed(0) # FORCE_* settings are random, keep variants reproducible
+    copy = {key: np.array(value) for key, value in network_tensors(network).items()}
+    stats = {"settings": settings}
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            input_count, gates, conn_a, conn_b = build_network(copy, settings.get("max_layers", -1), stats)
+    except Exception as e:
+        return stats | {"error": str(e)}
+
+    X = np.asarray(network['input'])
+    Y = np.asarray(network['output'])
+    if X.ndim == 2 and X.shape[-1] >= input_count:
+        out = eval_network(pack_bits(X), gates, conn_a, conn_b)
+        _, predicted = classify(out, len(X))
+        stats["accuracy"] = float(np.mean(predicted == expected_categories(Y)))
+    stats["cells"] = stats["optimized_gates"] + stats["relays"]
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def pareto_front(points):
+    # points: [variants, objectives], lower is better. Returns mask of the variants no other variant dominates.
+    p = np.asarray(points, dtype=np.float64)
+    no_worse = np.all(p[:, None, :] <= p[None, :, :], axis=-1)
+    better = np.any(p[:, None, :] < p[None, :, :], axis=-1)
+    return ~np.any(no_worse & better, axis=0)
+
+def print_results(results):
+    names = list(results[0]["settings"].keys())
+    width = max(len(json.dumps(r["settings"][n])) for r in results for n in names)
+    width = [max(width, len(n)) for n in names]
+    print()
+    print(" ", " ".join(f"{n:>{w}}" for n, w in zip(names, width)), f"{'accuracy':>8} {'gates':>8} {'relays':>8} {'cells':>8} {'wire':>10}")
+    for r in results:
+        settings = " ".join(f"{json.dumps(r['settings'][n]):>{w}}" for n, w in zip(names, width))
+        if "error" in r:
+            print(" ", settings, f"FAILED: {r['error']}")
+            continue
+        accuracy = f"{r['accuracy']*100:7.2f}%" if "accuracy" in r else f"{'-':>8}"
+        print("*" if r["pareto"] else " ", settings, accuracy, f"{r['optimized_gates']:>8} {r['relays']:>8} {r['cells']:>8} {r['optimized_wire']:>10}")
+    print("* Pareto front: accuracy vs. wire length vs. cell count")
+
+###########################################################################################
+
+if __name__ == "__main__":
+    argv = [arg for arg in sys.argv if not arg.endswith(".json")]
+    json_file_name = next((arg for arg in sys.argv if arg.endswith(".json")), None)
+    if len(argv) < 2:
+        print(f"Usage: python {argv[0]} <input_npz_file_name> (optional: <SETTING>=<value>,<value>,... ) (optional: <output_json_file_name>)")
+        sys.exit(1)
+
+    variants = grid_variants(parse_grid(argv[2:]))
+    processes = min(os.cpu_count() or 1, len(variants))
+    print(f"Sweeping {len(variants)} variant(s) with {processes} process(es)...")
+    start = time.perf_counter()
+    with Pool(processes, initializer=init_worker, initargs=(argv[1],)) as pool:
+        results = pool.map(run_variant, variants)
+
+    done = [r for r in results if "error" not in r]
+    front = pareto_front([(-r.get("accuracy", 0), r["optimized_wire"], r["cells"]) for r in done]) if done else []
+    for r, is_front in zip(done, front):
+        r["pareto"] = bool(is_front)
+    print_results(results)
+    print(f"Swept {len(variants)} variant(s) in {time.perf_counter() - start:.1f}s")
+
+    if json_file_name is not None:
+        with open(json_file_name, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Results have been saved to '{json_file_name}'.")
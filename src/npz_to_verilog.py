@@ -1,14 +1,25 @@
 import sys
 import os
+import io
+import shutil
+import json
 import numpy as np
 from collections.abc import Sequence, Mapping
 
+from artifact_cache import cached, cache_key, source_hash, parse_cache_flag
+import npz_file
+import popcount_tree
+from npz_file import open_network, network_layers
+from popcount_tree import write_popcount
+from stage_timer import stage, parse_timing_flag, report_timing
+
 # DONE: Inject additional pass-through (negate / or) gates on the long connections.
 #       Use keep directive to avoid optimisastion by Yosys.
 
-# TODO: * %Warning-UNUSEDSIGNAL / predict gate count
+# DONE: * %Warning-UNUSEDSIGNAL / predict gate count
 #       * Fanout historgram
 #       * Predict wire length 
+#       See npz_analyze.py
 
 EXPANDED_VERILOG = False
 # EXPANDED_VERILOG = True
@@ -27,30 +38,71 @@ ASSUME_CIRCULAR_LAYOUT_FOR_CONNECTION_LENGTH = True
 
 NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES = False
 
+ELIMINATE_DEAD_GATES = False
+# ELIMINATE_DEAD_GATES = True
+
+COLLAPSE_PASS_THROUGH_GATES = False
+# COLLAPSE_PASS_THROUGH_GATES = True
+
+MERGE_DUPLICATE_GATES = False
+# MERGE_DUPLICATE_GATES = True
+
+# Permute gates inside hidden layers to shorten the connections of the next layer
+REORDER_GATES_FOR_WIRE_LENGTH = False
+# REORDER_GATES_FOR_WIRE_LENGTH = True
+
+# Check that optimizations preserve 'categories' with a bit-level evaluation on random inputs
+VERIFY_OPTIMIZATIONS = True
+# VERIFY_OPTIMIZATIONS = False
+
+# Register stages after every N layers of the net, adds clk, in_valid and out_valid ports
+PIPELINE_EVERY_N_LAYERS = 0
+# PIPELINE_EVERY_N_LAYERS = 2
+
+# Register stage after the popcount in lgn.v
+PIPELINE_POPCOUNT = False
+# PIPELINE_POPCOUNT = True
+
+# Shadow input buffer in lgn.v: next image is shifted in while the net works on the previous one,
+# commit strobe latches it, result and valid are held until the next result is ready
+DOUBLE_BUFFER_INPUTS = False
+# DOUBLE_BUFFER_INPUTS = True
+
+# Emit Dadda compressor tree popcount for the categories into net.v, sum_bits in lgn.v uses it instead of $countones
+GENERATE_POPCOUNT_TREE = False
+# GENERATE_POPCOUNT_TREE = True
+
 NUMBER_OF_CATEGORIES = 10
 # OUTPUT_BITS_PER_CATEGORY = 127
 # OUTPUT_BITS_PER_CATEGORY = 511
 OUTPUT_BITS_PER_CATEGORY = 800
 
+# Category wiring chosen by npz_category_search.py: .json with the 'out' bits summed by every category
+# and the LSBs of the sums that arg_max_10 ignores. Overrides OUTPUT_BITS_PER_CATEGORY.
+CATEGORY_CONFIG = None
+# CATEGORY_CONFIG = "categories.json"
+
+GATE_TEMPLATES = [
+    "1'b0",
+    "{A} & {B}",
+    "{A} & ~{B}",
+    "{A}",
+    "{B} & ~{A}",
+    "{B}",
+    "{A} ^ {B}",
+    "{A} | {B}",
+    "~({A} | {B})",
+    "~({A} ^ {B})",
+    "~{B}",
+    "~{B} | ({A} & {B})",
+    "~{A}",
+    "~{A} | ({A} & {B})",
+    "~({A} & {B})",
+    "1'b1"
+]
+
 def op(gate_type, A, B):
-    return [
-        f"1'b0",
-        f"{A} & {B}",
-        f"{A} & ~{B}",
-        f"{A}",
-        f"{B} & ~{A}",
-        f"{B}",
-        f"{A} ^ {B}",
-        f"{A} | {B}",
-        f"~({A} | {B})",
-        f"~({A} ^ {B})",
-        f"~{B}",
-        f"~{B} | ({A} & {B})",
-        f"~{A}",
-        f"~{A} | ({A} & {B})",
-        f"~({A} & {B})",
-        f"1'b1"
-    ][gate_type]
+    return GATE_TEMPLATES[gate_type].format(A=A, B=B)
 
 def get_conn_distance(conn_a, conn_b, in_count):
     d = np.abs(conn_a - conn_b)
@@ -58,87 +110,7 @@ def get_conn_distance(conn_a, conn_b, in_count):
         d[d > in_count // 2] = in_count - d[d > in_count // 2]
     return d
 
-def generate_verilog(global_inputs, gates, conn_a, conn_b, number_of_categories=NUMBER_OF_CATEGORIES, output_bits_per_category=OUTPUT_BITS_PER_CATEGORY):
-    assert len(gates) == len(conn_a) == len(conn_b)
-    global_outputs = len(gates[-1])
-
-    decl = ""
-    body = ""
-    gate_idx = 0
-    for layer_idx, layer_gates, layer_conn_a, layer_conn_b in zip(range(len(gates)), gates, conn_a, conn_b):
-        if layer_idx > 0:
-            decl += f"    wire [{len(gates[layer_idx-1])-1}:0] layer_{layer_idx-1};\n"
-            input = f"layer_{layer_idx-1}"
-        else:
-            input = "in"
-
-        if layer_idx < len(gates) - 1:
-            output = f"layer_{layer_idx}"
-        else:
-            output = "out"
-
-        assert len(layer_gates) == len(layer_conn_a) == len(layer_conn_b)
-        body += f"    // Layer {layer_idx} ============================================================\n"
-
-        idx = 0
-        def setup_inputs(body, layer_idx, gate_idx, a, b):
-            input_a = f"{input}[{a}]"
-            input_b = f"{input}[{b}]"
-            if RELAY_LONG_CONNECTIONS > 0:
-                in_count = len(gates[layer_idx-1]) if layer_idx > 0 else global_inputs
-                relay_count = get_conn_distance(a, b, in_count) // RELAY_LONG_CONNECTIONS
-                for n in range(relay_count):
-                    relay = f"far_{layer_idx}_{gate_idx}_{n}"
-                    # body += f"    wire [1:0] {relay};"
-                    # body += f"    relay_conn {relay}_a(.in({input_a}), .out({relay}[0]));"
-                    # body += f"    relay_conn {relay}_b(.in({input_b}), .out({relay}[1]));"
-                    # body += "\n"
-                    # input_a = f"{relay}[0]"
-                    # input_b = f"{relay}[1]"
-
-                    body += f"    wire {relay};"
-                    body += f"    relay_conn {relay}_b(.in({input_b}), .out({relay}));"
-                    body += "\n"
-                    input_b = f"{relay}"
-
-            return body, input_a, input_b
-
-        if EXPANDED_VERILOG:
-            for out_idx, gate, a, b in zip(range(len(layer_gates)), layer_gates, layer_conn_a, layer_conn_b):
-                body, input_a, input_b = setup_inputs(body, layer_idx, gate_idx, a, b)
-                body += f"    logic_gate gate_{layer_idx}_{gate_idx} ("
-                body += f"        .A({input_a}),"
-                body += f"        .B({input_b}),"
-                body += f"        .gate_type(4'd{gate}),"
-                body += f"        .Y({output}[{out_idx}])"
-                body += f"    );\n"
-                gate_idx += 1
-        else:
-            for out_idx, gate, a, b in zip(range(len(layer_gates)), layer_gates, layer_conn_a, layer_conn_b):
-                body, input_a, input_b = setup_inputs(body, layer_idx, gate_idx, a, b)
-                body += f"    assign {output}[{out_idx}] = {op(gate, f'{input_a}', f'{input_b}')}; \n"
-                gate_idx += 1
-
-    if number_of_categories > 0:
-        body += f"    // Arrange outputs in categories ================================================\n"
-        if NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES:
-            out_wires_per_category = global_outputs // number_of_categories
-            for i in range(number_of_categories):
-                out_lo = i * out_wires_per_category
-                cat_lo = i * output_bits_per_category
-                out_hi = out_lo + min(out_wires_per_category, output_bits_per_category) - 1
-                cat_hi = cat_lo + min(out_wires_per_category, output_bits_per_category) - 1
-                body += f"    assign categories[{cat_hi}:{cat_lo}] = out[{out_hi}:{out_lo}];\n"
-
-                if (output_bits_per_category > out_wires_per_category):
-                    cat_full = cat_lo + output_bits_per_category - 1
-                    body += f"    assign categories[{cat_full}:{cat_hi + 1}] = 0;\n"
-        else:
-            body += f"    assign categories[{output_bits_per_category*number_of_categories-1}:0] = out[{output_bits_per_category*number_of_categories-1}:0];\n"
-
-    verilog = ""
-    if RELAY_LONG_CONNECTIONS > 0:
-        verilog += f"""
+RELAY_MODULE = """
 `ifdef SIM
 module sky130_fd_sc_hd__inv_1 (
     input wire A,
@@ -160,8 +132,7 @@ module relay_conn (
     /* verilator lint_on PINMISSING */
 endmodule """
 
-    if EXPANDED_VERILOG:
-        verilog += f"""
+LOGIC_GATE_MODULE = """
 module logic_gate (
     input wire A,
     input wire B,
@@ -190,18 +161,214 @@ module logic_gate (
         endcase
     end
 endmodule """
+
+def layer_lines(layer_idx, input, output, in_count, gate_idx, layer_gates, layer_conn_a, layer_conn_b, names=None):
+    # Lazily yields Verilog lines of a single layer, memory stays bounded by the output buffer.
+    # Per gate type templates with wire names already baked in: "assign out[{0}] = in[{1}] & in[{2}]; \n"
+    # If names are passed, inputs are read from names[conn] instead of input[conn].
+    if names is None:
+        templates = [f"    assign {output}[{{0}}] = " +
+                     t.format(A=f"{input}[{{1}}]", B=f"{input}[{{2}}]") + "; \n" for t in GATE_TEMPLATES]
+        name = lambda conn: f"{input}[{conn}]"
+    else:
+        templates = [f"    assign {output}[{{0}}] = " + t.format(A="{1}", B="{2}") + "; \n" for t in GATE_TEMPLATES]
+        name = lambda conn: names[conn]
+
+    yield f"    // Layer {layer_idx} ============================================================\n"
+
+    if RELAY_LONG_CONNECTIONS > 0:
+        relay_counts = (get_conn_distance(np.asarray(layer_conn_a), np.asarray(layer_conn_b), in_count) // RELAY_LONG_CONNECTIONS).tolist()
+    else:
+        relay_counts = None
+
+    for out_idx, gate, a, b in zip(range(len(layer_gates)), np.asarray(layer_gates).tolist(), np.asarray(layer_conn_a).tolist(), np.asarray(layer_conn_b).tolist()):
+        if relay_counts and relay_counts[out_idx] > 0:
+            input_b = name(b)
+            for n in range(relay_counts[out_idx]):
+                relay = f"far_{layer_idx}_{gate_idx + out_idx}_{n}"
+                yield f"    wire {relay};    relay_conn {relay}_b(.in({input_b}), .out({relay}));\n"
+                input_b = relay
+            yield f"    assign {output}[{out_idx}] = {op(gate, name(a), input_b)}; \n"
+        elif names is None:
+            yield templates[gate].format(out_idx, a, b)
+        else:
+            yield templates[gate].format(out_idx, names[a], names[b])
+
+def relay_count(global_inputs, gates, conn_a, conn_b):
+    # Number of relay_conn cells that layer_lines() inserts on the long connections
+    if not RELAY_LONG_CONNECTIONS > 0:
+        return 0
+    in_counts = [global_inputs] + [len(g) for g in gates[:-1]]
+    return sum(np.sum(get_conn_distance(np.asarray(a), np.asarray(b), x) // RELAY_LONG_CONNECTIONS)
+               for a, b, x in zip(conn_a, conn_b, in_counts))
+
+def category_lines(global_outputs, number_of_categories, output_bits_per_category):
+    yield f"    // Arrange outputs in categories ================================================\n"
+    if category_config() is not None:
+        bits = category_bits(global_outputs, number_of_categories, output_bits_per_category).reshape(-1)
+        # runs of consecutive bits are assigned as one slice
+        starts = np.flatnonzero(np.diff(bits, prepend=-2) != 1)
+        for lo, hi in zip(starts, np.append(starts[1:], len(bits)) - 1):
+            slice = lambda hi, lo: f"[{hi}:{lo}]" if hi != lo else f"[{lo}]"
+            if bits[lo] < 0:
+                yield f"    assign categories{slice(hi, lo)} = 0;\n"
+            else:
+                yield f"    assign categories{slice(hi, lo)} = out{slice(bits[hi], bits[lo])};\n"
+    elif NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES:
+        out_wires_per_category = global_outputs // number_of_categories
+        for i in range(number_of_categories):
+            out_lo = i * out_wires_per_category
+            cat_lo = i * output_bits_per_category
+            out_hi = out_lo + min(out_wires_per_category, output_bits_per_category) - 1
+            cat_hi = cat_lo + min(out_wires_per_category, output_bits_per_category) - 1
+            yield f"    assign categories[{cat_hi}:{cat_lo}] = out[{out_hi}:{out_lo}];\n"
+
+            if (output_bits_per_category > out_wires_per_category):
+                cat_full = cat_lo + output_bits_per_category - 1
+                yield f"    assign categories[{cat_full}:{cat_hi + 1}] = 0;\n"
+    else:
+        yield f"    assign categories[{output_bits_per_category*number_of_categories-1}:0] = out[{output_bits_per_category*number_of_categories-1}:0];\n"
+
+def pass_through_wires(global_inputs, gates, conn_a, conn_b, stages):
+    # Buffers (A, B) of the hidden layers are not emitted, their readers are wired straight to the net
+    # they buffer, which might be in any earlier layer. Registered layers keep all their gates,
+    # so no wire crosses a pipeline register. Returns per layer: mask of the emitted gates
+    # and the names of the wires that every connection index of the layer reads.
+    names = np.array([f"in[{i}]" for i in range(global_inputs)], dtype=object)
+    emitted, sources = [], []
+    for l, g in enumerate(gates):
+        g = np.asarray(g)
+        sources.append(names)
+        if l == len(gates) - 1:
+            emitted.append(np.ones(len(g), dtype=bool))
+            break
+        buffer = ((g == 3) | (g == 5)) & (l not in stages)
+        if np.all(buffer):
+            buffer[0] = False # keep layer wire non-empty
+        source = np.where(g == 3, np.asarray(conn_a[l]), np.asarray(conn_b[l]))
+        names_next = np.empty(len(g), dtype=object)
+        names_next[buffer] = names[source[buffer]]
+        names_next[~buffer] = [f"layer_{l}[{i}]" for i in range(np.count_nonzero(~buffer))]
+        emitted.append(~buffer)
+        names = names_next
+    return emitted, sources
+
+def emitted_wires(global_inputs, gates, conn_a, conn_b):
+    # Per level (inputs, then the outputs of every layer) mask of the nets that write_verilog() emits,
+    # same numbering as eval_levels() in npz_eval.py
+    if COLLAPSE_PASS_THROUGH_GATES:
+        emitted, _ = pass_through_wires(global_inputs, gates, conn_a, conn_b, pipeline_stages(len(gates)))
+    else:
+        emitted = [np.ones(len(g), dtype=bool) for g in gates]
+    return [np.ones(global_inputs, dtype=bool)] + emitted
+
+def pipeline_stages(layers):
+    # Indices of the layers whose outputs are registered, the last layer feeds the popcount directly
+    if PIPELINE_EVERY_N_LAYERS <= 0:
+        return []
+    return [l for l in range(PIPELINE_EVERY_N_LAYERS - 1, layers - 1, PIPELINE_EVERY_N_LAYERS)]
+
+def pipeline_lines(stages):
+    latency = len(stages)
+    yield f"    // Pipeline =====================================================================\n"
+    for layer_idx in stages:
+        yield f"    always @(posedge clk) layer_{layer_idx} <= layer_{layer_idx}_d;\n"
+    yield f"    reg [{latency-1}:0] valid;\n"
+    if latency == 1:
+        yield f"    always @(posedge clk) valid <= in_valid;\n"
+    else:
+        yield f"    always @(posedge clk) valid <= {{valid[{latency-2}:0], in_valid}};\n"
+    yield f"    assign out_valid = valid[{latency-1}];\n"
+
+def write_verilog(f, global_inputs, gates, conn_a, conn_b, number_of_categories=None, output_bits_per_category=None):
+    # Streams Verilog into the file handle f layer by layer
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    assert len(gates) == len(conn_a) == len(conn_b)
+    global_outputs = len(gates[-1])
+    stages = pipeline_stages(len(gates))
+    config = category_config()
+    if config is not None:
+        output_bits_per_category = len(config["bits"][0])
+
+    # lgn.v picks the matching net ports and popcount registers with these defines,
+    # net.v has to be read before lgn.v
+    if stages:
+        f.write(f"`define NET_LATENCY {len(stages)}\n")
+    if config is not None:
+        f.write(f"`define BITS_PER_CATEGORY {output_bits_per_category}\n")
+        if sum_truncate_lsb() > 0:
+            f.write(f"`define SUM_TRUNCATE_LSB {sum_truncate_lsb()}\n")
+    if PIPELINE_POPCOUNT:
+        f.write("`define PIPELINE_POPCOUNT\n")
+    if DOUBLE_BUFFER_INPUTS:
+        f.write("`define DOUBLE_BUFFER_INPUTS\n")
+    if GENERATE_POPCOUNT_TREE:
+        f.write(f"`define POPCOUNT_TREE popcount_{output_bits_per_category}\n")
+
+    if RELAY_LONG_CONNECTIONS > 0:
+        f.write(RELAY_MODULE)
+
+    # NOTE: EXPANDED_VERILOG mode only emits the logic_gate module, the net itself is not emitted
+    if EXPANDED_VERILOG:
+        f.write(LOGIC_GATE_MODULE)
+        return
+
+    if COLLAPSE_PASS_THROUGH_GATES:
+        emitted, sources = pass_through_wires(global_inputs, gates, conn_a, conn_b, stages)
+        gates   = [np.asarray(g)[m] for g, m in zip(gates, emitted)]
+        conn_a  = [np.asarray(a)[m] for a, m in zip(conn_a, emitted)]
+        conn_b  = [np.asarray(b)[m] for b, m in zip(conn_b, emitted)]
     else:
-        verilog += f"""
-module net (
+        sources = [None] * len(gates)
+
+    pipeline_ports = """
+    input  wire clk,
+    input  wire in_valid,
+    output wire out_valid,""" if stages else ""
+    f.write(f"""
+module net ({pipeline_ports}
     input  wire [{ global_inputs-1}:0] in,
     output wire [{global_outputs-1}:0] out{"," if number_of_categories > 0 else ""}
     output wire [{number_of_categories*output_bits_per_category-1}:0] categories
 );
-{decl}
-{body}
-endmodule
-"""
-    return verilog
+""")
+    for layer_idx in range(len(gates) - 1):
+        if layer_idx in stages:
+            f.write(f"    wire [{len(gates[layer_idx])-1}:0] layer_{layer_idx}_d;\n")
+            f.write(f"    reg  [{len(gates[layer_idx])-1}:0] layer_{layer_idx};\n")
+        else:
+            f.write(f"    wire [{len(gates[layer_idx])-1}:0] layer_{layer_idx};\n")
+    f.write("\n")
+
+    gate_idx = 0
+    for layer_idx, layer_gates, layer_conn_a, layer_conn_b, names in zip(range(len(gates)), gates, conn_a, conn_b, sources):
+        assert len(layer_gates) == len(layer_conn_a) == len(layer_conn_b)
+        input = f"layer_{layer_idx-1}" if layer_idx > 0 else "in"
+        output = f"layer_{layer_idx}" if layer_idx < len(gates) - 1 else "out"
+        if layer_idx in stages:
+            output += "_d"
+        in_count = len(gates[layer_idx-1]) if layer_idx > 0 else global_inputs
+        with stage("string building"):
+            text = "".join(layer_lines(layer_idx, input, output, in_count, gate_idx, layer_gates, layer_conn_a, layer_conn_b, names))
+        with stage("file write"):
+            f.write(text)
+        gate_idx += len(layer_gates)
+
+    if stages:
+        f.writelines(pipeline_lines(stages))
+
+    if number_of_categories > 0:
+        f.writelines(category_lines(global_outputs, number_of_categories, output_bits_per_category))
+
+    f.write("\nendmodule\n")
+
+    if GENERATE_POPCOUNT_TREE:
+        write_popcount(f, [output_bits_per_category])
+
+def generate_verilog(global_inputs, gates, conn_a, conn_b, number_of_categories=None, output_bits_per_category=None):
+    f = io.StringIO()
+    write_verilog(f, global_inputs, gates, conn_a, conn_b, number_of_categories, output_bits_per_category)
+    return f.getvalue()
 
 def ascii_graph(values):
     # Array of characters for tiny histograms
@@ -214,13 +381,7 @@ def ascii_graph(values):
     return "".join(histogram_chars[indices]), percentages
 
 def ascii_histogram(values, size=16):
-    values = np.copy(values)
-    values[values >= size] = size-1
-    counts = np.zeros(size, dtype=int)
-    for v in range(size):
-        counts[v] = len(values[values == v])
-    # unique, counts_vals = np.unique(values, return_counts=True)
-    # counts[unique] = counts_vals
+    counts = np.bincount(np.minimum(values, size-1).astype(np.int64), minlength=size)
     return ascii_graph(counts)
 
 def ascii_histogram_compressed(values, bins=8):
@@ -232,33 +393,399 @@ def ascii_histogram_compressed(values, bins=8):
     counts = np.pad(counts, bins-len(counts))
     return ascii_graph(counts)
 
-def load_npz_file(file_name):
-    if not file_name.endswith('.npz'):
-        raise ValueError(f"The file '{file_name}' is not a .npz file.")
+def load_npz_file(file_name, mmap_mode='c'):
+    # Accepts plain or packed .npz file or a directory of .npy files. Arrays are memory-mapped lazily,
+    # pass mmap_mode=None to read them into memory instead.
+    if not file_name.endswith('.npz') and not os.path.isdir(file_name):
+        raise ValueError(f"The file '{file_name}' is not a .npz file or a directory of .npy files.")
 
-    if not os.path.isfile(file_name):
+    if not os.path.exists(file_name):
         raise FileNotFoundError(f"The file '{file_name}' does not exist.")
 
     try:
-        data = np.load(file_name)
+        data = open_network(file_name, mmap_mode)
         print("File loaded successfully.")
         print("Contents:")
         for key in data.keys():
-            print(f"{key}: {data[key].shape}, dtype={data[key].dtype}")
+            print(f"{key}: {data.shape(key)}, dtype={data.dtype(key)}")
         return data
     except Exception as e:
         raise RuntimeError(f"Failed to load the .npz file: {e}")
 
 def save_verilog_file(file_name, verilog):
-    with open(file_name, "w") as f:
+    with stage("file write"), open(file_name, "w") as f:
         f.write(verilog)
 
+def add_missing_input_connections(gates, conn_a, conn_b):
+    assert len(conn_a) == len(conn_b)
+    if (len(gates) > len(conn_a)):
+        conn_a = [np.zeros(len(gates[0]), dtype=np.int64)] + list(conn_a)
+        conn_b = [np.ones (len(gates[0]), dtype=np.int64)] + list(conn_b)
+    return conn_a, conn_b
+
+def category_settings(number_of_categories=None, output_bits_per_category=None):
+    # Defaults are looked up on every call, not bound when the module is imported,
+    # so settings changed at run time (npz_sweep.py) take effect
+    return (NUMBER_OF_CATEGORIES if number_of_categories is None else number_of_categories,
+            OUTPUT_BITS_PER_CATEGORY if output_bits_per_category is None else output_bits_per_category)
+
+def category_config():
+    if CATEGORY_CONFIG is None:
+        return None
+    with open(CATEGORY_CONFIG) as f:
+        return json.load(f)
+
+def sum_truncate_lsb():
+    # LSBs of the category sums ignored by arg_max_10 in lgn.v
+    config = category_config()
+    return config.get("truncate_lsb", 0) if config is not None else 0
+
+def category_bits(global_outputs, number_of_categories=None, output_bits_per_category=None):
+    # Indices of the 'out' bits that are wired into every category by generate_verilog(),
+    # -1 marks the category bits that are tied to 0
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    config = category_config()
+    if config is not None:
+        bits = np.array(config["bits"], dtype=np.int64)
+        assert bits.shape[0] == number_of_categories and np.max(bits) < global_outputs, \
+            f"'{CATEGORY_CONFIG}' does not match the network"
+        return bits
+
+    bits = np.full((number_of_categories, output_bits_per_category), -1, dtype=np.int64)
+    if NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES:
+        out_wires_per_category = global_outputs // number_of_categories
+        n = min(out_wires_per_category, output_bits_per_category)
+        for i in range(number_of_categories):
+            bits[i, :n] = np.arange(n) + i * out_wires_per_category
+    else:
+        bits.reshape(-1)[:global_outputs] = np.arange(min(global_outputs, bits.size))
+    return bits
+
+def generator_settings(max_layers=-1):
+    # Everything besides the network itself that changes the generated Verilog
+    names = [   "EXPANDED_VERILOG", "RELAY_LONG_CONNECTIONS", "LIMIT_LONG_CONNECTIONS",
+                "ASSUME_CIRCULAR_LAYOUT_FOR_CONNECTION_LENGTH", "NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES",
+                "NUMBER_OF_CATEGORIES", "OUTPUT_BITS_PER_CATEGORY",
+                "ELIMINATE_DEAD_GATES", "COLLAPSE_PASS_THROUGH_GATES", "MERGE_DUPLICATE_GATES",
+                "REORDER_GATES_FOR_WIRE_LENGTH", "PIPELINE_EVERY_N_LAYERS", "PIPELINE_POPCOUNT",
+                "GENERATE_POPCOUNT_TREE", "DOUBLE_BUFFER_INPUTS" ]
+    return {name: globals()[name] for name in names} | {"category_config": category_config(), "max_layers": max_layers}
+
+def verilog_cache_key(network, max_layers=-1, *extra):
+    # Returns None when the Verilog is not reproducible (randomly forced gates or connections)
+    if "FORCE_RANDOM_GATES" in globals() or "FORCE_TO_POWER_LAW" in globals():
+        return None
+    return cache_key(network, generator_settings(max_layers), generator_source_hash(), *extra)
+
+def generator_source_hash():
+    # Generated Verilog also depends on the network reader, the popcount tree and the verification of the optimizations
+    import npz_eval
+    return source_hash(sys.modules[__name__], npz_file, popcount_tree, npz_eval)
+
+def network_tensors(data):
+    # Only the tensors that end up in Verilog, the test dataset does not matter
+    return {key: data[key] for key in ('gate_types', 'connections.A', 'connections.B', 'layer_sizes') if key in data}
+
+#--- Network optimizations ----------------------------------------------------------------
+
+# Truth table of every gate type, see op(): GATE_TRUTH_TABLE[gate_type, A, B]
+GATE_TRUTH_TABLE = np.array([[[(g >> (3 - 2*a - b)) & 1 for b in (0, 1)] for a in (0, 1)] for g in range(16)], dtype=np.int64)
+GATE_DEPENDS_ON_A = np.any(GATE_TRUTH_TABLE[:, 0, :] != GATE_TRUTH_TABLE[:, 1, :], axis=-1)
+GATE_DEPENDS_ON_B = np.any(GATE_TRUTH_TABLE[:, :, 0] != GATE_TRUTH_TABLE[:, :, 1], axis=-1)
+
+def gate_type_from_truth_table(t00, t01, t10, t11):
+    return (t00 << 3) | (t01 << 2) | (t10 << 1) | t11
+
+def fold_constants(gates, conn_a, conn_b):
+    # Propagates constant wires forward through the layers and rewrites every gate
+    # that reads a constant (or the same wire twice) into a gate of the remaining input
+    gates = [np.array(g, dtype=np.int64) for g in gates]
+    const = None # value of each wire of the previous layer: -1 not a constant, 0 or 1
+    for g, a, b in zip(gates, conn_a, conn_b):
+        if const is not None:
+            va = const[a]
+            vb = const[b]
+            m = va >= 0
+            t0, t1 = GATE_TRUTH_TABLE[g[m], va[m], 0], GATE_TRUTH_TABLE[g[m], va[m], 1]
+            g[m] = gate_type_from_truth_table(t0, t1, t0, t1)
+            m = vb >= 0
+            t0, t1 = GATE_TRUTH_TABLE[g[m], 0, vb[m]], GATE_TRUTH_TABLE[g[m], 1, vb[m]]
+            g[m] = gate_type_from_truth_table(t0, t0, t1, t1)
+        m = np.asarray(a) == np.asarray(b)
+        t0, t1 = GATE_TRUTH_TABLE[g[m], 0, 0], GATE_TRUTH_TABLE[g[m], 1, 1]
+        g[m] = gate_type_from_truth_table(t0, t0, t1, t1)
+
+        const = np.full(len(g), -1, dtype=np.int64)
+        const[g == 0] = 0
+        const[g == 15] = 1
+    return gates
+
+def eliminate_dead_gates(gates, conn_a, conn_b, live_outputs, keep_output_positions=False):
+    # Walks backward from the live outputs of the last layer, marks every gate that drives them
+    # and renumbers the surviving wires of the hidden layers. Inputs that gate type ignores
+    # are not followed. Returns ragged lists of per layer arrays.
+    # The last layer keeps its positions: dead outputs are tied to 0, trailing ones are dropped
+    # unless keep_output_positions is set.
+    live = [None] * len(gates)
+    live[-1] = np.zeros(len(gates[-1]), dtype=bool)
+    live[-1][live_outputs] = True
+    for l in range(len(gates) - 1, 0, -1):
+        g = np.asarray(gates[l])
+        live[l-1] = np.zeros(len(gates[l-1]), dtype=bool)
+        live[l-1][np.asarray(conn_a[l])[live[l] & GATE_DEPENDS_ON_A[g]]] = True
+        live[l-1][np.asarray(conn_b[l])[live[l] & GATE_DEPENDS_ON_B[g]]] = True
+
+    new_gates, new_conn_a, new_conn_b = [], [], []
+    remap = None
+    for l in range(len(gates)):
+        g = np.asarray(gates[l], dtype=np.int64)
+        a = np.asarray(conn_a[l], dtype=np.int64)
+        b = np.asarray(conn_b[l], dtype=np.int64)
+        if remap is not None:
+            a, b = remap[a], remap[b]
+
+        keep = live[l]
+        if l < len(gates) - 1:
+            if not np.any(keep):
+                keep[0] = True # keep layer wire non-empty
+            remap = np.full(len(keep), -1, dtype=np.int64)
+            remap[keep] = np.arange(np.count_nonzero(keep))
+        else:
+            g, a, b = g.copy(), a.copy(), b.copy()
+            g[~keep], a[~keep], b[~keep] = 0, 0, 0
+            if not keep_output_positions:
+                keep = np.arange(len(keep)) <= np.max(np.flatnonzero(keep), initial=0)
+            else:
+                keep = np.ones(len(keep), dtype=bool)
+
+        g, a, b = g[keep], a[keep], b[keep]
+        # ignored inputs might point to removed wires, reconnect them to the other input
+        a = np.where(GATE_DEPENDS_ON_A[g], a, np.where(GATE_DEPENDS_ON_B[g], b, 0))
+        b = np.where(GATE_DEPENDS_ON_B[g], b, a)
+        a[a < 0] = 0
+        b[b < 0] = 0
+        new_gates.append(g)
+        new_conn_a.append(a)
+        new_conn_b.append(b)
+    return new_gates, new_conn_a, new_conn_b
+
+def collapse_pass_through_gates(gates, conn_a, conn_b):
+    # Pass-through gates (A, B, ~A, ~B) of the hidden layers become plain wires:
+    # inverters are turned into buffers and the inversion is absorbed into the truth table
+    # of every gate that reads them. Layers can only read the previous layer, so the buffers stay
+    # in the network, write_verilog() wires their readers to the buffered net (see pass_through_wires()).
+    # Chains of pass-through gates collapse into wires with at most a single inverter left in the last layer.
+    gates = [np.array(g, dtype=np.int64) for g in gates]
+    pass_through = {3: 'A', 5: 'B', 10: 'B', 12: 'A'}
+    chain = None
+    for l in range(len(gates)):
+        g = gates[l]
+        a = np.asarray(conn_a[l])
+        b = np.asarray(conn_b[l])
+
+        # length of pass-through chains, only for the report
+        is_pass_a = (g == 3) | (g == 12)
+        is_pass_b = (g == 5) | (g == 10)
+        depth = (is_pass_a | is_pass_b).astype(np.int64)
+        if chain is not None:
+            depth[is_pass_a] += chain[a[is_pass_a]]
+            depth[is_pass_b] += chain[b[is_pass_b]]
+        chain = depth
+
+        if l == len(gates) - 1:
+            break
+        inverted = (g == 10) | (g == 12)
+        g[g == 10] = 5
+        g[g == 12] = 3
+
+        # absorb inversion into the readers from the next layer
+        t = GATE_TRUTH_TABLE[gates[l+1]]
+        flip = inverted[np.asarray(conn_a[l+1])]
+        t[flip] = t[flip][:, ::-1, :]
+        flip = inverted[np.asarray(conn_b[l+1])]
+        t[flip] = t[flip][:, :, ::-1]
+        gates[l+1] = gate_type_from_truth_table(t[:, 0, 0], t[:, 0, 1], t[:, 1, 0], t[:, 1, 1])
+
+        print(f"{l:3} pass-through gates: {np.count_nonzero(depth):8}, inverters absorbed: {np.count_nonzero(inverted):8}, longest chain: {np.max(depth, initial=0)}")
+    return gates
+
+def merge_duplicate_gates(gates, conn_a, conn_b):
+    # Structural hashing: canonicalizes operands of every hidden layer gate, keeps the first copy
+    # of every distinct (gate_type, A, B) triple and redirects the readers in the next layer to it.
+    # Merged wires can make gates of the next layer identical too, so layers are hashed in order.
+    gates = [np.array(g, dtype=np.int64) for g in gates]
+    conn_a = [np.array(a, dtype=np.int64) for a in conn_a]
+    conn_b = [np.array(b, dtype=np.int64) for b in conn_b]
+    for l in range(len(gates) - 1):
+        g, a, b = gates[l], conn_a[l], conn_b[l]
+
+        # swapping operands swaps A & ~B with ~A & B rows of the truth table
+        swap = a > b
+        t = GATE_TRUTH_TABLE[g[swap]]
+        g[swap] = gate_type_from_truth_table(t[:, 0, 0], t[:, 1, 0], t[:, 0, 1], t[:, 1, 1])
+        a[swap], b[swap] = b[swap], a[swap]
+        # ignored inputs must not tell identical gates apart
+        a[:] = np.where(GATE_DEPENDS_ON_A[g], a, np.where(GATE_DEPENDS_ON_B[g], b, 0))
+        b[:] = np.where(GATE_DEPENDS_ON_B[g], b, a)
+
+        n = max(np.max(a, initial=0), np.max(b, initial=0)) + 1
+        keys = (g * n + a) * n + b
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first) # keep surviving gates in their original order
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        remap = rank[inverse.reshape(-1)]
+        keep = first[order]
+
+        print(f"{l:3} {len(g):8} -> {len(keep):8} gates, merged: {len(g) - len(keep)}")
+        gates[l], conn_a[l], conn_b[l] = g[keep], a[keep], b[keep]
+        conn_a[l+1] = remap[conn_a[l+1]]
+        conn_b[l+1] = remap[conn_b[l+1]]
+    return gates, conn_a, conn_b
+
+def cuthill_mckee_order(n, u, v):
+    # Reverse Cuthill-McKee ordering of the graph with n nodes and edges (u, v):
+    # breadth first from the lowest degree node of every component, neighbours in the order of their degree.
+    # Nodes without edges go last.
+    src = np.concatenate([u, v])
+    dst = np.concatenate([v, u])
+    by_src = np.argsort(src, kind='stable')
+    neighbours = dst[by_src]
+    start = np.searchsorted(src[by_src], np.arange(n + 1))
+    degree = np.diff(start)
+
+    visited = degree == 0
+    order = []
+    for seed in np.argsort(degree, kind='stable'):
+        if visited[seed]:
+            continue
+        visited[seed] = True
+        queue = [seed]
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            nb = neighbours[start[node]:start[node+1]]
+            nb = np.unique(nb[~visited[nb]])
+            nb = nb[np.argsort(degree[nb], kind='stable')]
+            visited[nb] = True
+            queue.extend(nb.tolist())
+        order.extend(queue)
+    return np.concatenate([np.array(order[::-1], dtype=np.int64), np.flatnonzero(degree == 0)])
+
+def refine_by_swaps(pos, u, v, rounds=16):
+    # Swaps neighbouring gates when it shortens their connections. Gain of every swap is computed
+    # for all pairs at once, edges between two swapped pairs are only approximated,
+    # so the whole round is kept only if the exact total length goes down.
+    n = len(pos)
+    total = np.sum(get_conn_distance(pos[u], pos[v], n))
+    for _ in range(rounds):
+        improved = False
+        for parity in (0, 1):
+            at = np.argsort(pos)
+            left = at[parity:n-1:2]
+            right = at[parity+1::2][:len(left)]
+            pair = np.full(n, -1)
+            pair[left] = pair[right] = np.arange(len(left))
+            shift = np.zeros(n, dtype=pos.dtype)
+            shift[left], shift[right] = 1, -1
+
+            gain = get_conn_distance(pos[u] + shift[u], pos[v] + shift[v], n) - get_conn_distance(pos[u], pos[v], n)
+            delta = np.zeros(len(left) + 1)
+            np.add.at(delta, pair[u], gain)
+            np.add.at(delta, np.where(pair[v] != pair[u], pair[v], -1), gain)
+            swap = np.zeros(n, dtype=bool)
+            swap[left] = swap[right] = delta[:-1][pair[left]] < 0
+
+            candidate = np.where(swap, pos + shift, pos)
+            candidate_total = np.sum(get_conn_distance(candidate[u], candidate[v], n))
+            if candidate_total < total:
+                pos, total = candidate, candidate_total
+                improved = True
+        if not improved:
+            break
+    return pos
+
+def reorder_gates_for_wire_length(gates, conn_a, conn_b):
+    # Order of the gates inside a hidden layer is free as long as the connections of the next layer
+    # follow the permutation. Connection length (get_conn_distance) of the next layer depends only
+    # on the order of this layer, so every layer is solved on its own. Output layer order is kept.
+    gates = [np.asarray(g) for g in gates]
+    conn_a = [np.asarray(a) for a in conn_a]
+    conn_b = [np.asarray(b) for b in conn_b]
+    for l in range(len(gates) - 1):
+        n = len(gates[l])
+        u, v = conn_a[l+1], conn_b[l+1]
+        def cost(pos):
+            d = get_conn_distance(pos[u], pos[v], n)
+            return np.sum(d), np.max(d, initial=0)
+
+        identity = np.arange(n)
+        best, best_cost = identity, cost(identity)
+        before = best_cost
+        edges = u != v
+        pos = np.empty(n, dtype=np.int64)
+        pos[cuthill_mckee_order(n, u[edges], v[edges])] = identity
+        for candidate in (pos, identity):
+            candidate = refine_by_swaps(candidate, u[edges], v[edges])
+            candidate_cost = cost(candidate)
+            if candidate_cost[0] < best_cost[0] and candidate_cost[1] <= best_cost[1]:
+                best, best_cost = candidate, candidate_cost
+
+        print(f"{l:3} total/longest connection before: {before[0]}/{before[1]} vs now: {best_cost[0]}/{best_cost[1]}")
+        order = np.argsort(best)
+        gates[l], conn_a[l], conn_b[l] = gates[l][order], conn_a[l][order], conn_b[l][order]
+        conn_a[l+1], conn_b[l+1] = best[conn_a[l+1]], best[conn_b[l+1]]
+    return gates, conn_a, conn_b
+
+def optimize_network(gates, conn_a, conn_b, number_of_categories=None, output_bits_per_category=None):
+    # Returns function preserving ragged network with respect to the 'categories' outputs
+    number_of_categories, output_bits_per_category = category_settings(number_of_categories, output_bits_per_category)
+    gates_before = [len(g) for g in gates]
+    if ELIMINATE_DEAD_GATES:
+        with stage("dead gates"):
+            gates = fold_constants(gates, conn_a, conn_b)
+            constants_before = sum(np.count_nonzero((g == 0) | (g == 15)) for g in gates[:-1])
+            live_outputs = category_bits(len(gates[-1]), number_of_categories, output_bits_per_category)
+            live_outputs = live_outputs[live_outputs >= 0]
+            gates, conn_a, conn_b = eliminate_dead_gates(gates, conn_a, conn_b, live_outputs,
+                keep_output_positions=NEED_TO_PACK_STRIDED_OUTPUTS_INTO_CATEGORIES)
+
+            print()
+            print("Dead gate elimination & constant propagation:")
+            for i, before, g in zip(range(len(gates)), gates_before, gates):
+                print(f"{i:3} {before:8} -> {len(g):8} gates, removed: {before - len(g)}")
+            print(f"Removed {sum(gates_before) - sum(len(g) for g in gates)} gates in total ({constants_before} hidden constants folded)")
+
+    if COLLAPSE_PASS_THROUGH_GATES:
+        with stage("pass-through gates"):
+            print()
+            print("Collapsing pass-through gates:")
+            gates = collapse_pass_through_gates(gates, conn_a, conn_b)
+
+    if MERGE_DUPLICATE_GATES:
+        with stage("duplicate gates"):
+            print()
+            print("Merging duplicate gates:")
+            gates_before = sum(len(g) for g in gates)
+            gates, conn_a, conn_b = merge_duplicate_gates(gates, conn_a, conn_b)
+            print(f"Merged {gates_before - sum(len(g) for g in gates)} gates in total")
+
+    if REORDER_GATES_FOR_WIRE_LENGTH:
+        with stage("reorder gates"):
+            print()
+            print("Reordering gates for wire length:")
+            gates, conn_a, conn_b = reorder_gates_for_wire_length(gates, conn_a, conn_b)
+
+    return gates, conn_a, conn_b
+
 #--- CORE function ------------------------------------------------------------------------
 
-def npz_to_verilog(data, max_layers=-1):
-    gates = data['gate_types']
-    conn_a = data['connections.A']
-    conn_b = data['connections.B']
+def build_network(data, max_layers=-1, stats=None):
+    # Applies FORCE_*, LIMIT_LONG_CONNECTIONS, max_layers and the optimizations to the network,
+    # returns the number of global inputs and the layers that are turned into Verilog.
+    # If stats dictionary is passed, it is filled with the network statistics.
+    gates, conn_a, conn_b = network_layers(data)
 
     if 'inputs' in data:
         inputs = data['inputs'].dim(-1)
@@ -294,7 +821,7 @@ def npz_to_verilog(data, max_layers=-1):
 
     try:
         print(f"OVER-WRITING conections with random distributed according to power exponent: {FORCE_TO_POWER_LAW}")
-        assert conn_a.shape == conn_b.shape
+        assert len(conn_a) == len(conn_b)
         for i in range(len(conn_a)):
             try:
                 idx = min(i, len(FORCE_TO_POWER_LAW)-1)
@@ -316,10 +843,7 @@ def npz_to_verilog(data, max_layers=-1):
         pass
 
     # inject input connections, if the first connectivity layer is missing
-    assert len(conn_a) == len(conn_b)
-    if (gates.shape[0] > conn_a.shape[0]):
-        conn_a = np.vstack((np.zeros(len(gates[0]), dtype=conn_a.dtype), conn_a))
-        conn_b = np.vstack((np.ones (len(gates[0]), dtype=conn_b.dtype), conn_b))
+    conn_a, conn_b = add_missing_input_connections(gates, conn_a, conn_b)
 
     # (optional) limit long connections
     if LIMIT_LONG_CONNECTIONS > 0:
@@ -351,45 +875,89 @@ def npz_to_verilog(data, max_layers=-1):
         conn_b = conn_b[:-layers_to_cut]
         print(f"There are {len(gates)} layers after cut.")
 
-    print()
-    print("Layer statistics:")
-    print("   ","  _ _   ___ _ _ ")
-    print("   ","0&⇒A⇐B⊕||⊕B⇐A⇒&1","   ","0...4..........16..............32.... connection distance .....>64")
-    total_wire = 0
-    total_gates = np.prod(gates.shape)
-    for i, g, a, b, x in zip(range(len(gates)), gates, conn_a, conn_b, inputs):
-        d = get_conn_distance(a, b, x)
-        assert np.all(d >= 0)
-        if ASSUME_CIRCULAR_LAYOUT_FOR_CONNECTION_LENGTH:
-            assert np.all(d <= x // 2)
-        print(f"{i:3}", ascii_histogram(g, size=16)[0], "   ", ascii_histogram(d, size=64)[0], "xx", ascii_histogram_compressed(d, bins=8)[0])
-        total_wire += np.sum(d)
-    print("   ","0&⇒A⇐B⊕||⊕B⇐A⇒&1")
-    print(f"Total wire: {total_wire}, avg: {total_wire//total_gates}")
-    print(f"Total gates: {total_gates}")
-    input_count = np.max([np.max(conn_a[0,:]), np.max(conn_b[0,:])]) + 1
-    return generate_verilog(input_count, gates, conn_a, conn_b)
+    with stage("statistics"):
+        print()
+        print("Layer statistics:")
+        print("   ","  _ _   ___ _ _ ")
+        print("   ","0&⇒A⇐B⊕||⊕B⇐A⇒&1","   ","0...4..........16..............32.... connection distance .....>64")
+        total_wire = 0
+        total_gates = sum(len(g) for g in gates)
+        for i, g, a, b, x in zip(range(len(gates)), gates, conn_a, conn_b, inputs):
+            d = get_conn_distance(a, b, x)
+            assert np.all(d >= 0)
+            if ASSUME_CIRCULAR_LAYOUT_FOR_CONNECTION_LENGTH:
+                assert np.all(d <= x // 2)
+            print(f"{i:3}", ascii_histogram(g, size=16)[0], "   ", ascii_histogram(d, size=64)[0], "xx", ascii_histogram_compressed(d, bins=8)[0])
+            total_wire += np.sum(d)
+        print("   ","0&⇒A⇐B⊕||⊕B⇐A⇒&1")
+        print(f"Total wire: {total_wire}, avg: {total_wire//total_gates}")
+        print(f"Total gates: {total_gates}")
+    input_count = np.max([np.max(conn_a[0]), np.max(conn_b[0])]) + 1
+
+    with stage("optimizations"):
+        optimized_gates, optimized_conn_a, optimized_conn_b = optimize_network(gates, conn_a, conn_b)
+    optimized = ELIMINATE_DEAD_GATES or COLLAPSE_PASS_THROUGH_GATES or MERGE_DUPLICATE_GATES or REORDER_GATES_FOR_WIRE_LENGTH
+    if VERIFY_OPTIMIZATIONS and optimized:
+        from npz_eval import verify_equivalence
+        with stage("verify optimizations"):
+            verify_equivalence(input_count, (gates, conn_a, conn_b), (optimized_gates, optimized_conn_a, optimized_conn_b))
+    gates, conn_a, conn_b = optimized_gates, optimized_conn_a, optimized_conn_b
+    optimized_wire = sum(np.sum(get_conn_distance(a, b, x)) for a, b, x in zip(conn_a, conn_b, [inputs[0]] + [len(g) for g in gates]))
+    print(f"Total wire after optimizations: {optimized_wire}")
+
+    if stats is not None:
+        stats["layers"] = len(gates)
+        stats["gates"] = int(total_gates)
+        stats["optimized_gates"] = int(sum(len(g) for g in gates))
+        stats["optimized_wire"] = int(optimized_wire)
+        stats["total_wire"] = int(total_wire)
+        stats["avg_wire"] = int(total_wire//total_gates)
+        stats["relays"] = int(relay_count(input_count, gates, conn_a, conn_b))
+
+    return input_count, gates, conn_a, conn_b
+
+def npz_to_verilog(data, max_layers=-1, f=None, stats=None):
+    # Returns Verilog as a string, or streams it into the file handle f if one is given.
+    # If stats dictionary is passed, it is filled with the network statistics.
+    with stage("build network"):
+        input_count, gates, conn_a, conn_b = build_network(data, max_layers, stats)
+    with stage("verilog"):
+        if f is not None:
+            return write_verilog(f, input_count, gates, conn_a, conn_b)
+        return generate_verilog(input_count, gates, conn_a, conn_b)
 
 ###########################################################################################
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2 and len(sys.argv) != 3:
-        print(f"Usage: python {sys.argv[0]} <input_npz_file_name> <output_verilog_file_name> (optional: <max_layers>)")
+    use_cache, argv = parse_cache_flag(sys.argv)
+    timing, timing_file_name, argv = parse_timing_flag(argv)
+    if len(argv) < 2 or len(argv) > 4:
+        print(f"Usage: python {argv[0]} <input_npz_file_name> <output_verilog_file_name> (optional: <max_layers>) [--no-cache] [--timing[=<output_json_file_name>]]")
         sys.exit(1)
 
-    npz_file_name = sys.argv[1]
-    if len(sys.argv) == 3:
-        verilog_file_name = sys.argv[2]
+    npz_file_name = argv[1]
+    if len(argv) >= 3:
+        verilog_file_name = argv[2]
     else:
         verilog_file_name = os.path.splitext(npz_file_name)[0] + ".v"
     max_layers = -1
-    if len(sys.argv) > 3:
-        max_layers = int(sys.argv[3])
-
-    data = load_npz_file(npz_file_name)
-    verilog = f"// Generated from: {npz_file_name}\n" + \
-        npz_to_verilog(data, max_layers)
+    if len(argv) > 3:
+        max_layers = int(argv[3])
+
+    with stage("load npz"):
+        data = load_npz_file(npz_file_name)
+    key = verilog_cache_key(network_tensors(data), max_layers) if use_cache else None
+    with open(verilog_file_name, "w") as f:
+        f.write(f"// Generated from: {npz_file_name}\n")
+        if key is not None:
+            def produce(path):
+                with open(os.path.join(path, "net.v"), "w") as cached_verilog:
+                    npz_to_verilog(data, max_layers, cached_verilog)
+            with open(os.path.join(cached(key, produce, log=True), "net.v")) as cached_verilog:
+                shutil.copyfileobj(cached_verilog, f)
+        else:
+            npz_to_verilog(data, max_layers, f)
 
-    save_verilog_file(verilog_file_name, verilog)
     print(f"Verilog code has been generated and saved to '{verilog_file_name}'.")
+    report_timing(timing, timing_file_name)
 
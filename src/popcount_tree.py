@@ -0,0 +1,140 @@
+import sys
+
+# Dadda compressor tree popcount for any number of inputs.
+#
+# Bits of equal weight (columns) are reduced with full and half adders to the Dadda heights
+# ..., 13, 9, 6, 4, 3, 2 and a final ripple carry stage leaves a single bit per column.
+# Result is truncated to $clog2(N) bits like sum_bits in lgn.v, the top bit is just the parity
+# of its column, so no adder carries are left unused.
+#
+# Adders follow the USE_HA_FA_CELLS convention of popcount.v, but with gf180mcu cells.
+
+CELLS = """
+`ifndef POPCOUNT_TREE_CELLS
+`define POPCOUNT_TREE_CELLS
+`ifdef SIM
+`elsif FPGA
+`else
+`define USE_HA_FA_CELLS
+`endif
+
+module popcount_fa (
+    input  wire a,
+    input  wire b,
+    input  wire c,
+    output wire sum,
+    output wire carry
+);
+  `ifdef USE_HA_FA_CELLS
+    /* verilator lint_off PINMISSING */
+    gf180mcu_fd_sc_mcu7t5v0__addf_1 full_adder(.A(a), .B(b), .CI(c), .CO(carry), .S(sum));
+    /* verilator lint_on PINMISSING */
+  `else
+    assign sum = a ^ b ^ c;
+    assign carry = (a & b) | (b & c) | (c & a);
+  `endif
+endmodule
+
+module popcount_ha (
+    input  wire a,
+    input  wire b,
+    output wire sum,
+    output wire carry
+);
+  `ifdef USE_HA_FA_CELLS
+    /* verilator lint_off PINMISSING */
+    gf180mcu_fd_sc_mcu7t5v0__addh_1 half_adder(.A(a), .B(b), .CO(carry), .S(sum));
+    /* verilator lint_on PINMISSING */
+  `else
+    assign sum = a ^ b;
+    assign carry = a & b;
+  `endif
+endmodule
+`endif
+"""
+
+def sum_width(n):
+    # $clog2(N) bits, same as sum_bits in lgn.v
+    return max(1, (n - 1).bit_length())
+
+def dadda_heights(max_height):
+    # Descending Dadda heights below max_height: ..., 13, 9, 6, 4, 3, 2
+    heights = [2]
+    while heights[-1] * 3 // 2 < max_height:
+        heights.append(heights[-1] * 3 // 2)
+    return [d for d in heights[::-1] if d < max_height]
+
+def popcount_netlist(n):
+    # Returns adders as (cell, inputs, sum, carry) tuples and the wire of every result bit
+    width = sum_width(n)
+    columns = [[f"y[{i}]" for i in range(n)]] + [[] for _ in range(width - 1)]
+    adders = []
+
+    def add(cell, inputs, column, next_column):
+        k = len(adders)
+        adders.append((cell, inputs, f"s{k}", f"c{k}"))
+        column.append(f"s{k}")
+        next_column.append(f"c{k}")
+
+    # the top column is only needed modulo 2, it is left to the parity at the end
+    for d in dadda_heights(max(len(c) for c in columns[:-1]) if width > 1 else 0) + [1]:
+        ripple = d == 1 # last stage: carries are added in the same stage
+        reduced = [[] for _ in range(width)]
+        for i in range(width - 1):
+            pool = reduced[i] + columns[i] if ripple else columns[i]
+            kept = [] if ripple else reduced[i]
+            while len(pool) + len(kept) > d and len(pool) >= 2:
+                if len(pool) + len(kept) - d >= 2 and len(pool) >= 3:
+                    add("popcount_fa", pool[:3], kept, reduced[i+1])
+                    pool = pool[3:]
+                else:
+                    add("popcount_ha", pool[:2], kept, reduced[i+1])
+                    pool = pool[2:]
+            reduced[i] = pool + kept # inputs that arrived earlier go first
+            assert len(reduced[i]) <= d
+        reduced[-1] += columns[-1]
+        columns = reduced
+
+    outputs = [c[0] if c else "1'b0" for c in columns[:-1]]
+    outputs.append("^{" + ", ".join(columns[-1]) + "}" if columns[-1] else "1'b0")
+    return adders, outputs
+
+def popcount_module(n, name=None):
+    name = name or f"popcount_{n}"
+    width = sum_width(n)
+    adders, outputs = popcount_netlist(n)
+    lines = [f"""
+module {name} (
+    input  wire [{n-1}:0] y,
+    output wire [{width-1}:0] sum
+);
+    // {sum(a[0] == "popcount_fa" for a in adders)} full adders, {sum(a[0] == "popcount_ha" for a in adders)} half adders
+"""]
+    for k in range(0, len(adders), 16):
+        lines.append("    wire " + ", ".join(f"s{i}, c{i}" for i in range(k, min(k + 16, len(adders)))) + ";\n")
+    for k, (cell, inputs, s, c) in enumerate(adders):
+        pins = "".join(f".{pin}({wire}), " for pin, wire in zip("abc", inputs))
+        lines.append(f"    {cell} add{k} ({pins}.sum({s}), .carry({c}));\n")
+    for i, wire in enumerate(outputs):
+        lines.append(f"    assign sum[{i}] = {wire};\n")
+    lines.append("endmodule\n")
+    return "".join(lines)
+
+def write_popcount(f, sizes):
+    f.write(CELLS)
+    for n in sizes:
+        f.write(popcount_module(n))
+
+###########################################################################################
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 and len(sys.argv) != 3:
+        print(f"Usage: python {sys.argv[0]} <number_of_inputs> (optional: <output_verilog_file_name>)")
+        sys.exit(1)
+
+    n = int(sys.argv[1])
+    verilog_file_name = sys.argv[2] if len(sys.argv) == 3 else f"popcount_{n}.v"
+    with open(verilog_file_name, "w") as f:
+        write_popcount(f, [n])
+    adders, _ = popcount_netlist(n)
+    print(f"Popcount of {n} inputs with {len(adders)} adders has been saved to '{verilog_file_name}'.")
@@ -3,9 +3,28 @@ import torch.nn.functional as F
 import numpy as np
 import sys
 import os
+import shutil
+
+import npz_file
+from artifact_cache import cached, cache_key, source_hash, parse_cache_flag
+from npz_file import save_npy_dir, save_packed_npz
+from stage_timer import stage, parse_timing_flag, report_timing
 
 # Reference for network training: https://gist.github.com/rejunity/bff3857ce1fad9f11fbfed0db0f2bbc8
 
+# Packed format: 4-bit gate types, narrow connection indices and bit packed test dataset, see npz_file.py
+PACK_NETWORK_FILE = False
+# PACK_NETWORK_FILE = True
+
+# Packed file can be compressed further, but then it can not be memory-mapped
+COMPRESS_NETWORK_FILE = False
+# COMPRESS_NETWORK_FILE = True
+
+# Layers of different width are stored back to back with their 'layer_sizes' instead of padding
+# every layer with null gates to the widest one, see network_layers() in npz_file.py
+RAGGED_LAYERS = True
+# RAGGED_LAYERS = False
+
 def load_pth_file(file_name):
     if not file_name.endswith('.pth'):
         raise ValueError(f"The file '{file_name}' is not a .pth file.")
@@ -14,13 +33,21 @@ def load_pth_file(file_name):
         raise FileNotFoundError(f"The file '{file_name}' does not exist.")
 
     try:
-        checkpoint = torch.load(file_name, map_location=torch.device('cpu'), weights_only=True)
+        with stage("torch load"):
+            checkpoint = torch.load(file_name, map_location=torch.device('cpu'), weights_only=True)
         return checkpoint
     except Exception as e:
         raise RuntimeError(f"Failed to load the .pth file: {e}")
 
 def save_npz_file(file_name, npz_data):
-    np.savez(file_name, **npz_data)
+    # Both layouts can be memory-mapped by load_npz_file(): uncompressed .npz or a directory of .npy files
+    with stage("save npz"):
+        if PACK_NETWORK_FILE:
+            save_packed_npz(file_name, npz_data, compress=COMPRESS_NETWORK_FILE)
+        elif file_name.endswith('.npz'):
+            np.savez(file_name, **npz_data)
+        else:
+            save_npy_dir(file_name, npz_data)
 
 #--- CORE function ------------------------------------------------------------------------
 
@@ -31,24 +58,25 @@ def pth_to_npz(checkpoint):
         connections = checkpoint.pop("connections")
         layers = [checkpoint[f"layers.{i}.w"] for i in range(len([k for k in checkpoint if k.startswith('layers.') and k.endswith('.w')]))]
     else:
-        c = {}
-        w = {}
-        indices = {}
-        for key in checkpoint.keys():
-            parts = key.split('.')
-            if len(parts) != 3 or parts[0] != 'layers':
-                continue  # Skip tensors that don't contain layer parameters
-            layer_id, type = int(parts[1]), parts[2]
-            # print(layer_id)
+        with stage("argmax connections"):
+            c = {}
+            w = {}
+            indices = {}
+            for key in checkpoint.keys():
+                parts = key.split('.')
+                if len(parts) != 3 or parts[0] != 'layers':
+                    continue  # Skip tensors that don't contain layer parameters
+                layer_id, type = int(parts[1]), parts[2]
+                # print(layer_id)
             
-            value = checkpoint[key]
-            if type == 'c':
-                # print(value.shape, torch.argmax(value, dim=0).shape, torch.argmax(value, dim=1).shape)
-                c[layer_id] = torch.argmax(value, dim=0)
-            elif type == 'w':
-                w[layer_id] = value
-            elif type == 'indices':
-                indices[layer_id] = value
+                value = checkpoint[key]
+                if type == 'c':
+                    # print(value.shape, torch.argmax(value, dim=0).shape, torch.argmax(value, dim=1).shape)
+                    c[layer_id] = torch.argmax(value, dim=0)
+                elif type == 'w':
+                    w[layer_id] = value
+                elif type == 'indices':
+                    indices[layer_id] = value
 
         # print(len(c), len(w), len(indices))
 
@@ -82,7 +110,8 @@ def pth_to_npz(checkpoint):
         dataset_output = checkpoint.pop("dataset_output")
 
 
-    gate_types = [torch.argmax(layer, dim=0) for layer in layers]
+    with stage("argmax gates"):
+        gate_types = [torch.argmax(layer, dim=0) for layer in layers]
 
     original_size = np.sum([g.size() for g in gate_types] + [c.size() for c in connections[0]] + [c.size() for c in connections[1]])
 
@@ -90,10 +119,23 @@ def pth_to_npz(checkpoint):
         padded = [F.pad(t, (0, new_size - t.size(0)), value=padding) for t in tensors]
         return torch.stack(padded, dim=0)
 
-    max_size = max(t.size(0) for t in gate_types)
-    gate_types = pad_tensor_array(gate_types, max_size).cpu().numpy()
-    connections[0] = pad_tensor_array(connections[0], max_size).cpu().numpy()
-    connections[1] = pad_tensor_array(connections[1], max_size).cpu().numpy()
+    def concat_tensor_array(tensors):
+        return torch.cat([t.reshape(-1) for t in tensors]).cpu().numpy()
+
+    with stage("padding"):
+        layer_sizes = np.array([t.size(0) for t in gate_types])
+        extra = {}
+        if RAGGED_LAYERS and np.any(layer_sizes != layer_sizes[0]):
+            print("Layer sizes: ", layer_sizes)
+            gate_types = concat_tensor_array(gate_types)
+            connections[0] = concat_tensor_array(connections[0])
+            connections[1] = concat_tensor_array(connections[1])
+            extra = {"layer_sizes": layer_sizes}
+        else:
+            max_size = max(layer_sizes)
+            gate_types = pad_tensor_array(gate_types, max_size).cpu().numpy()
+            connections[0] = pad_tensor_array(connections[0], max_size).cpu().numpy()
+            connections[1] = pad_tensor_array(connections[1], max_size).cpu().numpy()
 
     padded_size = gate_types.size + connections[0].size + connections[1].size 
     if padded_size - original_size > 0:
@@ -107,23 +149,36 @@ def pth_to_npz(checkpoint):
                 "connections.A" : connections[0],
                 "connections.B" : connections[1],
                 "input"         : dataset_input,
-                "output"        : dataset_output }
+                "output"        : dataset_output } | extra
 
 ###########################################################################################
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2 and len(sys.argv) != 3:
-        print(f"Usage: python {sys.argv[0]} <input_npz_file_name> <output_verilog_file_name>")
+    use_cache, argv = parse_cache_flag(sys.argv)
+    timing, timing_file_name, argv = parse_timing_flag(argv)
+    if len(argv) != 2 and len(argv) != 3:
+        print(f"Usage: python {argv[0]} <input_pth_file_name> <output_npz_file_name> [--no-cache] [--timing[=<output_json_file_name>]]")
         sys.exit(1)
 
-    pth_file_name = sys.argv[1]
-    if len(sys.argv) == 3:
-        npz_file_name = sys.argv[2]
+    pth_file_name = argv[1]
+    if len(argv) == 3:
+        npz_file_name = argv[2]
     else:
         npz_file_name = os.path.splitext(pth_file_name)[0] + ".npz"
 
     checkpoint = load_pth_file(pth_file_name)
-    data = pth_to_npz(checkpoint)
-    save_npz_file(npz_file_name, data)
+    if use_cache:
+        # cache entry holds the network in the requested layout: .npz file or a directory of .npy files
+        entry_name = "net.npz" if npz_file_name.endswith('.npz') else "net"
+        key = cache_key(checkpoint, entry_name, source_hash(sys.modules[__name__], npz_file))
+        entry = cached(key, lambda path: save_npz_file(os.path.join(path, entry_name), pth_to_npz(checkpoint)), log=True)
+        if os.path.isdir(os.path.join(entry, entry_name)):
+            shutil.copytree(os.path.join(entry, entry_name), npz_file_name, dirs_exist_ok=True)
+        else:
+            shutil.copyfile(os.path.join(entry, entry_name), npz_file_name)
+    else:
+        data = pth_to_npz(checkpoint)
+        save_npz_file(npz_file_name, data)
 
     print(f"Data has been converted and saved to '{npz_file_name}'.")
+    report_timing(timing, timing_file_name)
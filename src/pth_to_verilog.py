@@ -1,23 +1,37 @@
 from pth_to_npz import load_pth_file, pth_to_npz
-from npz_to_verilog import npz_to_verilog, save_verilog_file
+import pth_to_npz as pth_to_npz_module
+from npz_to_verilog import npz_to_verilog, verilog_cache_key
+from artifact_cache import cached, source_hash, parse_cache_flag
+from stage_timer import parse_timing_flag, report_timing
 import sys
 import os
+import shutil
 
-if len(sys.argv) != 2 and len(sys.argv) != 3:
-    print(f"Usage: python {sys.argv[0]} <input_pth_file_name> <output_verilog_file_name>")
+use_cache, argv = parse_cache_flag(sys.argv)
+timing, timing_file_name, argv = parse_timing_flag(argv)
+if len(argv) != 2 and len(argv) != 3:
+    print(f"Usage: python {argv[0]} <input_pth_file_name> <output_verilog_file_name> [--no-cache] [--timing[=<output_json_file_name>]]")
     sys.exit(1)
 
-pth_file_name = sys.argv[1]
-if len(sys.argv) == 3:
-    verilog_file_name = sys.argv[2]
+pth_file_name = argv[1]
+if len(argv) == 3:
+    verilog_file_name = argv[2]
 else:
     # verilog_file_name = os.path.splitext(npz_file_name)[0] + ".v"
     verilog_file_name = "net.v"
 
 pth_data = load_pth_file(pth_file_name)
-npz_data = pth_to_npz(pth_data)
-verilog = f"// Generated from: {pth_file_name}\n" + \
-    npz_to_verilog(npz_data)
-save_verilog_file(verilog_file_name, verilog)
+key = verilog_cache_key(pth_data, -1, source_hash(pth_to_npz_module)) if use_cache else None
+with open(verilog_file_name, "w") as f:
+    f.write(f"// Generated from: {pth_file_name}\n")
+    if key is not None:
+        def produce(path):
+            with open(os.path.join(path, "net.v"), "w") as cached_verilog:
+                npz_to_verilog(pth_to_npz(pth_data), f=cached_verilog)
+        with open(os.path.join(cached(key, produce, log=True), "net.v")) as cached_verilog:
+            shutil.copyfileobj(cached_verilog, f)
+    else:
+        npz_to_verilog(pth_to_npz(pth_data), f=f)
 
 print(f"Verilog code has been generated and saved to '{verilog_file_name}'.")
+report_timing(timing, timing_file_name)
@@ -0,0 +1,71 @@
+import sys
+import json
+import time
+import resource
+import contextlib
+
+# Per stage wall time and peak memory of the converters.
+#
+#   with stage("argmax"):
+#       ...
+#
+# Stages nest, repeated stages with the same name and parent are accumulated.
+# Peak RSS of the process is sampled when a stage ends, it never goes down:
+# the stage with the largest growth is the one that needs the memory.
+
+stages = {} # (parent names..., name) -> record, in the order stages were entered
+_path = ()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, kilobytes elsewhere
+
+@contextlib.contextmanager
+def stage(name):
+    global _path
+    parent = _path
+    _path = parent + (name,)
+    record = stages.setdefault(_path, {"stage": "/".join(_path), "calls": 0, "seconds": 0.0, "peak_rss_mb": 0.0, "peak_rss_growth_mb": 0.0})
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _path = parent
+        rss_after = peak_rss_mb()
+        record["calls"] += 1
+        record["seconds"] += time.perf_counter() - start
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], rss_after)
+        record["peak_rss_growth_mb"] += rss_after - rss_before
+
+def reset():
+    stages.clear()
+
+def timing_report():
+    return {"stages": list(stages.values()), "peak_rss_mb": peak_rss_mb()}
+
+def print_timing():
+    print()
+    print(f"{'stage':<48} {'calls':>6} {'seconds':>9} {'peak RSS MB':>12} {'growth MB':>10}")
+    for path, s in stages.items():
+        name = "  " * (len(path) - 1) + path[-1]
+        print(f"{name:<48} {s['calls']:>6} {s['seconds']:>9.3f} {s['peak_rss_mb']:>12.1f} {s['peak_rss_growth_mb']:>10.1f}")
+    print(f"Peak RSS: {peak_rss_mb():.1f} MB")
+
+def save_timing(file_name, extra=None):
+    with open(file_name, "w") as f:
+        json.dump(timing_report() | (extra or {}), f, indent=1)
+
+def parse_timing_flag(argv):
+    # Strips --timing[=<output_json_file_name>] from the command line,
+    # returns (print timing, json file name or None, remaining arguments)
+    flags = [arg for arg in argv if arg == "--timing" or arg.startswith("--timing=")]
+    json_file_name = next((arg.split("=", 1)[1] for arg in flags if "=" in arg), None)
+    return len(flags) > 0, json_file_name, [arg for arg in argv if arg not in flags]
+
+def report_timing(timing, json_file_name):
+    if timing:
+        print_timing()
+    if json_file_name is not None:
+        save_timing(json_file_name)
+        print(f"Timing has been saved to '{json_file_name}'.")
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Converters are flat modules in src/ that import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+@pytest.fixture
+def random_network():
+    # Returns a factory of random ragged networks: (inputs, gates, conn_a, conn_b) lists of per layer arrays
+    def make(widths, inputs=32, gate_types=range(16), seed=0):
+        rng = np.random.default_rng(seed)
+        in_counts = [inputs] + list(widths[:-1])
+        gates = [rng.choice(list(gate_types), size=w) for w in widths]
+        conn_a = [rng.integers(0, n, size=w) for n, w in zip(in_counts, widths)]
+        conn_b = [rng.integers(0, n, size=w) for n, w in zip(in_counts, widths)]
+        return inputs, gates, conn_a, conn_b
+    return make
@@ -0,0 +1,99 @@
+import os
+import types
+
+import numpy as np
+import pytest
+
+import artifact_cache
+from artifact_cache import cache_key, cached, source_hash, parse_cache_flag
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_cache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_cache_key_is_deterministic_and_sensitive():
+    network = {"gate_types": np.arange(8, dtype=np.int8), "layer_sizes": np.array([4, 4])}
+    key = cache_key(network, {"PIPELINE_EVERY_N_LAYERS": 0}, -1)
+    assert key == cache_key(dict(reversed(list(network.items()))), {"PIPELINE_EVERY_N_LAYERS": 0}, -1)
+
+    changed = dict(network, gate_types=network["gate_types"][::-1])
+    assert key != cache_key(changed, {"PIPELINE_EVERY_N_LAYERS": 0}, -1)
+    assert key != cache_key(dict(network, gate_types=network["gate_types"].astype(np.int16)), {"PIPELINE_EVERY_N_LAYERS": 0}, -1)
+    assert key != cache_key(network, {"PIPELINE_EVERY_N_LAYERS": 2}, -1)
+    assert key != cache_key(network, {"PIPELINE_EVERY_N_LAYERS": 0}, 3)
+
+
+def test_cached_produces_once(cache_dir):
+    calls = []
+    def produce(directory):
+        calls.append(directory)
+        with open(os.path.join(directory, "net.v"), "w") as f:
+            f.write("module net();\nendmodule\n")
+
+    first = cached("abc", produce)
+    second = cached("abc", produce)
+    assert first == second == str(cache_dir / "abc")
+    assert len(calls) == 1
+    assert (cache_dir / "abc" / "net.v").read_text().startswith("module net")
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
+
+
+def test_failed_produce_leaves_no_entry(cache_dir):
+    def produce(directory):
+        raise RuntimeError("conversion failed")
+
+    with pytest.raises(RuntimeError):
+        cached("abc", produce)
+    assert os.listdir(cache_dir) == []
+
+
+def test_least_recently_used_entries_are_evicted(cache_dir, monkeypatch):
+    monkeypatch.setattr(artifact_cache, "CACHE_MAX_BYTES", 2500)
+    def produce(directory):
+        os.makedirs(os.path.join(directory, "net"))
+        with open(os.path.join(directory, "net", "gate_types.npy"), "wb") as f:
+            f.write(bytes(1000))
+
+    for i, key in enumerate(["a", "b"]):
+        cached(key, produce)
+        os.utime(cache_dir / key, (i, i))
+    cached("a", produce) # hit makes "b" the oldest entry
+    cached("c", produce)
+    assert sorted(os.listdir(cache_dir)) == ["a", "c"]
+
+
+def test_source_hash_follows_file_contents(tmp_path):
+    path = tmp_path / "converter.py"
+    module = types.SimpleNamespace(__file__=str(path))
+    path.write_text("VERSION = 1\n")
+    before = source_hash(module)
+    assert before == source_hash(module)
+    path.write_text("VERSION = 2\n")
+    assert before != source_hash(module)
+
+
+def test_parse_cache_flag():
+    assert parse_cache_flag(["net.pth", "--no-cache", "net.npz"]) == (False, ["net.pth", "net.npz"])
+    assert parse_cache_flag(["net.pth"]) == (True, ["net.pth"])
+
+
+def test_cached_log_is_printed_on_every_call(cache_dir, capsys):
+    def produce(directory):
+        print("Gates: 24000")
+        open(os.path.join(directory, "net.v"), "w").close()
+
+    cached("abc", produce, log=True)
+    miss = capsys.readouterr().out
+    cached("abc", produce, log=True)
+    hit = capsys.readouterr().out
+    assert "Gates: 24000" in miss
+    assert hit.endswith(miss) and "Using cached artifacts" in hit
+
+
+def test_default_cache_is_inside_the_project():
+    if "LGN_CACHE_DIR" not in os.environ:
+        project = os.path.dirname(os.path.dirname(os.path.abspath(artifact_cache.__file__)))
+        assert artifact_cache.CACHE_DIR == os.path.join(project, ".cache", "lgn")
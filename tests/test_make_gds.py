@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("klayout.db")
+pytest.importorskip("PIL")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ip", "gf180mcu_ws_ip__logo", "script"))
+
+from make_gds import pixel_rectangles
+
+
+def paint(rectangles, shape):
+    # Number of rectangles covering every pixel
+    covered = np.zeros(shape, dtype=np.int64)
+    for x0, y0, x1, y1 in rectangles:
+        covered[y0:y1, x0:x1] += 1
+    return covered
+
+
+@pytest.mark.parametrize("density", [0.1, 0.5, 0.9])
+def test_rectangles_cover_set_pixels_exactly_once(density):
+    rng = np.random.default_rng(int(density * 10))
+    pixels = rng.random((40, 57)) < density
+    rectangles = pixel_rectangles(pixels)
+    assert np.array_equal(paint(rectangles, pixels.shape), pixels.astype(np.int64))
+    assert len(rectangles) <= np.count_nonzero(pixels)
+
+
+def test_identical_runs_coalesce_into_one_rectangle():
+    pixels = np.zeros((6, 8), dtype=bool)
+    pixels[1:5, 2:6] = True
+    assert pixel_rectangles(pixels).tolist() == [[2, 1, 6, 5]]
+
+
+def test_empty_image_has_no_rectangles():
+    rectangles = pixel_rectangles(np.zeros((5, 7), dtype=bool))
+    assert rectangles.shape == (0, 4)
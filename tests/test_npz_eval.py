@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+import pytest
+
+import npz_to_verilog
+
+from npz_eval import pack_bits, unpack_bits, eval_network, eval_levels, first_divergence, arg_max_10, expected_results
+from npz_to_verilog import op
+
+
+def eval_gate(gate_type, a, b):
+    # Evaluates the Verilog expression of the gate, independent of the truth table encoding
+    return eval(op(gate_type, "a", "b").replace("1'b0", "0").replace("1'b1", "1")) & 1
+
+
+def test_pack_unpack_round_trip():
+    rng = np.random.default_rng(0)
+    for count in (1, 63, 64, 65, 200):
+        samples = rng.integers(0, 2, size=(count, 37)).astype(np.uint8)
+        planes = pack_bits(samples)
+        assert planes.dtype == np.uint64
+        assert planes.shape == (37, (count + 63) // 64)
+        assert np.array_equal(unpack_bits(planes, count), samples)
+
+
+def test_eval_network_matches_gate_by_gate_evaluation(random_network):
+    inputs, gates, conn_a, conn_b = random_network([20, 12, 7], inputs=16)
+    samples = np.random.default_rng(1).integers(0, 2, size=(100, inputs))
+
+    out = unpack_bits(eval_network(pack_bits(samples), gates, conn_a, conn_b), len(samples))
+
+    for sample, result in zip(samples, out):
+        x = sample.tolist()
+        for g, a, b in zip(gates, conn_a, conn_b):
+            x = [eval_gate(int(t), x[i], x[j]) for t, i, j in zip(g, a, b)]
+        assert result.tolist() == x
+
+
+def test_eval_network_trace_holds_every_layer(random_network):
+    inputs, gates, conn_a, conn_b = random_network([9, 5], inputs=8)
+    trace = []
+    out = eval_network(pack_bits(np.ones((3, inputs))), gates, conn_a, conn_b, trace)
+    assert [len(t) for t in trace] == [9, 5]
+    assert np.array_equal(trace[-1], out)
+
+
+def test_arg_max_10_last_maximum_wins_ties():
+    sums = np.array([[1, 5, 5, 0], [7, 0, 0, 7], [0, 0, 0, 0]])
+    assert arg_max_10(sums).tolist() == [2, 3, 3]
+
+
+def test_first_divergence_of_matching_levels(random_network):
+    inputs, gates, conn_a, conn_b = random_network([20, 12, 7], inputs=16)
+    samples = np.random.default_rng(2).integers(0, 2, size=(30, inputs))
+    levels = eval_levels(samples, gates, conn_a, conn_b)
+    assert [level.shape for level in levels] == [(30, 16), (30, 20), (30, 12), (30, 7)]
+    assert first_divergence(levels, [level.copy() for level in levels], gates, conn_a, conn_b) is None
+
+
+def test_first_divergence_locates_the_first_broken_net(random_network):
+    inputs, gates, conn_a, conn_b = random_network([20, 12, 7], inputs=16)
+    samples = np.random.default_rng(2).integers(0, 2, size=(30, inputs))
+    expected = eval_levels(samples, gates, conn_a, conn_b)
+    simulated = [level.astype(np.int64) for level in expected]
+    simulated[2][4:, 9] ^= 1
+    simulated[2][5, 10] = 2 # X
+    simulated[3][:, :] ^= 1 # follows from the earlier divergence
+
+    d = first_divergence(expected, simulated, gates, conn_a, conn_b)
+    assert (d["level"], d["net"], d["sample"]) == (2, 9, 4)
+    assert (d["divergent_nets"], d["divergent_samples"]) == (2, 26)
+    assert d["simulated"] == 1 - d["expected"]
+    assert (d["gate_type"], d["conn_a"], d["conn_b"]) == (gates[1][9], conn_a[1][9], conn_b[1][9])
+    assert d["expected_a"] == d["simulated_a"] == expected[1][4, conn_a[1][9]]
+
+
+def test_first_divergence_rejects_other_networks(random_network):
+    inputs, gates, conn_a, conn_b = random_network([20, 12], inputs=16)
+    levels = eval_levels(np.zeros((4, inputs)), gates, conn_a, conn_b)
+    with pytest.raises(ValueError):
+        first_divergence(levels, levels[:2] + [levels[2][:, :10]], gates, conn_a, conn_b)
+
+
+def test_expected_results_follow_the_category_config(tmp_path, monkeypatch):
+    y = np.random.default_rng(3).integers(0, 2, size=(50, 8000))
+    sums = y.reshape(50, 10, 800).sum(axis=-1)
+    categories, values = expected_results(y)
+    assert categories.tolist() == arg_max_10(sums).tolist()
+    assert values.tolist() == (sums[np.arange(50), categories] >> 2).tolist() # top 8 of 10 bits
+    assert expected_results(sums)[0].tolist() == categories.tolist()
+
+    # searched wiring: 300 bits of every category, 1 LSB truncated
+    bits = np.arange(8000).reshape(10, 800)[:, 100:400]
+    with open(tmp_path / "categories.json", "w") as f:
+        json.dump({"bits": bits.tolist(), "truncate_lsb": 1}, f)
+    monkeypatch.setattr(npz_to_verilog, "CATEGORY_CONFIG", str(tmp_path / "categories.json"))
+    sums = y[:, bits].sum(axis=-1) >> 1
+    categories, values = expected_results(y)
+    assert categories.tolist() == arg_max_10(sums).tolist()
+    assert values.tolist() == sums[np.arange(50), categories].tolist() # 9 - 1 bits
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from npz_file import LazyNpz, PackedNpz, save_npy_dir, save_packed_npz, open_network, network_layers
+
+
+@pytest.fixture
+def network():
+    rng = np.random.default_rng(0)
+    return {
+        "gate_types": rng.integers(0, 16, size=(3, 20)),
+        "connections.A": rng.integers(0, 20, size=(3, 20)),
+        "connections.B": rng.integers(0, 20, size=(3, 20)),
+        "weights": np.asfortranarray(rng.random((4, 5), dtype=np.float32)),
+        "empty": np.zeros((0, 8), dtype=np.int32),
+    }
+
+
+@pytest.fixture(params=["npz", "compressed", "dir"])
+def saved(request, tmp_path, network):
+    if request.param == "dir":
+        file_name = str(tmp_path / "net")
+        save_npy_dir(file_name, network)
+    else:
+        file_name = str(tmp_path / "net.npz")
+        (np.savez_compressed if request.param == "compressed" else np.savez)(file_name, **network)
+    return file_name
+
+
+def test_lazy_npz_round_trip(saved, network):
+    data = LazyNpz(saved)
+    assert sorted(data) == sorted(network)
+    assert data.arrays == {} # nothing is read before the first access
+    for key, value in network.items():
+        assert data.shape(key) == value.shape
+        assert data.dtype(key) == value.dtype
+        assert np.array_equal(data[key], value)
+        assert data[key] is data[key]
+
+
+def test_lazy_npz_maps_uncompressed_arrays(saved, network):
+    data = LazyNpz(saved)
+    if saved.endswith(".npz") and data.offsets["gate_types"] is None:
+        pytest.skip("compressed members can not be mapped")
+    assert isinstance(data["gate_types"], np.memmap)
+
+    # copy-on-write, the file is not modified
+    data["gate_types"][0, 0] = 99
+    assert LazyNpz(saved)["gate_types"][0, 0] == network["gate_types"][0, 0]
+
+
+def test_lazy_npz_missing_key(saved):
+    with pytest.raises(KeyError):
+        LazyNpz(saved)["layer_sizes"]
+    assert "layer_sizes" not in LazyNpz(saved)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_packed_npz_round_trip(tmp_path, network, compress):
+    network = dict(network, gate_types=network["gate_types"][:, :19], # odd number of nibbles
+                   dataset_input=np.random.default_rng(1).integers(0, 2, size=(7, 13), dtype=np.uint8))
+    file_name = str(tmp_path / "net.npz")
+    save_packed_npz(file_name, network, compress=compress)
+    data = open_network(file_name)
+
+    assert isinstance(data, PackedNpz)
+    assert sorted(data) == sorted(network)
+    for key, value in network.items():
+        assert data.shape(key) == value.shape
+        assert np.array_equal(data[key], value)
+    assert data.dtype("gate_types") == data["gate_types"].dtype == np.int64
+    assert data["connections.A"].dtype == np.int64
+    assert data["dataset_input"].dtype == np.uint8
+
+
+def test_packed_npz_is_smaller(tmp_path):
+    rng = np.random.default_rng(0)
+    network = {
+        "gate_types": rng.integers(0, 16, size=4000),
+        "connections.A": rng.integers(0, 4000, size=4000),
+        "connections.B": rng.integers(0, 4000, size=4000),
+    }
+    np.savez(tmp_path / "plain.npz", **network)
+    save_packed_npz(str(tmp_path / "packed.npz"), network)
+    with np.load(tmp_path / "packed.npz") as packed:
+        assert packed["connections.A"].dtype == np.uint16
+        assert packed["gate_types.nibbles"].nbytes == 2000
+    assert (tmp_path / "packed.npz").stat().st_size * 3 < (tmp_path / "plain.npz").stat().st_size
+
+
+def test_packed_npz_rejects_unknown_version(tmp_path):
+    np.savez(tmp_path / "net.npz", format_version=np.array(99), gate_types=np.zeros(4))
+    with pytest.raises(ValueError):
+        open_network(str(tmp_path / "net.npz"))
+
+
+def test_network_layers_of_rectangular_network(network):
+    gates, conn_a, conn_b = network_layers(network)
+    assert len(gates) == len(conn_a) == len(conn_b) == 3
+    assert all(np.array_equal(g, row) for g, row in zip(gates, network["gate_types"]))
+
+
+@pytest.mark.parametrize("first_connections", [True, False])
+def test_network_layers_of_ragged_network(tmp_path, first_connections):
+    sizes = [5, 3, 8]
+    gates = np.arange(16)
+    conn = np.arange(16) if first_connections else np.arange(5, 16)
+    np.savez(tmp_path / "net.npz", gate_types=gates, layer_sizes=np.array(sizes),
+             **{"connections.A": conn, "connections.B": conn[::-1]})
+    gates, conn_a, conn_b = network_layers(LazyNpz(str(tmp_path / "net.npz")))
+
+    assert [len(g) for g in gates] == sizes
+    assert [len(a) for a in conn_a] == [len(b) for b in conn_b] == (sizes if first_connections else sizes[1:])
+    assert np.array_equal(conn_a[-1], np.arange(8, 16))
+    assert np.array_equal(np.concatenate(conn_b), conn[::-1])
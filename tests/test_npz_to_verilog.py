@@ -0,0 +1,90 @@
+import re
+
+import numpy as np
+import pytest
+
+import npz_to_verilog
+from npz_to_verilog import generate_verilog, optimize_network, category_bits, emitted_wires
+from npz_eval import pack_bits, unpack_bits, eval_network, classify, eval_levels, expand_emitted, first_divergence
+
+
+def eval_verilog(text, x):
+    # Evaluates the assigns, relays and registers of the emitted net on packed input bitplanes,
+    # returns the packed values of every wire. Registers settle after one pass over the lines per pipeline stage.
+    words = x.shape[1]
+    wires = {"Z": np.zeros(words, dtype=np.uint64), "O": ~np.zeros(words, dtype=np.uint64)}
+    for m in re.finditer(r"(?:wire|reg) +\[(\d+):0\] (\w+)", text):
+        wires[m.group(2)] = np.zeros((int(m.group(1)) + 1, words), dtype=np.uint64)
+    wires["in"] = x
+    expression = lambda e: re.sub(r"\b(far_\w+)", r'W["\1"]',
+                                  re.sub(r"\b(\w+)\[(\d+)\]", r'W["\1"][\2]', e.replace("1'b0", 'W["Z"]').replace("1'b1", 'W["O"]')))
+
+    lines = [line.strip() for line in text.splitlines()]
+    for line in lines * (text.count("always @") + 1):
+        if m := re.fullmatch(r"assign (\w+)\[(\d+)\] = (.*);", line):
+            wires[m.group(1)][int(m.group(2))] = eval(expression(m.group(3)), {"W": wires})
+        elif m := re.fullmatch(r"wire (\w+); +relay_conn \w+\(\.in\((.*)\), \.out\(\w+\)\);", line):
+            wires[m.group(1)] = eval(expression(m.group(2)), {"W": wires})
+        elif m := re.fullmatch(r"always @\(posedge clk\) (layer_\d+) <= (\w+);", line):
+            wires[m.group(1)][:] = wires[m.group(2)]
+    return wires
+
+
+@pytest.mark.parametrize("stages", [0, 1, 2])
+@pytest.mark.parametrize("relay", [False, 8])
+@pytest.mark.parametrize("collapse", [False, True])
+def test_emitted_verilog_matches_simulator(random_network, monkeypatch, capsys, stages, relay, collapse):
+    monkeypatch.setattr(npz_to_verilog, "PIPELINE_EVERY_N_LAYERS", stages)
+    monkeypatch.setattr(npz_to_verilog, "RELAY_LONG_CONNECTIONS", relay)
+    monkeypatch.setattr(npz_to_verilog, "COLLAPSE_PASS_THROUGH_GATES", collapse)
+    for name in ["ELIMINATE_DEAD_GATES", "MERGE_DUPLICATE_GATES", "REORDER_GATES_FOR_WIRE_LENGTH"]:
+        monkeypatch.setattr(npz_to_verilog, name, False)
+
+    inputs, gates, conn_a, conn_b = random_network([50, 40, 30, 60, 40], inputs=64, gate_types=[3, 5, 10, 12, 1, 6, 0, 15], seed=stages)
+    if collapse:
+        gates, conn_a, conn_b = optimize_network(gates, conn_a, conn_b)
+    text = generate_verilog(inputs, gates, conn_a, conn_b, number_of_categories=0)
+
+    x = pack_bits(np.random.default_rng(1).integers(0, 2, size=(256, inputs)))
+    assert np.array_equal(eval_verilog(text, x)["out"], eval_network(x, gates, conn_a, conn_b))
+    if collapse and stages != 1: # registered layers keep their buffers
+        assert text.count("assign layer_") < sum(len(g) for g in gates[:-1])
+
+
+def test_category_settings_follow_run_time_changes(monkeypatch):
+    out = pack_bits(np.ones((3, 40), dtype=np.uint8))
+    assert category_bits(40).shape == (10, 800)
+    assert classify(out, 3)[0][0].tolist() == [40] + [0] * 9
+
+    # npz_sweep.py sets the module globals, every default has to follow
+    monkeypatch.setattr(npz_to_verilog, "OUTPUT_BITS_PER_CATEGORY", 3)
+    assert category_bits(40).shape == (10, 3)
+    assert classify(out, 3)[0][0].tolist() == [3] * 10
+    assert "output wire [29:0] categories" in generate_verilog(8, [np.zeros(40, dtype=np.int64)], [np.zeros(40, dtype=np.int64)], [np.zeros(40, dtype=np.int64)])
+
+
+@pytest.mark.parametrize("stages", [0, 2])
+def test_trace_of_collapsed_network(random_network, monkeypatch, capsys, stages):
+    # Same steps as test_lgn_trace in chip_top_tb.py, with the emitted net evaluated instead of simulated
+    monkeypatch.setattr(npz_to_verilog, "PIPELINE_EVERY_N_LAYERS", stages)
+    monkeypatch.setattr(npz_to_verilog, "COLLAPSE_PASS_THROUGH_GATES", True)
+    inputs, gates, conn_a, conn_b = random_network([50, 40, 30, 60, 40], inputs=64, gate_types=[3, 5, 10, 12, 1, 6, 0, 15], seed=7)
+    gates, conn_a, conn_b = optimize_network(gates, conn_a, conn_b)
+    text = generate_verilog(inputs, gates, conn_a, conn_b, number_of_categories=0)
+
+    samples = np.random.default_rng(1).integers(0, 2, size=(100, inputs))
+    wires = eval_verilog(text, pack_bits(samples))
+    simulated = [samples.astype(np.uint8)] + [unpack_bits(wires[f"layer_{l}"], len(samples)) for l in range(len(gates) - 1)] + \
+                [unpack_bits(wires["out"], len(samples))]
+    expected = eval_levels(samples, gates, conn_a, conn_b)
+    emitted = emitted_wires(inputs, gates, conn_a, conn_b)
+
+    assert [s.shape[-1] for s in simulated] == [np.count_nonzero(mask) for mask in emitted]
+    assert sum(s.shape[-1] for s in simulated) < sum(e.shape[-1] for e in expected)
+    with pytest.raises(ValueError):
+        first_divergence(expected, simulated, gates, conn_a, conn_b)
+    assert first_divergence(expected, expand_emitted(simulated, emitted, gates, conn_a, conn_b), gates, conn_a, conn_b) is None
+
+    # a broken wire behind a collapsed buffer is still found at its own level
+    simulated[2][:, 0] ^= 1
+    assert first_divergence(expected, expand_emitted(simulated, emitted, gates, conn_a, conn_b), gates, conn_a, conn_b)["level"] == 2
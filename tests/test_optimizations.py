@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import npz_to_verilog
+from npz_to_verilog import fold_constants, eliminate_dead_gates, optimize_network, GATE_TRUTH_TABLE
+from npz_eval import pack_bits, eval_network, verify_equivalence
+
+PASSES = ["ELIMINATE_DEAD_GATES", "COLLAPSE_PASS_THROUGH_GATES", "MERGE_DUPLICATE_GATES", "REORDER_GATES_FOR_WIRE_LENGTH"]
+
+
+@pytest.fixture
+def only(monkeypatch):
+    # Enables the given optimization passes and disables the rest
+    def enable(*passes):
+        for name in PASSES:
+            monkeypatch.setattr(npz_to_verilog, name, name in passes)
+    return enable
+
+
+def random_inputs(inputs, samples=512, seed=1):
+    return pack_bits(np.random.default_rng(seed).integers(0, 2, size=(samples, inputs)))
+
+
+def test_gate_truth_table_matches_gate_templates():
+    for g in range(16):
+        for a in (0, 1):
+            for b in (0, 1):
+                expression = npz_to_verilog.op(g, "a", "b").replace("1'b0", "0").replace("1'b1", "1")
+                assert GATE_TRUTH_TABLE[g, a, b] == eval(expression) & 1
+
+
+def test_fold_constants_preserves_outputs(random_network):
+    inputs, gates, conn_a, conn_b = random_network([40, 30, 20], gate_types=[0, 15, 1, 6, 7, 14], seed=2)
+    folded = fold_constants(gates, conn_a, conn_b)
+    x = random_inputs(inputs)
+    assert np.array_equal(eval_network(x, gates, conn_a, conn_b), eval_network(x, folded, conn_a, conn_b))
+
+
+@pytest.mark.parametrize("keep_output_positions", [False, True])
+def test_eliminate_dead_gates_keeps_live_outputs(random_network, keep_output_positions):
+    inputs, gates, conn_a, conn_b = random_network([50, 40, 30], seed=3)
+    live = np.arange(0, 30, 3)
+    new_gates, new_conn_a, new_conn_b = eliminate_dead_gates(gates, conn_a, conn_b, live, keep_output_positions)
+
+    assert sum(len(g) for g in new_gates[:-1]) < sum(len(g) for g in gates[:-1])
+    x = random_inputs(inputs)
+    before = eval_network(x, gates, conn_a, conn_b)
+    after = eval_network(x, new_gates, new_conn_a, new_conn_b)
+    assert np.array_equal(before[live], after[live])
+    assert len(after) == (30 if keep_output_positions else live[-1] + 1)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_dead_gate_elimination_is_equivalent_on_categories(random_network, only, monkeypatch, seed):
+    only("ELIMINATE_DEAD_GATES")
+    monkeypatch.setattr(npz_to_verilog, "OUTPUT_BITS_PER_CATEGORY", 2) # 20 of the 30 outputs are live
+    inputs, gates, conn_a, conn_b = random_network([60, 45, 30], seed=seed)
+    optimized = optimize_network(gates, conn_a, conn_b)
+    verify_equivalence(inputs, (gates, conn_a, conn_b), optimized)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_collapse_pass_through_gates_is_equivalent(random_network, only, seed):
+    only("COLLAPSE_PASS_THROUGH_GATES")
+    inputs, gates, conn_a, conn_b = random_network([50, 40, 30, 20], gate_types=[3, 5, 10, 12, 1, 6, 0, 15], seed=seed)
+    collapsed = optimize_network(gates, conn_a, conn_b)
+
+    # all inverters of the hidden layers are absorbed into their readers
+    assert not any(np.isin(g, [10, 12]).any() for g in collapsed[0][:-1])
+    verify_equivalence(inputs, (gates, conn_a, conn_b), collapsed)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_merge_duplicate_gates_is_equivalent(random_network, only, seed):
+    only("MERGE_DUPLICATE_GATES")
+    inputs, gates, conn_a, conn_b = random_network([60, 40, 30], seed=seed)
+    # copies of the first 10 gates, half of them with swapped operands and the mirrored gate type
+    t = GATE_TRUTH_TABLE[gates[0][:10]]
+    swapped = npz_to_verilog.gate_type_from_truth_table(t[:, 0, 0], t[:, 1, 0], t[:, 0, 1], t[:, 1, 1])
+    gates[0][20:30] = np.where(np.arange(10) % 2, swapped, gates[0][:10])
+    conn_a[0][20:30] = np.where(np.arange(10) % 2, conn_b[0][:10], conn_a[0][:10])
+    conn_b[0][20:30] = np.where(np.arange(10) % 2, conn_a[0][:10], conn_b[0][:10])
+
+    merged = optimize_network(gates, conn_a, conn_b)
+    assert len(merged[0][0]) <= len(gates[0]) - 10
+    verify_equivalence(inputs, (gates, conn_a, conn_b), merged)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_reorder_gates_for_wire_length_is_equivalent(random_network, only, seed):
+    only("REORDER_GATES_FOR_WIRE_LENGTH")
+    inputs, gates, conn_a, conn_b = random_network([80, 60, 40], seed=seed)
+    reordered = optimize_network(gates, conn_a, conn_b)
+    verify_equivalence(inputs, (gates, conn_a, conn_b), reordered)
+
+    # output layer keeps its order, wires between the hidden layers never get longer
+    assert np.array_equal(gates[-1], reordered[0][-1])
+    for l in range(1, len(gates)):
+        n = len(gates[l-1])
+        before = npz_to_verilog.get_conn_distance(conn_a[l], conn_b[l], n)
+        after = npz_to_verilog.get_conn_distance(reordered[1][l], reordered[2][l], n)
+        assert np.sum(after) <= np.sum(before) and np.max(after) <= np.max(before)
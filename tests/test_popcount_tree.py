@@ -0,0 +1,53 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from popcount_tree import popcount_netlist, popcount_module, sum_width
+
+
+def eval_popcount(n, y):
+    # Evaluates the adders of popcount_netlist(n) on rows of y, returns the result as integers
+    adders, outputs = popcount_netlist(n)
+    wires = {f"y[{i}]": y[:, i] for i in range(n)}
+    wires["1'b0"] = np.zeros(len(y), dtype=np.int64)
+    for cell, inputs, s, c in adders:
+        assert cell == ("popcount_fa" if len(inputs) == 3 else "popcount_ha")
+        total = sum(wires[i] for i in inputs)
+        wires[s], wires[c] = total & 1, total >> 1
+
+    result = np.zeros(len(y), dtype=np.int64)
+    for bit, wire in enumerate(outputs):
+        if wire.startswith("^{"):
+            value = sum(wires[w] for w in wire[2:-1].split(", ")) & 1
+        else:
+            value = wires[wire]
+        result |= value << bit
+    return result
+
+
+def test_sum_width():
+    assert [sum_width(n) for n in [1, 2, 3, 4, 5, 8, 9, 800]] == [1, 1, 2, 2, 3, 3, 4, 10]
+
+
+@pytest.mark.parametrize("n", range(1, 13))
+def test_popcount_is_exact_for_all_inputs(n):
+    y = np.array(list(itertools.product([0, 1], repeat=n)), dtype=np.int64)
+    assert np.array_equal(eval_popcount(n, y), y.sum(axis=1) % 2**sum_width(n))
+
+
+@pytest.mark.parametrize("n", [16, 33, 100, 255, 256, 257, 800])
+def test_popcount_of_random_inputs(n):
+    rng = np.random.default_rng(n)
+    density = rng.random((512, 1))
+    y = (rng.random((512, n)) < density).astype(np.int64)
+    y[0], y[1] = 0, 1
+    assert np.array_equal(eval_popcount(n, y), y.sum(axis=1) % 2**sum_width(n))
+
+
+def test_popcount_module_instantiates_every_adder():
+    adders, outputs = popcount_netlist(100)
+    verilog = popcount_module(100)
+    assert "module popcount_100 (" in verilog
+    assert verilog.count("popcount_fa add") + verilog.count("popcount_ha add") == len(adders)
+    assert verilog.count("assign sum[") == len(outputs) == sum_width(100)